@@ -8,11 +8,19 @@ from pioreactor.actions import od_blank
 from pioreactor.actions import system_check
 from pioreactor.actions.leader import export_experiment_data
 from pioreactor.actions.leader import backup_database
+from pioreactor.actions.leader import migrate_database
+from pioreactor.actions.leader import backfill_rollups
+from pioreactor.actions.leader import query_time_series
+from pioreactor.actions.leader import archive_experiment
 
 
 __all__ = (
     "export_experiment_data",
     "backup_database",
+    "migrate_database",
+    "backfill_rollups",
+    "query_time_series",
+    "archive_experiment",
     "od_normalization",
     "remove_waste",
     "add_media",
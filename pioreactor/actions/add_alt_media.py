@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import time
-from json import loads, dumps
+from json import loads
 from configparser import NoOptionError
 import click
 
@@ -8,6 +8,7 @@ from pioreactor.utils import pump_ml_to_duration, pump_duration_to_ml
 from pioreactor.whoami import get_unit_name, get_latest_experiment_name
 from pioreactor.config import config
 from pioreactor.pubsub import publish, QOS
+from pioreactor import structs
 from pioreactor.hardware_mappings import PWM_TO_PIN
 from pioreactor.logging import create_logger
 from pioreactor.utils.pwm import PWM
@@ -62,13 +63,12 @@ def add_alt_media(
     assert duration >= 0
     publish(
         f"pioreactor/{unit}/{experiment}/dosing_events",
-        dumps(
-            {
-                "volume_change": ml,
-                "event": "add_alt_media",
-                "source_of_event": source_of_event,
-                "timestamp": current_utc_time(),
-            }
+        structs.DosingEvent(
+            volume_change=ml,
+            event="add_alt_media",
+            source_of_event=source_of_event,
+            timestamp=current_utc_time(),
+            source="add_alt_media",
         ),
         qos=QOS.EXACTLY_ONCE,
     )
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import time
-from json import loads, dumps
+from json import loads
 import click
 from configparser import NoOptionError
 
@@ -9,6 +9,7 @@ from pioreactor.utils import pump_ml_to_duration, pump_duration_to_ml
 from pioreactor.whoami import get_unit_name, get_latest_experiment_name
 from pioreactor.config import config
 from pioreactor.pubsub import publish, QOS
+from pioreactor import structs
 from pioreactor.hardware_mappings import PWM_TO_PIN
 from pioreactor.logging import create_logger
 from pioreactor.utils.pwm import PWM
@@ -72,16 +73,17 @@ def add_media(
     assert duration >= 0
 
     # publish this first, as downstream jobs need to know about it.
-    json_output = dumps(
-        {
-            "volume_change": ml,
-            "event": "add_media",
-            "source_of_event": source_of_event,
-            "timestamp": current_utc_time(),
-        }
+    dosing_event = structs.DosingEvent(
+        volume_change=ml,
+        event="add_media",
+        source_of_event=source_of_event,
+        timestamp=current_utc_time(),
+        source="add_media",
     )
     publish(
-        f"pioreactor/{unit}/{experiment}/dosing_events", json_output, qos=QOS.EXACTLY_ONCE
+        f"pioreactor/{unit}/{experiment}/dosing_events",
+        dosing_event,
+        qos=QOS.EXACTLY_ONCE,
     )
 
     MEDIA_PIN = PWM_TO_PIN[config.getint("PWM_reverse", "media")]
@@ -98,7 +100,7 @@ def add_media(
             while True:
                 publish(
                     f"pioreactor/{unit}/{experiment}/dosing_events",
-                    json_output,
+                    dosing_event,
                     qos=QOS.EXACTLY_ONCE,
                 )
                 time.sleep(duration)
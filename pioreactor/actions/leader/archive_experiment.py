@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Move a finished experiment's rows out of the database and into compressed, columnar (Parquet) files.
+
+    <archive_directory>/<experiment>/
+        manifest.json
+        <table>/pioreactor_unit=<unit>/part-0.parquet
+
+The manifest records, for each table, its columns and, for each unit, the file(s), their number of rows and the
+highest rowid they cover. Only rows up to that rowid, recorded before exporting, are archived: rows that arrive while
+archiving stay in the database (archive again to move them). Once the files are written and verified, those rows are
+deleted from the database and freed pages are returned with an incremental vacuum. Logs are archived from their own
+database (see pioreactor.utils.log_store); rows left in the main database's old logs table are not.
+`export_experiment_data` reads from the archive when the rows are no longer in the database.
+
+Requires pyarrow (in requirements/requirements_leader.txt): `pip3 install pyarrow`
+"""
+import os
+import json
+import click
+
+from pioreactor.config import config
+from pioreactor.logging import create_logger
+from pioreactor.utils.timing import current_utc_time
+from pioreactor.utils.log_store import get_log_database
+
+# tables with an `experiment` column that are _not_ archived: small, and needed by the UI.
+NOT_ARCHIVED = ["experiments"]
+
+DELETE_CHUNK_SIZE = 10_000
+FETCH_SIZE = 10_000
+
+SQLITE_TO_ARROW_TYPES = {
+    "TEXT": "string",
+    "REAL": "float64",
+    "INTEGER": "int64",
+    "BLOB": "binary",
+}
+
+
+def get_archive_directory(experiment):
+    archive_directory = config.get(
+        "storage", "archive_directory", fallback="/home/pi/.pioreactor/archive"
+    )
+    return os.path.join(archive_directory, experiment.replace(os.sep, "_"))
+
+
+def read_manifest(experiment):
+    try:
+        with open(os.path.join(get_archive_directory(experiment), "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_archived(experiment, table):
+    manifest = read_manifest(experiment)
+    return (manifest is not None) and (table in manifest["tables"])
+
+
+def tables_to_archive(cursor):
+    tables = [
+        table
+        for (table,) in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
+        )
+    ]
+    return [
+        table
+        for table in tables
+        if (table not in NOT_ARCHIVED)
+        and ("_rollup_" not in table)  # rollups are small, and keep the charts working.
+        and (table != "logs")  # archived from the log database, see archive_experiment.
+        and ("experiment" in get_columns(cursor, table))
+        and ("pioreactor_unit" in get_columns(cursor, table))
+    ]
+
+
+def get_columns(cursor, table):
+    # (name, declared type)
+    return {
+        row[1]: row[2].upper() for row in cursor.execute(f"PRAGMA table_info({table})")
+    }
+
+
+def arrow_schema(cursor, table):
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            (column, getattr(pa, SQLITE_TO_ARROW_TYPES.get(type_, "string"))())
+            for column, type_ in get_columns(cursor, table).items()
+        ]
+    )
+
+
+def load_archived_table(
+    connection, experiment, table, columns=None, units=(), filters=()
+):
+    """
+    Load the archived rows of `table` into a TEMP table, `archived_<table>`, with `columns` (name -> declared type,
+    default: the archived columns; those the archive doesn't have are NULL), and return its name. Only the rows of
+    `units` (if any) that match `filters`, a list of (column, ">=" or "<", value), are read from the Parquet files.
+    Rows where the column is NULL are read too.
+    """
+    import pyarrow.dataset as ds
+
+    manifest = read_manifest(experiment)
+    archived_columns = manifest["tables"][table]["columns"]
+    columns = columns or archived_columns
+    read_columns = [c for c in columns if c in archived_columns]
+    archive_directory = get_archive_directory(experiment)
+
+    expression = None
+    for column, op, value in filters:
+        if column not in archived_columns:
+            continue
+        condition = (
+            (ds.field(column) >= value) if op == ">=" else (ds.field(column) < value)
+        ) | ds.field(column).is_null()
+        expression = condition if expression is None else (expression & condition)
+
+    archived_table = f"archived_{table}"
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS temp.{archived_table}")
+    cursor.execute(
+        f"CREATE TEMP TABLE {archived_table} ({', '.join(f'{c} {t}' for c, t in columns.items())})"
+    )
+
+    insert = f"INSERT INTO temp.{archived_table} ({', '.join(read_columns)}) VALUES ({', '.join(['?'] * len(read_columns))})"
+    for unit, parts in manifest["tables"][table]["units"].items():
+        if units and (unit not in units):
+            continue
+        for part in parts:
+            dataset = ds.dataset(
+                os.path.join(archive_directory, part["path"]), format="parquet"
+            )
+            for batch in dataset.to_batches(
+                columns=read_columns, filter=expression, batch_size=FETCH_SIZE
+            ):
+                cursor.executemany(insert, zip(*(c.to_pylist() for c in batch.columns)))
+
+    return archived_table
+
+
+def archive_table(con, experiment, table, manifest, logger):
+    """
+    Export `table`'s rows of `experiment` to Parquet, record them in `manifest` (and write it), then delete them.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cursor = con.cursor()
+    archive_directory = get_archive_directory(experiment)
+    columns = get_columns(cursor, table)
+    schema = arrow_schema(cursor, table)
+
+    # rows can still arrive while we archive (ex: a late edge store sync): export and delete only up to here.
+    (max_rowid,) = cursor.execute(
+        f"SELECT MAX(rowid) FROM {table} WHERE experiment = ?", (experiment,)
+    ).fetchone()
+    if max_rowid is None:
+        return
+
+    units = [
+        unit
+        for (unit,) in cursor.execute(
+            f"SELECT DISTINCT pioreactor_unit FROM {table} WHERE experiment = ? AND rowid <= ?",
+            (experiment, max_rowid),
+        )
+    ]
+
+    table_manifest = manifest["tables"].setdefault(
+        table, {"columns": columns, "units": {}}
+    )
+    order_by = "ORDER BY timestamp" if "timestamp" in columns else ""
+
+    # the rowids written to Parquet: only those are deleted.
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS archived_rowids (id INTEGER PRIMARY KEY)"
+    )
+    cursor.execute("DELETE FROM temp.archived_rowids")
+    con.commit()
+    insert_cursor = con.cursor()
+
+    for unit in units:
+        # archiving an experiment again (ex: rows arrived after it was archived) adds a new part.
+        # json has no null keys, so rows without a unit are under "null".
+        parts = table_manifest["units"].setdefault(
+            unit if unit is not None else "null", []
+        )
+        path = os.path.join(
+            table, f"pioreactor_unit={unit}", f"part-{len(parts)}.parquet"
+        )
+        os.makedirs(os.path.join(archive_directory, os.path.dirname(path)), exist_ok=True)
+
+        query = cursor.execute(
+            f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE experiment = ? AND pioreactor_unit IS ? AND rowid <= ? {order_by}",
+            (experiment, unit, max_rowid),
+        )
+        n_rows = 0
+        with pq.ParquetWriter(
+            os.path.join(archive_directory, path), schema, compression="zstd"
+        ) as writer:
+            while True:
+                rows = query.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                rowids, *values = zip(*rows)
+                writer.write_batch(
+                    pa.record_batch([list(c) for c in values], schema=schema)
+                )
+                insert_cursor.executemany(
+                    "INSERT INTO temp.archived_rowids (id) VALUES (?)",
+                    ((rowid,) for rowid in rowids),
+                )
+                n_rows += len(rows)
+
+        # verify before we delete anything.
+        if (
+            pq.ParquetFile(os.path.join(archive_directory, path)).metadata.num_rows
+            != n_rows
+        ):
+            raise IOError(f"Archive of {table} for {unit} is incomplete. Aborting.")
+
+        parts.append({"path": path, "rows": n_rows, "max_rowid": max_rowid})
+        con.commit()  # the rowids, and end the read transaction
+
+    manifest["archived_at"] = current_utc_time()
+    with open(os.path.join(archive_directory, "manifest.json.tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(
+        os.path.join(archive_directory, "manifest.json.tmp"),
+        os.path.join(archive_directory, "manifest.json"),
+    )
+
+    # delete in chunks, so we don't hold the write lock (and block the streamer) for long.
+    n_deleted, last_rowid = 0, 0
+    while True:
+        (chunk_end,) = cursor.execute(
+            "SELECT MAX(id) FROM (SELECT id FROM temp.archived_rowids WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_rowid, DELETE_CHUNK_SIZE),
+        ).fetchone()
+        if chunk_end is None:
+            break
+        cursor.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT id FROM temp.archived_rowids WHERE id > ? AND id <= ?)",
+            (last_rowid, chunk_end),
+        )
+        con.commit()
+        n_deleted += cursor.rowcount
+        last_rowid = chunk_end
+
+    logger.debug(f"Archived and deleted {n_deleted} rows from {table}.")
+
+
+def archive_experiment(experiment, force=False, full_vacuum=False):
+    import sqlite3
+
+    logger = create_logger("archive_experiment")
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.error("pyarrow is required to archive experiments: `pip3 install pyarrow`")
+        raise
+
+    con = sqlite3.connect(config["storage"]["database"], timeout=30)
+    cursor = con.cursor()
+
+    latest_experiment = cursor.execute(
+        "SELECT experiment FROM experiments ORDER BY timestamp DESC LIMIT 1"
+    ).fetchone()
+    if (
+        (latest_experiment is not None)
+        and latest_experiment[0] == experiment
+        and not force
+    ):
+        logger.error(
+            f"{experiment} is the current experiment. Use --force to archive it anyways."
+        )
+        raise ValueError(f"{experiment} is the current experiment.")
+
+    archive_directory = get_archive_directory(experiment)
+    manifest = read_manifest(experiment) or {
+        "experiment": experiment,
+        "format": "parquet",
+        "compression": "zstd",
+        "tables": {},
+    }
+
+    logger.info(f"Archiving experiment {experiment} to {archive_directory}.")
+
+    for table in tables_to_archive(cursor):
+        archive_table(con, experiment, table, manifest, logger)
+
+    # logs are in their own database, see pioreactor.utils.log_store
+    if os.path.exists(get_log_database()):
+        log_con = sqlite3.connect(get_log_database(), timeout=30)
+        if "experiment" in get_columns(log_con.cursor(), "logs"):
+            archive_table(log_con, experiment, "logs", manifest, logger)
+        log_con.close()
+
+    auto_vacuum = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if full_vacuum:
+        logger.info("Running a full VACUUM. This may take a while.")
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    elif auto_vacuum == 2:  # INCREMENTAL
+        cursor.execute("PRAGMA incremental_vacuum")
+    else:
+        logger.info(
+            "Database isn't set up for incremental vacuums, so its file size won't shrink. Run once with --full-vacuum to enable them."
+        )
+
+    con.close()
+    logger.info(f"Completed archive of experiment {experiment}.")
+
+
+@click.command(name="archive_experiment")
+@click.option("--experiment", required=True)
+@click.option("--force", is_flag=True, help="archive even if it's the current experiment")
+@click.option(
+    "--full-vacuum",
+    is_flag=True,
+    help="run a full VACUUM afterwards (slow), and enable incremental vacuums from now on",
+)
+def click_archive_experiment(experiment, force, full_vacuum):
+    """
+    (leader only) Move an experiment's data out of the database and into Parquet files.
+    """
+    archive_experiment(experiment, force=force, full_vacuum=full_vacuum)
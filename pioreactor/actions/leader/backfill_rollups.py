@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import click
+
+from pioreactor.config import config
+from pioreactor.logging import create_logger
+from pioreactor.utils.rollups import ROLLUP_SOURCES, BUCKETS, rollup_table, backfill_sql
+
+
+def backfill_rollups(experiments=None):
+    """
+    (Re)compute the rollup tables from the raw tables for the given experiments, or all experiments if None.
+    Rollups are otherwise kept up to date by mqtt_to_db_streaming, so this is only needed for data
+    that was written before the rollups existed.
+    """
+    import sqlite3
+
+    logger = create_logger("backfill_rollups")
+
+    connection = sqlite3.connect(config["storage"]["database"], timeout=30)
+    cursor = connection.cursor()
+
+    if not experiments:
+        experiments = [
+            experiment
+            for (experiment,) in cursor.execute("SELECT experiment FROM experiments")
+        ]
+
+    for experiment in experiments:
+        for table in ROLLUP_SOURCES:
+            for bucket in BUCKETS:
+                # one transaction per (experiment, table, bucket) so we don't hold the write lock for long
+                with connection:
+                    cursor.execute(
+                        f"DELETE FROM {rollup_table(table, bucket)} WHERE experiment = ?",
+                        (experiment,),
+                    )
+                    cursor.execute(backfill_sql(table, bucket), (experiment,))
+        logger.info(f"Backfilled rollups for experiment {experiment}.")
+
+    connection.close()
+
+
+@click.command(name="backfill_rollups")
+@click.option(
+    "--experiment",
+    multiple=True,
+    help="experiment(s) to backfill. Default is all experiments.",
+)
+def click_backfill_rollups(experiment):
+    """
+    (leader only) Compute the downsampled rollup tables from the raw tables.
+    """
+    backfill_rollups(list(experiment))
@@ -5,52 +5,92 @@ import click
 from pioreactor.config import config, get_active_workers_in_inventory
 from pioreactor.whoami import get_unit_name
 from pioreactor.logging import create_logger
+from pioreactor.utils import is_pio_job_running
 from pioreactor.utils.timing import current_utc_time
 
 
 LAST_BACKUP_TIMESTAMP_PATH = "/home/pi/.pioreactor/.last_backup_time"
 
 
-def backup_database(output, force):
+def get_backup_settings(throttle):
+    """
+    (pages copied per step, seconds to pause between steps, rsync bandwidth limit in KB/s)
+    """
+    pages_per_step = config.getint("backup_database", "pages_per_step", fallback=1000)
+    pause_between_steps = config.getfloat(
+        "backup_database", "pause_between_steps", fallback=0.05
+    )
+    bwlimit = config.getint("backup_database", "bwlimit_kbps", fallback=2000)
+
+    if throttle:
+        return (
+            max(pages_per_step // 10, 1),
+            pause_between_steps * 10,
+            max(bwlimit // 4, 1),
+        )
+    return pages_per_step, pause_between_steps, bwlimit
+
+
+def backup_database(output, force=False):
     """
     This action will create a backup of the SQLite3 database into specified output. It then
     will try to copy the backup to any available worker Pioreactors as a further backup.
 
     This job actually consumes a lot of power, and I've seen the LED output
-    drop due to this running. See issue #81. For now, we will skip the backup if `od_reading` is running
+    drop due to this running. See issue #81. So the database is copied in small steps, with pauses
+    in between, and the copies to workers are bandwidth limited. If `od_reading` is running, all of these
+    are throttled further, unless `force` is set.
+
+    The backup is of a single snapshot of the database: we hold a read transaction open on it for the
+    duration. In WAL mode, that doesn't block the writers, and stops the backup from restarting
+    whenever the database changes between steps. The copies to workers use rsync's delta transfer,
+    so only the pages that changed since the last backup are sent.
 
     Elsewhere, a cronjob is set up as well to run this action every N days.
 
     """
 
     import sqlite3
-    from sh import rsync, ErrorReturnCode
 
     logger = create_logger("backup_database")
 
     # let's check to see how old the last backup is and alert the user if too old.
     if os.path.isfile(LAST_BACKUP_TIMESTAMP_PATH):
         with open(LAST_BACKUP_TIMESTAMP_PATH, "r") as f:
-            latest_backup_at = datetime.datetime.strptime(
-                f.read(), "%Y-%m-%dT%H:%M:%S.%f"
-            )
+            latest_backup_at = datetime.strptime(f.read(), "%Y-%m-%dT%H:%M:%S.%f")
 
         if (datetime.utcnow() - latest_backup_at).days > 30:
             logger.warning("Database hasn't been backed up in over 30 days. Running now.")
 
+    throttle = (not force) and is_pio_job_running("od_reading")
+    pages_per_step, pause_between_steps, bwlimit = get_backup_settings(throttle)
+    if throttle:
+        logger.debug("od_reading is running, so the backup is throttled.")
+
+    last_reported = [0.0]
+
     def progress(status, remaining, total):
-        logger.debug(f"Copied {total-remaining} of {total} SQLite3 pages.")
-        logger.debug(f"Writing to local backup {output}.")
+        # there are many small steps, so only report every 10%.
+        if (total - remaining) / total - last_reported[0] >= 0.1 or remaining == 0:
+            last_reported[0] = (total - remaining) / total
+            logger.debug(f"Copied {total-remaining} of {total} SQLite3 pages.")
 
     logger.debug(f"Starting backup of database to {output}")
     time.sleep(1)  # pause a second so the log entry above gets recorded into the DB.
 
-    con = sqlite3.connect(config.get("storage", "database"))
+    con = sqlite3.connect(config.get("storage", "database"), isolation_level=None)
     bck = sqlite3.connect(output)
 
+    # hold a read transaction (snapshot) for the whole backup.
+    con.execute("BEGIN")
+    con.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
     with bck:
-        con.backup(bck, pages=-1, progress=progress)
+        con.backup(
+            bck, pages=pages_per_step, progress=progress, sleep=pause_between_steps
+        )
 
+    con.execute("COMMIT")
     bck.close()
     con.close()
 
@@ -59,32 +99,67 @@ def backup_database(output, force):
 
     logger.info("Completed backup of database.")
 
-    n_backups = 2
+    available_workers = [
+        unit for unit in get_active_workers_in_inventory() if unit != get_unit_name()
+    ]
+    copy_to_workers(output, available_workers, bwlimit, logger)
+
+    return
+
+
+def copy_to_workers(output, workers, bwlimit, logger, n_backups=2):
+    """
+    Copy the backup to `n_backups` of `workers`, in parallel. If a copy fails, the next worker in line is tried.
+    Returns the number of copies made.
+    """
+    from sh import rsync, ErrorReturnCode
+
     backups_complete = 0
-    available_workers = get_active_workers_in_inventory()
+    available_workers = list(workers)
 
     while (backups_complete < n_backups) and (len(available_workers) > 0):
-        backup_unit = available_workers.pop()
-        if backup_unit == get_unit_name():
-            continue
-
-        try:
-            rsync("-hz", "--partial", "--inplace", output, f"{backup_unit}:{output}")
-        except ErrorReturnCode:
-            logger.debug(
-                f"Unable to backup database to {backup_unit}. Is it online?",
-                exc_info=True,
+        # copy to as many workers as we still need, in parallel.
+        backup_units = available_workers[: n_backups - backups_complete]
+        available_workers = available_workers[n_backups - backups_complete :]
+
+        transfers = {
+            backup_unit: rsync(
+                "-hz",
+                "--partial",
+                "--inplace",
+                f"--bwlimit={bwlimit}",
+                output,
+                f"{backup_unit}:{output}",
+                _bg=True,
             )
-            logger.warning(f"Unable to backup database to {backup_unit}. Is it online?")
-        else:
-            logger.debug(f"Backed up database to {backup_unit}:{output}.")
-            backups_complete += 1
-
-    return
+            for backup_unit in backup_units
+        }
+
+        for backup_unit, transfer in transfers.items():
+            try:
+                transfer.wait()
+            except ErrorReturnCode:
+                logger.debug(
+                    f"Unable to backup database to {backup_unit}. Is it online?",
+                    exc_info=True,
+                )
+                logger.warning(
+                    f"Unable to backup database to {backup_unit}. Is it online?"
+                )
+            else:
+                logger.debug(f"Backed up database to {backup_unit}:{output}.")
+                backups_complete += 1
+
+    return backups_complete
 
 
 @click.command(name="backup_database")
 @click.option("--output", default="/home/pi/.pioreactor/pioreactor.sqlite.backup")
+@click.option(
+    "--force",
+    is_flag=True,
+    help="don't throttle the backup, even if od_reading is running",
+)
 def click_backup_database(output, force):
     """
     (leader only) Backup db to workers.
@@ -2,12 +2,23 @@
 # export experiment data
 # See create_tables.sql for all tables
 
-import os
+import json
 from datetime import datetime
 
 import click
 from pioreactor.config import config
 from pioreactor.logging import create_logger
+from pioreactor.actions.leader.archive_experiment import (
+    is_archived,
+    load_archived_table,
+    get_columns,
+    SQLITE_TO_ARROW_TYPES,
+)
+from pioreactor.utils.log_store import get_log_database
+
+FETCH_SIZE = 10_000
+
+FORMATS = {"csv": "dump.csv", "parquet": "parquet", "arrow": "arrow"}
 
 
 def exists_table(cursor, table_name_to_check):
@@ -15,6 +26,11 @@ def exists_table(cursor, table_name_to_check):
     return cursor.execute(query, (table_name_to_check,)).fetchone() is not None
 
 
+def get_database(table_name):
+    # logs are in their own database, see pioreactor.utils.log_store
+    return get_log_database() if table_name == "logs" else config["storage"]["database"]
+
+
 def get_column_names(cursor, table_name):
     query = "PRAGMA table_info(%s)" % table_name
     return [row[1] for row in cursor.execute(query).fetchall()]
@@ -25,9 +41,9 @@ def filter_to_timestamp_columns(column_names):
     return [c for c in column_names if (c == "timestamp") or c.endswith("_at")]
 
 
-def generate_timestamp_to_localtimestamp_clause(cursor, table_name):
+def generate_timestamp_to_localtimestamp_clause(cursor, table_name, columns=None):
     # TODO: this assumes a timestamp column exists?
-    columns = get_column_names(cursor, table_name)
+    columns = columns or get_column_names(cursor, table_name)
     timestamp_columns = filter_to_timestamp_columns(columns)
     clause = ",".join(
         [f"datetime({c}, 'localtime') as {c}_localtime" for c in timestamp_columns]
@@ -38,23 +54,196 @@ def generate_timestamp_to_localtimestamp_clause(cursor, table_name):
     return clause
 
 
-def export_experiment_data(experiment, output, tables):
+def decode_blobs(row):
+    # packed arrays (ex: kalman_filter_outputs) are exported as JSON, like they were originally stored.
+    from pioreactor.utils.matrix_blobs import unpack_array
+
+    return [
+        json.dumps(unpack_array(v).tolist()) if isinstance(v, bytes) else v for v in row
+    ]
+
+
+def get_timestamp_column(column_names):
+    timestamp_columns = filter_to_timestamp_columns(column_names)
+    if not timestamp_columns:
+        return None
+    return "timestamp" if "timestamp" in column_names else timestamp_columns[0]
+
+
+def get_order_by(cursor, table_name, experiment):
+    columns = get_column_names(cursor, table_name)
+    timestamp_column = get_timestamp_column(columns)
+    if timestamp_column is None:
+        return ""
+
+    if (experiment is not None) and ("pioreactor_unit" in columns):
+        # matches the (experiment, pioreactor_unit, timestamp) index, so rows stream off the index without a sort.
+        return f"ORDER BY pioreactor_unit, {timestamp_column}"
+    return f"ORDER BY {timestamp_column}"
+
+
+def get_epoch_expression(column_names):
+    """
+    since/until are compared as seconds since the Unix epoch, not as strings, so that timestamps with a timezone
+    (ex: `Z`, `+00:00`) or without a time compare correctly. Time series have a numeric timestamp_epoch column,
+    for other tables (and rows without timestamp_epoch) the timestamp column is converted in the query.
+    """
+    timestamp_column = get_timestamp_column(column_names)
+    if timestamp_column is None:
+        return None
+
+    converted = f"(julianday({timestamp_column}) - 2440587.5) * 86400.0"
+    if "timestamp_epoch" in column_names:
+        return f"COALESCE(timestamp_epoch, {converted})"
+    return f"({converted})"
+
+
+def generate_where_clause(column_names, experiment, units, since, until):
+    """
+    Filters are pushed into the query, so only the rows we want are read. Filters on a column
+    the table doesn't have (ex: units on the experiments table) are skipped.
+    """
+    from pioreactor.actions.leader.migrate_database import to_epoch
+
+    conditions, params = [], {}
+
+    if experiment is not None:
+        conditions.append("experiment=:experiment")
+        params["experiment"] = experiment
+
+    if units and ("pioreactor_unit" in column_names):
+        placeholders = ", ".join(f":unit{i}" for i in range(len(units)))
+        conditions.append(f"pioreactor_unit IN ({placeholders})")
+        params.update({f"unit{i}": unit for i, unit in enumerate(units)})
+
+    epoch_expression = get_epoch_expression(column_names)
+    if (since is not None) and (epoch_expression is not None):
+        conditions.append(f"{epoch_expression} >= :since")
+        params["since"] = to_epoch(since)
+
+    if (until is not None) and (epoch_expression is not None):
+        conditions.append(f"{epoch_expression} < :until")
+        params["until"] = to_epoch(until)
+
+    if not conditions:
+        return "", params
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def generate_archive_filters(column_names, since, until):
+    # the same time filters as generate_where_clause, for reading archives. Only timestamp_epoch can be filtered on
+    # in the Parquet read (rows where it's NULL are read), the query filters the rest.
+    from pioreactor.actions.leader.migrate_database import to_epoch
+
+    if "timestamp_epoch" not in column_names:
+        return []
+
+    filters = []
+    if since is not None:
+        filters.append(("timestamp_epoch", ">=", to_epoch(since)))
+    if until is not None:
+        filters.append(("timestamp_epoch", "<", to_epoch(until)))
+    return filters
+
+
+def arrow_schema_from_cursor(cursor, declared_types):
+    import pyarrow as pa
+
+    def arrow_type(column):
+        if column.endswith("_localtime"):
+            return pa.string()
+        declared_type = declared_types.get(column, "TEXT")
+        if declared_type == "BLOB":
+            # packed arrays are exported as JSON text, see decode_blobs
+            return pa.string()
+        return getattr(pa, SQLITE_TO_ARROW_TYPES.get(declared_type, "string"))()
+
+    return pa.schema([(d[0], arrow_type(d[0])) for d in cursor.description])
+
+
+def iter_chunks(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield [decode_blobs(row) for row in rows]
+
+
+def write_csv(entry, cursor, declared_types):
+    import csv
+    import io
+
+    with io.TextIOWrapper(entry, encoding="utf-8", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=",")
+        csv_writer.writerow([i[0] for i in cursor.description])
+        for rows in iter_chunks(cursor):
+            csv_writer.writerows(rows)
+
+
+def write_parquet(entry, cursor, declared_types):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema_from_cursor(cursor, declared_types)
+    with pq.ParquetWriter(entry, schema, compression="zstd") as writer:
+        # one row group per chunk
+        for rows in iter_chunks(cursor):
+            writer.write_batch(
+                pa.record_batch([list(c) for c in zip(*rows)], schema=schema)
+            )
+
+
+def write_arrow(entry, cursor, declared_types):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    schema = arrow_schema_from_cursor(cursor, declared_types)
+    with ipc.new_file(
+        entry, schema, options=ipc.IpcWriteOptions(compression="zstd")
+    ) as writer:
+        for rows in iter_chunks(cursor):
+            writer.write_batch(
+                pa.record_batch([list(c) for c in zip(*rows)], schema=schema)
+            )
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet, "arrow": write_arrow}
+
+
+def export_experiment_data(
+    experiment,
+    output,
+    tables,
+    format="csv",
+    units=(),
+    since=None,
+    until=None,
+    columns=(),
+):
     """
     Set an experiment, else it defaults to the entire table.
 
+    Each table is streamed from the database, in chunks, directly into its own entry in the zip file.
+    units, since/until (UTC times, compared against the table's timestamp) and columns filter what's exported.
     """
     import sqlite3
     import zipfile
-    import csv
 
     logger = create_logger("export_experiment_data")
     logger.info(f"Starting export of table(s): {', '.join(tables)}.")
 
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}.")
+
     time = datetime.now().strftime("%Y%m%d%H%m%S")
     zf = zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED)
-    con = sqlite3.connect(config["storage"]["database"])
+    connections = {}
 
     for table in tables:
+        database = get_database(table)
+        if database not in connections:
+            connections[database] = sqlite3.connect(database)
+        con = connections[database]
         cursor = con.cursor()
 
         # so apparently, you can't parameterize the table name in python's sqlite3, so I
@@ -62,32 +251,54 @@ def export_experiment_data(experiment, output, tables):
         if not exists_table(cursor, table):
             raise ValueError(f"Table {table} does not exist.")
 
+        declared_types = get_columns(cursor, table)
+        column_names = list(declared_types)
+
+        # if the experiment was archived, most of its rows are no longer in the database. Load them (those that
+        # pass the filters) into a temp table, and read from it and the database: rows can arrive after archiving.
+        source = table
+        if (experiment is not None) and is_archived(experiment, table):
+            logger.debug(f"Reading {table} from the archive of {experiment}.")
+            archived_table = load_archived_table(
+                con,
+                experiment,
+                table,
+                columns=declared_types,
+                units=units,
+                filters=generate_archive_filters(column_names, since, until),
+            )
+            source = f"(SELECT {', '.join(column_names)} FROM temp.{archived_table} UNION ALL SELECT {', '.join(column_names)} FROM main.{table})"
+        # likewise, column names are checked against the table's columns before being put in the query.
+        selected_columns = [c for c in column_names if (not columns) or (c in columns)]
+        if not selected_columns:
+            raise ValueError(f"None of the columns {columns} are in {table}.")
+
         timestamp_to_localtimestamp_clause = generate_timestamp_to_localtimestamp_clause(
-            cursor, table
+            cursor, table, selected_columns
+        )
+        where_clause, params = generate_where_clause(
+            column_names, experiment, units, since, until
         )
-        order_by = filter_to_timestamp_columns(
-            get_column_names(cursor, table)
-        ).pop()  # just take first...
+        order_by = get_order_by(cursor, table, experiment)
 
-        if experiment is None:
-            query = f"SELECT {timestamp_to_localtimestamp_clause} * from {table} ORDER BY :order_by"
-            cursor.execute(query, {"order_by": order_by})
-            _filename = f"{table}-{time}.dump.csv".replace(" ", "_")
+        query = f"SELECT {timestamp_to_localtimestamp_clause} {', '.join(selected_columns)} from {source} {where_clause} {order_by}"
+        cursor.execute(query, params)
 
+        if experiment is None:
+            _filename = f"{table}-{time}.{FORMATS[format]}".replace(" ", "_")
         else:
-            query = f"SELECT {timestamp_to_localtimestamp_clause} * from {table} WHERE experiment=:experiment ORDER BY :order_by"
-            cursor.execute(query, {"experiment": experiment, "order_by": order_by})
-            _filename = f"{experiment}-{table}-{time}.dump.csv".replace(" ", "_")
+            _filename = f"{experiment}-{table}-{time}.{FORMATS[format]}".replace(" ", "_")
 
-        path_to_file = os.path.join(os.path.dirname(output), _filename)
-        with open(path_to_file, "w") as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=",")
-            csv_writer.writerow([i[0] for i in cursor.description])
-            csv_writer.writerows(cursor)
-
-        zf.write(path_to_file, arcname=_filename)
+        # Parquet and Arrow files are already compressed.
+        zinfo = zipfile.ZipInfo(_filename, date_time=datetime.now().timetuple()[:6])
+        zinfo.compress_type = (
+            zipfile.ZIP_DEFLATED if format == "csv" else zipfile.ZIP_STORED
+        )
+        with zf.open(zinfo, mode="w", force_zip64=True) as entry:
+            WRITERS[format](entry, cursor, declared_types)
 
-    con.close()
+    for con in connections.values():
+        con.close()
     zf.close()
 
     logger.info("Completed export.")
@@ -98,8 +309,30 @@ def export_experiment_data(experiment, output, tables):
 @click.option("--experiment", default=None)
 @click.option("--output", default="/home/pi/exports/export.zip")
 @click.option("--tables", multiple=True, default=[])
-def click_export_experiment_data(experiment, output, tables):
+@click.option(
+    "--format",
+    type=click.Choice(list(FORMATS)),
+    default="csv",
+    show_default=True,
+    help="parquet and arrow require pyarrow",
+)
+@click.option("--units", multiple=True, default=[], help="only export these units")
+@click.option("--since", default=None, help="only export rows at or after this UTC time")
+@click.option("--until", default=None, help="only export rows before this UTC time")
+@click.option("--columns", multiple=True, default=[], help="only export these columns")
+def click_export_experiment_data(
+    experiment, output, tables, format, units, since, until, columns
+):
     """
     (leader only) Export tables from db.
     """
-    return export_experiment_data(experiment, output, tables)
+    return export_experiment_data(
+        experiment,
+        output,
+        tables,
+        format=format,
+        units=units,
+        since=since,
+        until=until,
+        columns=columns,
+    )
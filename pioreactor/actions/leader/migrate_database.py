@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned schema migrations for the leader's database. The schema version is stored in SQLite's
+`PRAGMA user_version`, and each migration with a higher version is applied, in order, then the version is bumped.
+
+Migrations must be idempotent (ex: `IF NOT EXISTS`), as a new database is created from sql/create_tables.sql
+(which already includes them) with user_version 0, and a migration can be interrupted before its version is recorded.
+
+> pio run migrate_database
+
+The streamer, mqtt_to_db_streaming, runs this on startup.
+"""
+from datetime import datetime, timezone
+import click
+
+from pioreactor.config import config
+from pioreactor.logging import create_logger
+
+
+# tables that have a `timestamp` column and receive a steady stream of rows.
+TIME_SERIES_TABLES = [
+    "od_readings_raw",
+    "od_readings_filtered",
+    "alt_media_fraction",
+    "growth_rates",
+    "temperature_readings",
+    "dosing_events",
+    "led_events",
+    "pid_logs",
+    "kalman_filter_outputs",
+    "stirring_rates",
+    "od_reading_statistics",
+]
+
+# tables that previously only had an index on (experiment), which is a prefix of the new composite index.
+TABLES_WITH_EXPERIMENT_INDEX = [
+    "od_readings_raw",
+    "od_readings_filtered",
+    "alt_media_fraction",
+    "growth_rates",
+    "temperature_readings",
+]
+
+# tables of telemetry with a sequence number per (unit, source), see pioreactor.utils.sequences. Rows are inserted
+# with INSERT OR IGNORE, and a unique index skips duplicates.
+SEQUENCED_TABLES = [
+    "od_readings_raw",
+    "od_readings_filtered",
+    "growth_rates",
+    "temperature_readings",
+    "dosing_events",
+    "led_events",
+]
+
+BACKFILL_CHUNK_SIZE = 10_000
+
+
+def to_epoch(timestamp):
+    """
+    ISO 8601 timestamp -> seconds since the Unix epoch. Timestamps without a timezone are UTC, see current_utc_time.
+    """
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _table_exists(cursor, table):
+    return (
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+        ).fetchone()
+        is not None
+    )
+
+
+def _column_exists(cursor, table, column):
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
+
+
+def get_column_type(cursor, table, column):
+    for row in cursor.execute(f"PRAGMA table_info({table})").fetchall():
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+
+def add_composite_timestamp_indexes(connection, logger):
+    cursor = connection.cursor()
+    for table in TIME_SERIES_TABLES:
+        if not _table_exists(cursor, table):
+            continue
+
+        if table in TABLES_WITH_EXPERIMENT_INDEX:
+            cursor.execute(f"DROP INDEX IF EXISTS {table}_ix")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_ix ON {table} (experiment, pioreactor_unit, timestamp)"
+        )
+        logger.debug(f"Created index {table}_ix.")
+    connection.commit()
+
+
+def add_timestamp_epoch_column(connection, logger):
+    cursor = connection.cursor()
+    for table in TIME_SERIES_TABLES:
+        if not _table_exists(cursor, table):
+            continue
+
+        if not _column_exists(cursor, table, "timestamp_epoch"):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN timestamp_epoch REAL")
+            connection.commit()
+
+        # backfill in chunks of rowids, committing each, so we never hold the write lock for long. Walking the
+        # rowids (rather than re-selecting NULLs) means an unparseable timestamp, left NULL, can't stall the loop.
+        n_updated = 0
+        last_rowid = -1
+        while True:
+            chunk = cursor.execute(
+                f"SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                (last_rowid, BACKFILL_CHUNK_SIZE),
+            ).fetchone()
+            if chunk[1] == 0:
+                break
+
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET timestamp_epoch = (julianday(timestamp) - 2440587.5) * 86400.0
+                WHERE rowid > ? AND rowid <= ? AND timestamp_epoch IS NULL""",
+                (last_rowid, chunk[0]),
+            )
+            connection.commit()
+            n_updated += cursor.rowcount
+            last_rowid = chunk[0]
+
+        if n_updated:
+            logger.debug(f"Backfilled timestamp_epoch for {n_updated} rows in {table}.")
+
+
+def create_rollup_tables(connection, logger):
+    from pioreactor.utils.rollups import create_rollup_tables_sql
+
+    cursor = connection.cursor()
+    for statement in create_rollup_tables_sql():
+        cursor.execute(statement)
+    connection.commit()
+    logger.info(
+        "Created rollup tables. Use `pio run backfill_rollups` to fill them for past experiments."
+    )
+
+
+def create_edge_sync_watermarks_table(connection, logger):
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS edge_sync_watermarks (
+            pioreactor_unit        TEXT     PRIMARY KEY,
+            seq                    INTEGER  NOT NULL
+        )
+        """
+    )
+    connection.commit()
+
+
+def add_sequence_columns(connection, logger):
+    cursor = connection.cursor()
+    for table in SEQUENCED_TABLES:
+        if not _table_exists(cursor, table):
+            continue
+
+        if not _column_exists(cursor, table, "source"):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN source TEXT")
+        if not _column_exists(cursor, table, "seq"):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN seq INTEGER")
+        # existing rows have no seq, and NULLs are never equal, so they don't conflict.
+        cursor.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_seq_ux ON {table} (pioreactor_unit, source, seq)"
+        )
+        logger.debug(f"Added sequence numbers to {table}.")
+    connection.commit()
+
+
+def pack_kalman_filter_outputs(connection, logger):
+    from pioreactor.utils.matrix_blobs import pack_array, unpack_array
+
+    cursor = connection.cursor()
+    if not _table_exists(cursor, "kalman_filter_outputs"):
+        return
+
+    # SQLite can't change a column's type in place, so rebuild the table with BLOB columns.
+    if get_column_type(cursor, "kalman_filter_outputs", "state") != "BLOB":
+        cursor.executescript(
+            """
+            BEGIN;
+            CREATE TABLE kalman_filter_outputs_new (
+                timestamp                TEXT NOT NULL,
+                pioreactor_unit          TEXT NOT NULL,
+                experiment               TEXT NOT NULL,
+                state                    BLOB NOT NULL,
+                covariance_matrix        BLOB NOT NULL,
+                timestamp_epoch          REAL
+            );
+            INSERT INTO kalman_filter_outputs_new
+                SELECT timestamp, pioreactor_unit, experiment, state, covariance_matrix, timestamp_epoch
+                FROM kalman_filter_outputs;
+            DROP TABLE kalman_filter_outputs;
+            ALTER TABLE kalman_filter_outputs_new RENAME TO kalman_filter_outputs;
+            CREATE INDEX IF NOT EXISTS kalman_filter_outputs_ix
+                ON kalman_filter_outputs (experiment, pioreactor_unit, timestamp);
+            COMMIT;
+            """
+        )
+
+    # convert the JSON rows to packed blobs, in chunks.
+    n_updated = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT rowid, state, covariance_matrix FROM kalman_filter_outputs
+            WHERE typeof(state) = 'text' LIMIT ?""",
+            (BACKFILL_CHUNK_SIZE,),
+        ).fetchall()
+        if not rows:
+            break
+
+        cursor.executemany(
+            "UPDATE kalman_filter_outputs SET state = ?, covariance_matrix = ? WHERE rowid = ?",
+            [
+                (
+                    pack_array(unpack_array(state), dtype="float64"),
+                    pack_array(
+                        unpack_array(covariance_matrix),
+                        dtype="float32",
+                        upper_triangle=True,
+                    ),
+                    rowid,
+                )
+                for (rowid, state, covariance_matrix) in rows
+            ],
+        )
+        connection.commit()
+        n_updated += len(rows)
+
+    if n_updated:
+        logger.debug(f"Packed {n_updated} rows in kalman_filter_outputs.")
+
+
+# (version, description, function). Append new migrations to the end, with increasing versions.
+MIGRATIONS = [
+    (
+        1,
+        "composite (experiment, pioreactor_unit, timestamp) indexes",
+        add_composite_timestamp_indexes,
+    ),
+    (2, "numeric timestamp_epoch column", add_timestamp_epoch_column),
+    (3, "1 minute and 15 minute rollup tables", create_rollup_tables),
+    (4, "binary packed kalman_filter_outputs", pack_kalman_filter_outputs),
+    (5, "edge_sync_watermarks table", create_edge_sync_watermarks_table),
+    (6, "source and seq columns of telemetry", add_sequence_columns),
+]
+
+
+def migrate_database(database=None):
+    """
+    Apply any migrations newer than the database's schema version. Returns the new schema version.
+    """
+    import sqlite3
+
+    logger = create_logger("migrate_database")
+
+    connection = sqlite3.connect(database or config["storage"]["database"], timeout=30)
+    current_version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        logger.info(f"Migrating database to version {version}: {description}.")
+        migration(connection, logger)
+        connection.execute(f"PRAGMA user_version = {version}")
+        connection.commit()
+        current_version = version
+
+    connection.close()
+    return current_version
+
+
+@click.command(name="migrate_database")
+def click_migrate_database():
+    """
+    (leader only) Apply any pending schema migrations to the database.
+    """
+    migrate_database()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Time series for plotting, in a fixed number of points however long the experiment.
+
+The points are read from the coarsest table that still has enough of them (a rollup, see pioreactor.utils.rollups,
+or the raw table for short ranges), then downsampled with LTTB (see pioreactor.utils.downsampling) to at most
+`points` per series. The result has the same shape as the time_series_cache's:
+
+    {"unit1": {"od_readings_filtered/0": {"x": [<epoch seconds>, ...], "y": [...]}}}
+
+"""
+import json
+
+import click
+
+from pioreactor.config import config
+from pioreactor.utils.rollups import ROLLUP_SOURCES, BUCKETS, rollup_table, choose_source
+
+
+def get_time_range(reader, table, experiment, since, until):
+    # from the 15m rollup if the range isn't given: it's small, and keyed by experiment.
+    if since is None or until is None:
+        first, last = reader.query(
+            f"""SELECT MIN(bucket_epoch), MAX(bucket_epoch) + {max(BUCKETS.values())}
+            FROM {rollup_table(table, max(BUCKETS, key=BUCKETS.get))} WHERE experiment = ?""",
+            (experiment,),
+        )[0]
+        since = first if since is None else since
+        until = last if until is None else until
+    return since, until
+
+
+def query_time_series(
+    table, experiment, units=(), since=None, until=None, points=1000, database=None
+):
+    """
+    table is one of the tables with rollups: od_readings_raw, od_readings_filtered, growth_rates,
+    temperature_readings. since and until are UTC timestamps, ex: "2021-06-01T12:00:00", and default to the
+    start and end of the experiment.
+    """
+    from pioreactor.actions.leader.migrate_database import to_epoch
+    from pioreactor.utils.downsampling import lttb
+    from pioreactor.utils.sqlite_reader import get_reader
+
+    if table not in ROLLUP_SOURCES:
+        raise ValueError(f"`{table}` isn't one of {', '.join(ROLLUP_SOURCES)}.")
+
+    reader = get_reader(database or config["storage"]["database"])
+    since = to_epoch(since) if since is not None else None
+    until = to_epoch(until) if until is not None else None
+
+    since_, until_ = get_time_range(reader, table, experiment, since, until)
+    if since_ is None or until_ is None:
+        # no rollups for this experiment (ex: not backfilled), so read everything from the raw table.
+        source, time_column, value_column = choose_source(table, 0, points)
+    else:
+        source, time_column, value_column = choose_source(table, until_ - since_, points)
+
+    channel = "channel" if "channel" in ROLLUP_SOURCES[table].key_columns else "NULL"
+    conditions, params = ["experiment = ?"], [experiment]
+    if units:
+        conditions.append(f"pioreactor_unit IN ({', '.join(['?'] * len(units))})")
+        params.extend(units)
+    if since is not None:
+        conditions.append(f"{time_column} >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{time_column} < ?")
+        params.append(until)
+
+    series = {}  # (unit, series) -> ([times], [values])
+    for unit, channel_, t, value in reader.iterate(
+        f"""SELECT pioreactor_unit, {channel}, {time_column}, {value_column} FROM {source}
+        WHERE {" AND ".join(conditions)} ORDER BY {time_column}""",
+        tuple(params),
+    ):
+        name = table if channel_ is None else f"{table}/{channel_}"
+        times, values = series.setdefault((unit, name), ([], []))
+        times.append(t)
+        values.append(value)
+
+    result = {}
+    for (unit, name), (times, values) in series.items():
+        x, y = lttb(times, values, points)
+        result.setdefault(unit, {})[name] = {"x": x.tolist(), "y": y.tolist()}
+    return result
+
+
+@click.command(name="query_time_series")
+@click.argument("table", type=click.Choice(list(ROLLUP_SOURCES)))
+@click.option("--experiment", required=True)
+@click.option(
+    "--units", multiple=True, default=(), help="only these units. Default is all."
+)
+@click.option("--since", default=None, help="only points at or after this UTC time")
+@click.option("--until", default=None, help="only points before this UTC time")
+@click.option(
+    "--points", default=1000, show_default=True, help="most points returned per series"
+)
+def click_query_time_series(table, experiment, units, since, until, points):
+    """
+    (leader only) Print a time series, downsampled for plotting, as JSON.
+    """
+    click.echo(
+        json.dumps(
+            query_time_series(
+                table, experiment, units=units, since=since, until=until, points=points
+            )
+        )
+    )
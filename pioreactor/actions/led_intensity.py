@@ -3,10 +3,12 @@ import json
 import click
 
 from pioreactor.pubsub import create_client, QOS
+from pioreactor import structs
 from pioreactor.whoami import get_unit_name, get_latest_experiment_name
 from pioreactor.logging import create_logger
 from pioreactor.utils.timing import current_utc_time
 from pioreactor.utils import local_intermittent_storage
+from pioreactor.utils.sequences import sequence
 
 CHANNELS = ["A", "B", "C", "D"]
 
@@ -89,13 +91,14 @@ def led_intensity(
                 f"Updated LED {channel} from {old_state[channel]:g}% to {new_state[channel]:g}%."
             )
 
-        event = {
-            "channel": channel,
-            "intensity": intensity,
-            "event": "change_intensity",
-            "source_of_event": source_of_event,
-            "timestamp": current_utc_time(),
-        }
+        event = structs.LEDEvent(
+            channel=channel,
+            intensity=intensity,
+            event="change_intensity",
+            source_of_event=source_of_event,
+            timestamp=current_utc_time(),
+            source="led_intensity",
+        )
 
         pubsub_client.publish(
             f"pioreactor/{unit}/{experiment}/led/{channel}/intensity",
@@ -111,7 +114,7 @@ def led_intensity(
         )
         pubsub_client.publish(
             f"pioreactor/{unit}/{experiment}/led_events",
-            json.dumps(event),
+            sequence(event).to_json(),
             qos=QOS.AT_MOST_ONCE,
             retain=False,
         )
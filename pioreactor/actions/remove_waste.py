@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import time
-from json import loads, dumps
+from json import loads
 from configparser import NoOptionError
 
 import click
@@ -10,6 +10,7 @@ from pioreactor.utils import pump_ml_to_duration, pump_duration_to_ml
 from pioreactor.whoami import get_unit_name, get_latest_experiment_name
 from pioreactor.config import config
 from pioreactor.pubsub import publish, QOS
+from pioreactor import structs
 from pioreactor.hardware_mappings import PWM_TO_PIN
 from pioreactor.logging import create_logger
 from pioreactor.utils.pwm import PWM
@@ -63,13 +64,12 @@ def remove_waste(
 
     publish(
         f"pioreactor/{unit}/{experiment}/dosing_events",
-        dumps(
-            {
-                "volume_change": ml,
-                "event": "remove_waste",
-                "source_of_event": source_of_event,
-                "timestamp": current_utc_time(),
-            }
+        structs.DosingEvent(
+            volume_change=ml,
+            event="remove_waste",
+            source_of_event=source_of_event,
+            timestamp=current_utc_time(),
+            source="remove_waste",
         ),
         qos=QOS.EXACTLY_ONCE,
     )
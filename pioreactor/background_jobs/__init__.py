@@ -14,12 +14,16 @@ from pioreactor.background_jobs import stirring
 from pioreactor.background_jobs import monitor
 from pioreactor.background_jobs.leader import mqtt_to_db_streaming
 from pioreactor.background_jobs.leader import watchdog
+from pioreactor.background_jobs.leader import database_retention
+from pioreactor.background_jobs.leader import time_series_cache
 
 
 __all__ = (
     "monitor",
     "mqtt_to_db_streaming",
     "watchdog",
+    "database_retention",
+    "time_series_cache",
     "growth_rate_calculating",
     "dosing_control",
     "led_control",
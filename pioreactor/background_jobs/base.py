@@ -8,8 +8,21 @@ from collections import namedtuple
 from json import dumps
 
 from pioreactor.utils import pio_jobs_running, local_intermittent_storage
-from pioreactor.pubsub import QOS, create_client
+from pioreactor.pubsub import (
+    QOS,
+    AttributePublisher,
+    SubscriptionRegistry,
+    apply_qos_policy,
+    create_client,
+    get_spool,
+    record_at_edge,
+    should_spool,
+    spool_message,
+    update_retained_cache,
+)
 from pioreactor.whoami import UNIVERSAL_IDENTIFIER, is_testing_env
+from pioreactor.structs import Message
+from pioreactor.utils.sequences import sequence
 from pioreactor.logging import create_logger
 
 
@@ -86,6 +99,11 @@ class _BackgroundJob(metaclass=PostInitCaller):
     On __init__, attributes are broadcast under `pioreactor/<unit>/<experiment>/<job_name>/$properties`,
     and each has `pioreactor/<unit>/<experiment>/<job_name>/$settable` set to True. This latter field isn't used at the moment.
 
+    Each assignment to an attribute in `editable_settings` publishes it (retained). Attributes that change often can
+    be given a pubsub.PublishPolicy in `publish_policies`, to publish them at most every so often, or only on large
+    enough changes. Held values are published on every state transition, so the final values are never lost.
+    Attributes whose policy doesn't retain them have any retained value cleared when the job starts.
+
 
     Parameters
     -----------
@@ -113,6 +131,9 @@ class _BackgroundJob(metaclass=PostInitCaller):
     # be published to MQTT and available to be edited (but not all _should_ be edited)
     editable_settings = []
 
+    # attr -> pubsub.PublishPolicy, for attributes (editable or not) published through self.attribute_publisher
+    publish_policies = {}
+
     def __init__(
         self, job_name: str, source: str, experiment: str = None, unit: str = None
     ):
@@ -122,6 +143,9 @@ class _BackgroundJob(metaclass=PostInitCaller):
         self.unit = unit
         self.sub_jobs = []
         self.editable_settings = self.editable_settings + ["state"]
+        self.attribute_publisher = AttributePublisher(
+            self.publish, policies=self.publish_policies
+        )
 
         self.logger = create_logger(
             self.job_name,
@@ -151,6 +175,13 @@ class _BackgroundJob(metaclass=PostInitCaller):
         self.sub_client = self.create_sub_client()
         self.pubsub_clients = [self.sub_client, self.pub_client]
 
+        # attributes that aren't retained may still have a retained value on the broker: from before their publish
+        # policy said so, or from a run that didn't disconnect cleanly. Clear it, once.
+        self.clear_unretained_attributes()
+
+        # every subscription made with subscribe_and_callback is tracked here, and restored on reconnect.
+        self.subscriptions = SubscriptionRegistry(self.sub_client)
+
         # let's move to init, next thing that run is the subclasses __init__
         self.set_state(self.INIT)
 
@@ -159,8 +190,8 @@ class _BackgroundJob(metaclass=PostInitCaller):
         self.set_state(self.READY)
 
     def start_passive_listeners(self):
-        # overwrite this to in subclasses to subscribe to topics in MQTT
-        # using this handles reconnects correctly.
+        # overwrite this to in subclasses to subscribe to topics in MQTT.
+        # Subscriptions made with subscribe_and_callback are restored on reconnects.
         pass
 
     # subclasses to override these to perform certain actions on a state transfer
@@ -230,12 +261,13 @@ class _BackgroundJob(metaclass=PostInitCaller):
         # the client will try to automatically reconnect if something bad happens
         # when we reconnect to the broker, we want to republish our state
         # to overwrite potential last-will losts...
-        # also reconnect to our old topics.
+        # also resubscribe to our old topics, all in one go.
         def reconnect_protocol(client, userdata, flags, rc, properties=None):
             self.logger.debug("Reconnected to MQTT broker.")
+            # messages may have been spooled, by any job, while we were disconnected. Send ours after them.
+            get_spool().refresh()
             self.publish_attr("state")
-            self.start_general_passive_listeners()
-            self.start_passive_listeners()
+            self.subscriptions.restore()
 
         def on_disconnect(client, userdata, rc):
 
@@ -285,30 +317,61 @@ class _BackgroundJob(metaclass=PostInitCaller):
         """
         Publish payload to topic.
 
-        This will convert the payload to a json blob if MQTT does not allow its original type.
+        This will convert the payload to a json blob if MQTT does not allow its original type. pioreactor.structs
+        messages are sent as json, too, with a new sequence number from this job (see pioreactor.utils.sequences).
+
+        If we aren't connected to the broker, messages worth keeping are spooled to disk (see pubsub.SPOOL_POLICIES)
+        and are sent later, in order, by the monitor job. With the edge store enabled, telemetry is kept there
+        instead (see pubsub.record_at_edge).
+
+        qos and retain are overridden by the topic's QoS policy, if any (see pubsub.QOS_POLICIES).
         """
 
-        if not isinstance(payload, (str, bytearray, int, float)) and (
+        if isinstance(payload, Message):
+            payload = sequence(payload, source=self.job_name).to_json()
+        elif not isinstance(payload, (str, bytes, bytearray, int, float)) and (
             payload is not None
         ):
             payload = dumps(payload)
 
-        self.pub_client.publish(topic, payload=payload, **kwargs)
+        qos, retain = apply_qos_policy(
+            topic, kwargs.pop("qos", 0), kwargs.pop("retain", False)
+        )
+
+        is_connected = self.pub_client.is_connected()
+        if record_at_edge(topic, payload, is_connected=is_connected):
+            return
+
+        if should_spool(topic, is_connected=is_connected):
+            spool_message(topic, payload, qos=qos, retain=retain)
+            return
+
+        self.pub_client.publish(topic, payload=payload, qos=qos, retain=retain, **kwargs)
+
+    def clear_unretained_attributes(self) -> None:
+        for attr, policy in self.publish_policies.items():
+            if policy.retain is False:
+                self.publish(
+                    f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/{attr}",
+                    None,
+                    retain=True,
+                    qos=QOS.AT_LEAST_ONCE,
+                )
 
     def publish_attr(self, attr: str) -> None:
         """
-        Publish the current value of the class attribute `attr` to MQTT.
+        Publish the current value of the class attribute `attr` to MQTT, per its publish policy, if any.
         """
         if attr == "state":
             attr_name = "$state"
         else:
             attr_name = attr
 
-        self.publish(
+        self.attribute_publisher.update(
+            attr,
             f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/{attr_name}",
             getattr(self, attr),
             retain=True,
-            qos=QOS.EXACTLY_ONCE,
         )
 
     def subscribe_and_callback(self, callback, subscriptions, allow_retained=True, qos=0):
@@ -324,13 +387,18 @@ class _BackgroundJob(metaclass=PostInitCaller):
             subscriber "fresh", it will have retain=False on the client side. More here:
             https://github.com/eclipse/paho.mqtt.python/blob/master/src/paho/mqtt/client.py#L364
         qos: int
-            see pioreactor.pubsub.QOS
+            see pioreactor.pubsub.QOS. Overridden by the subscription's QoS policy, if any (see pioreactor.pubsub.QOS_POLICIES).
+
+        Subscriptions are tracked in self.subscriptions: subscribing the same callback to a topic twice is a no-op,
+        and self.subscriptions.remove(topic) undoes this.
         """
 
         def wrap_callback(actual_callback):
             def _callback(client, userdata, message):
                 if not allow_retained and message.retain:
                     return
+
+                update_retained_cache(message)
                 try:
                     return actual_callback(message)
                 except Exception as e:
@@ -348,9 +416,11 @@ class _BackgroundJob(metaclass=PostInitCaller):
             [subscriptions] if isinstance(subscriptions, str) else subscriptions
         )
 
-        for sub in subscriptions:
-            self.sub_client.message_callback_add(sub, wrap_callback(callback))
-            self.sub_client.subscribe(sub, qos=qos)
+        self.subscriptions.add(
+            [(sub, apply_qos_policy(sub, qos)[0]) for sub in subscriptions],
+            wrap_callback(callback),
+            key=callback,
+        )
         return
 
     def set_up_exit_protocol(self):
@@ -436,6 +506,9 @@ class _BackgroundJob(metaclass=PostInitCaller):
         # call this first to make sure that it gets published to the broker.
         self.state = self.DISCONNECTED
 
+        # from here, attributes are published right away: on_disconnect clears them, in order.
+        self.attribute_publisher.close()
+
         # if a job exits ungracefully, we log the error here (possibly a duplication...)
         # this is a partial resolution to issue #145
         if hasattr(sys, "last_traceback"):
@@ -485,6 +558,8 @@ class _BackgroundJob(metaclass=PostInitCaller):
 
     def set_state(self, new_state):
         assert new_state in self.LIFECYCLE_STATES, f"saw {new_state}: not a valid state"
+        # publish held attributes before the transition.
+        self.attribute_publisher.flush()
         try:
             getattr(self, f"on_{self.state}_to_{new_state}")()
         except AttributeError:
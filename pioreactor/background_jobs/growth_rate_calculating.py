@@ -36,7 +36,8 @@ import click
 
 from pioreactor.utils.streaming_calculations import ExtendedKalmanFilter
 from pioreactor.utils import is_pio_job_running
-from pioreactor.pubsub import subscribe, QOS
+from pioreactor.pubsub import subscribe, snapshot, QOS
+from pioreactor import structs
 
 from pioreactor.whoami import get_unit_name, get_latest_experiment_name, is_testing_env
 from pioreactor.config import config
@@ -91,7 +92,7 @@ class GrowthRateCalculator(BackgroundJob):
         latest_od_message = subscribe(
             f"pioreactor/{self.unit}/{self.experiment}/od_reading/od_raw_batched"
         )
-        latest_ods = json.loads(latest_od_message.payload)["od_raw"]
+        latest_ods = structs.ODReadings.from_json(latest_od_message.payload).od_raw
 
         channels_and_initial_points = self.scale_raw_observations(
             self.batched_raw_od_readings_to_dict(latest_ods)
@@ -170,6 +171,17 @@ class GrowthRateCalculator(BackgroundJob):
         return obs_variances
 
     def get_precomputed_values(self):
+        # fetch all the retained values we might need in a single connection
+        retained = snapshot(
+            [
+                f"pioreactor/{self.unit}/{self.experiment}/od_blank/mean",
+                f"pioreactor/{self.unit}/{self.experiment}/growth_rate_calculating/growth_rate",
+                f"pioreactor/{self.unit}/{self.experiment}/od_normalization/mean",
+                f"pioreactor/{self.unit}/{self.experiment}/od_normalization/variance",
+            ],
+            deadline=2,
+        )
+
         if self.ignore_cache:
             assert is_pio_job_running(
                 "od_reading"
@@ -184,11 +196,13 @@ class GrowthRateCalculator(BackgroundJob):
             self.logger.info("Completed OD normalization metrics.")
             initial_growth_rate = 0
         else:
-            od_normalization_factors = self.get_od_normalization_from_broker()
-            od_variances = self.get_od_variances_from_broker()
-            initial_growth_rate = self.get_growth_rate_from_broker()
+            (
+                od_normalization_factors,
+                od_variances,
+            ) = self.get_od_normalization_and_variances_from_broker(retained)
+            initial_growth_rate = self.get_growth_rate_from_broker(retained)
 
-        od_blank = self.get_od_blank_from_broker()
+        od_blank = self.get_od_blank_from_broker(retained)
 
         # what happens if od_blank is near / less than od_normalization_factors?
         # this means that the inoculant had near 0 impact on the turbidity => very dilute.
@@ -202,64 +216,38 @@ class GrowthRateCalculator(BackgroundJob):
 
         return initial_growth_rate, od_normalization_factors, od_variances, od_blank
 
-    def get_od_blank_from_broker(self):
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/od_blank/mean",
-            timeout=2,
-            qos=QOS.EXACTLY_ONCE,
-        )
-        if message:
-            return json.loads(message.payload)
+    def get_od_blank_from_broker(self, retained):
+        topic = f"pioreactor/{self.unit}/{self.experiment}/od_blank/mean"
+        if topic in retained:
+            return json.loads(retained[topic])
         else:
             return defaultdict(lambda: 0)
 
-    def get_growth_rate_from_broker(self):
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/growth_rate_calculating/growth_rate",
-            timeout=2,
-            qos=QOS.EXACTLY_ONCE,
-        )
-        if message:
-            return float(json.loads(message.payload)["growth_rate"])
+    def get_growth_rate_from_broker(self, retained):
+        topic = f"pioreactor/{self.unit}/{self.experiment}/growth_rate_calculating/growth_rate"
+        if topic in retained:
+            return structs.GrowthRate.from_json(retained[topic]).growth_rate
         else:
             return 0
 
-    def get_od_normalization_from_broker(self):
+    def get_od_normalization_and_variances_from_broker(self, retained):
         # we check if the broker has variance/mean stats
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/od_normalization/mean",
-            timeout=2,
-            qos=QOS.EXACTLY_ONCE,
+        mean_topic = f"pioreactor/{self.unit}/{self.experiment}/od_normalization/mean"
+        variance_topic = (
+            f"pioreactor/{self.unit}/{self.experiment}/od_normalization/variance"
         )
-        if message:
-            return json.loads(message.payload)
+        if (mean_topic in retained) and (variance_topic in retained):
+            return json.loads(retained[mean_topic]), json.loads(retained[variance_topic])
         else:
-            self.logger.debug("od_normalization/mean not found in broker.")
+            self.logger.debug("od_normalization/mean or variance not found in broker.")
             self.logger.info(
                 "Calculating OD normalization metrics. This may take a few minutes"
             )
-            means, _ = od_normalization(unit=self.unit, experiment=self.experiment)
-            self.logger.info("Finished calculating OD normalization metrics.")
-            return means
-
-    def get_od_variances_from_broker(self):
-        # we check if the broker has variance/mean stats
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/od_normalization/variance",
-            timeout=2,
-            qos=QOS.EXACTLY_ONCE,
-        )
-        if message:
-            return json.loads(message.payload)
-        else:
-            self.logger.debug("od_normalization/variance not found in broker.")
-            self.logger.info(
-                "Calculating OD normalization metrics. This may take a few minutes"
+            means, variances = od_normalization(
+                unit=self.unit, experiment=self.experiment
             )
-            _, variances = od_normalization(unit=self.unit, experiment=self.experiment)
             self.logger.info("Finished calculating OD normalization metrics.")
-
-            return variances
+            return means, variances
 
     def update_ekf_variance_after_event(self, minutes, factor):
         if is_testing_env():
@@ -300,8 +288,8 @@ class GrowthRateCalculator(BackgroundJob):
         if self.state != self.READY:
             return
 
-        payload = json.loads(message.payload)
-        observations = self.batched_raw_od_readings_to_dict(payload["od_raw"])
+        od_readings = structs.ODReadings.from_json(message.payload)
+        observations = self.batched_raw_od_readings_to_dict(od_readings.od_raw)
         scaled_observations = self.scale_raw_observations(observations)
 
         if is_testing_env():
@@ -312,7 +300,7 @@ class GrowthRateCalculator(BackgroundJob):
             # TODO this should use the internal timestamp reference
 
             time_of_current_observation = datetime.strptime(
-                payload["timestamp"], "%Y-%m-%dT%H:%M:%S.%f"
+                od_readings.timestamp, "%Y-%m-%dT%H:%M:%S.%f"
             )
             dt = (
                 (
@@ -333,27 +321,29 @@ class GrowthRateCalculator(BackgroundJob):
             # TODO: EKF values can be nans...
             self.publish(
                 f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/growth_rate",
-                {"growth_rate": self.state_[-2], "timestamp": payload["timestamp"]},
+                structs.GrowthRate(
+                    growth_rate=self.state_[-2], timestamp=od_readings.timestamp
+                ),
                 retain=True,
             )
 
             self.publish(
                 f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/kalman_filter_outputs",
-                {
-                    "state": self.ekf.state_.tolist(),
-                    "covariance_matrix": self.ekf.covariance_.tolist(),
-                    "timestamp": payload["timestamp"],
-                },
+                structs.KalmanFilterOutputs(
+                    state=self.ekf.state_.tolist(),
+                    covariance_matrix=self.ekf.covariance_.tolist(),
+                    timestamp=od_readings.timestamp,
+                ),
             )
 
             for i, (channel, angle) in enumerate(self.channels_and_angles.items()):
                 self.publish(
                     f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/od_filtered/{channel}",
-                    {
-                        "od_filtered": self.state_[i],
-                        "timestamp": payload["timestamp"],
-                        "angle": angle,
-                    },
+                    structs.ODFiltered(
+                        od_filtered=self.state_[i],
+                        angle=angle,
+                        timestamp=od_readings.timestamp,
+                    ),
                 )
 
             return
@@ -369,7 +359,6 @@ class GrowthRateCalculator(BackgroundJob):
         self.subscribe_and_callback(
             self.update_state_from_observation,
             f"pioreactor/{self.unit}/{self.experiment}/od_reading/od_raw_batched",
-            qos=QOS.EXACTLY_ONCE,
             allow_retained=False,
         )
         self.subscribe_and_callback(
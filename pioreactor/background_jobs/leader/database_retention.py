@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+This job runs on the leader, and enforces the retention rules in the [storage.retention] section of config.ini:
+
+    [storage.retention]
+    # <table>=<age>                   delete rows older than age
+    # <table>.<level>=<age>           only rows with this level (ex: logs)
+    # <table>=<age> thin <interval>   for rows older than age, keep one row per unit per interval
+    # experiments.<glob>=<age>        delete rows, in every table, of experiments matching glob that are older than age
+    logs.DEBUG=14d
+    kalman_filter_outputs=7d thin 1m
+    experiments._testing_*=1d
+
+Ages and intervals are a number followed by s, m, h or d.
+
+Rows are deleted in small batches, each its own short transaction, with a pause in between so
+the database writer (mqtt_to_db_streaming) is never blocked for long.
+"""
+import json
+import signal
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+
+from pioreactor.background_jobs.base import BackgroundJob
+from pioreactor.config import config
+from pioreactor.utils import local_intermittent_storage
+from pioreactor.utils.timing import RepeatedTimer
+from pioreactor.whoami import get_unit_name, UNIVERSAL_EXPERIMENT
+
+RetentionRule = namedtuple(
+    "RetentionRule", ["table", "level", "experiment_glob", "max_age", "thin_interval"]
+)
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_duration(duration):
+    duration = duration.strip()
+    try:
+        return float(duration[:-1]) * DURATION_UNITS[duration[-1]]
+    except (KeyError, ValueError):
+        raise ValueError(f"Unable to parse duration `{duration}`. Ex: 30s, 10m, 12h, 14d")
+
+
+def parse_retention_rule(key, value):
+    max_age, *rest = value.split()
+    if rest and (len(rest) != 2 or rest[0] != "thin"):
+        raise ValueError(f"Unable to parse retention rule `{key}={value}`.")
+    thin_interval = parse_duration(rest[1]) if rest else None
+
+    if key.startswith("experiments."):
+        return RetentionRule(
+            None, None, key[len("experiments.") :], parse_duration(max_age), thin_interval
+        )
+
+    table, _, level = key.partition(".")
+    return RetentionRule(
+        table, level or None, None, parse_duration(max_age), thin_interval
+    )
+
+
+def get_retention_rules():
+    if not config.has_section("storage.retention"):
+        return []
+    return [parse_retention_rule(k, v) for k, v in config["storage.retention"].items()]
+
+
+BATCH_SIZE = 500
+PAUSE_BETWEEN_BATCHES = 0.1  # seconds, lets the writer in between our transactions
+
+
+def delete_in_batches(connection, table, where, params, batch_size=BATCH_SIZE):
+    n_deleted = 0
+    while True:
+        cursor = connection.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+            params + (batch_size,),
+        )
+        connection.commit()
+        n_deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return n_deleted
+        time.sleep(PAUSE_BETWEEN_BATCHES)
+
+
+def thin(connection, table, cutoff, interval, batch_size=BATCH_SIZE):
+    """
+    Of the rows older than cutoff, keep the first per (experiment, unit, interval). Rows are scanned in rowid
+    order, and the scan stops at the first row that isn't older than cutoff yet: we remember how far we got, and
+    the last bucket kept per (experiment, unit), so the next run picks up at that row, mid-bucket, without
+    rescanning what's been thinned or skipping rows that have aged since.
+    """
+    with local_intermittent_storage("database_retention") as cache:
+        last_rowid = int(cache.get(table, b"0"))
+        last_kept = {
+            (experiment, unit): bucket
+            for experiment, unit, bucket in json.loads(
+                cache.get(f"{table}.last_kept", b"[]")
+            )
+        }
+
+    # the database was replaced since we last ran.
+    (max_rowid,) = connection.execute(
+        f"SELECT COALESCE(MAX(rowid), 0) FROM {table}"
+    ).fetchone()
+    if last_rowid > max_rowid:
+        last_rowid, last_kept = 0, {}
+
+    n_deleted = 0
+    scanned_rowid = last_rowid
+    while True:
+        rows = connection.execute(
+            f"""SELECT rowid, experiment, pioreactor_unit, CAST(timestamp_epoch / ? AS INTEGER), timestamp < ?
+            FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?""",
+            (interval, cutoff, scanned_rowid, batch_size),
+        ).fetchall()
+
+        to_delete = []
+        reached_recent_rows = False
+        for rowid, experiment, unit, bucket, is_aged in rows:
+            if not is_aged:
+                reached_recent_rows = True
+                break
+            scanned_rowid = rowid
+            if (bucket is not None) and last_kept.get((experiment, unit)) == bucket:
+                to_delete.append((rowid,))
+            else:
+                # we remember the last row kept, not deleted: if it were the table's last row, MAX(rowid)
+                # would drop below it, and look like a replaced database.
+                last_rowid = rowid
+                if bucket is not None:
+                    last_kept[(experiment, unit)] = bucket
+
+        connection.executemany(f"DELETE FROM {table} WHERE rowid = ?", to_delete)
+        connection.commit()
+        n_deleted += len(to_delete)
+
+        is_last_batch = reached_recent_rows or (len(rows) < batch_size)
+        if is_last_batch and last_kept:
+            # forget (experiment, unit)s that have stopped, or fallen behind. At worst, the next run keeps a
+            # second row in their last bucket.
+            latest_bucket = max(last_kept.values())
+            last_kept = {k: b for k, b in last_kept.items() if b >= latest_bucket - 1}
+
+        with local_intermittent_storage("database_retention") as cache:
+            cache[table] = str(last_rowid)
+            cache[f"{table}.last_kept"] = json.dumps(
+                [
+                    [experiment, unit, bucket]
+                    for (experiment, unit), bucket in last_kept.items()
+                ]
+            )
+
+        if is_last_batch:
+            return n_deleted
+
+        time.sleep(PAUSE_BETWEEN_BATCHES)
+
+
+def get_columns(connection, table):
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+
+
+def enforce_rule(connection, rule, batch_size=BATCH_SIZE):
+    cutoff = (datetime.utcnow() - timedelta(seconds=rule.max_age)).isoformat()
+
+    if rule.experiment_glob is not None:
+        n_deleted = 0
+        tables = [
+            table
+            for (table,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            ).fetchall()
+        ]
+        for table in tables:
+            columns = get_columns(connection, table)
+            if "experiment" not in columns:
+                continue
+            # experiments has started_at in older databases
+            timestamp_column = next(
+                (c for c in ["timestamp", "started_at"] if c in columns), None
+            )
+            if timestamp_column is None:
+                continue
+            n_deleted += delete_in_batches(
+                connection,
+                table,
+                f"experiment GLOB ? AND {timestamp_column} < ?",
+                (rule.experiment_glob, cutoff),
+                batch_size=batch_size,
+            )
+        return n_deleted
+
+    elif rule.thin_interval is not None:
+        return thin(connection, rule.table, cutoff, rule.thin_interval, batch_size)
+
+    elif rule.level is not None:
+        return delete_in_batches(
+            connection,
+            rule.table,
+            "UPPER(level) = UPPER(?) AND timestamp < ?",
+            (rule.level, cutoff),
+            batch_size=batch_size,
+        )
+
+    else:
+        return delete_in_batches(
+            connection, rule.table, "timestamp < ?", (cutoff,), batch_size=batch_size
+        )
+
+
+class DatabaseRetention(BackgroundJob):
+    def __init__(self, unit, experiment, interval=60 * 60):
+        super(DatabaseRetention, self).__init__(
+            job_name="database_retention", unit=unit, experiment=experiment
+        )
+        self.rules = get_retention_rules()
+        self.logger.debug(f"Retention rules: {self.rules}")
+
+        self.enforce_thread = RepeatedTimer(
+            interval, self.enforce, job_name=self.job_name, run_after=60
+        ).start()
+
+    def on_disconnect(self):
+        self.enforce_thread.cancel()
+
+    def enforce(self):
+        from pioreactor.utils.log_store import get_log_database
+
+        for database, rules in [
+            (config["storage"]["database"], [r for r in self.rules if r.table != "logs"]),
+            # logs live in their own database, see pioreactor.utils.log_store
+            (
+                get_log_database(),
+                [
+                    r
+                    for r in self.rules
+                    if r.table == "logs" or r.experiment_glob is not None
+                ],
+            ),
+        ]:
+            if rules:
+                self.enforce_rules(database, rules)
+
+    def enforce_rules(self, database, rules):
+        connection = sqlite3.connect(database, timeout=5)
+        try:
+            for rule in rules:
+                if self.state == self.DISCONNECTED:
+                    return
+
+                try:
+                    n_deleted = enforce_rule(connection, rule)
+                except sqlite3.OperationalError as e:
+                    # ex: database is locked. We'll try again next run.
+                    self.logger.debug(f"Unable to enforce {rule}: {e}")
+                    continue
+
+                if n_deleted:
+                    self.logger.info(
+                        f"Deleted {n_deleted} rows from {rule.table or 'experiments matching ' + rule.experiment_glob}."
+                    )
+        finally:
+            connection.close()
+
+
+@click.command(name="database_retention")
+def click_database_retention():
+    """
+    (leader only) Enforce the retention rules in [storage.retention] on the database.
+    """
+    DatabaseRetention(unit=get_unit_name(), experiment=UNIVERSAL_EXPERIMENT)
+
+    signal.pause()
@@ -4,32 +4,86 @@ This job runs on the leader, and is a replacement for the NodeRed database strea
 """
 import signal
 import os
+import inspect
 import click
 import json
-from collections import namedtuple
+import queue
+import threading
+import time
+import zlib
+from collections import namedtuple, defaultdict
 from dataclasses import dataclass
+from functools import partial
 
 
-from pioreactor.pubsub import QOS
+from pioreactor.pubsub import QOS, TopicTrie
+from pioreactor import structs
 from pioreactor.background_jobs.base import BackgroundJob
 from pioreactor.whoami import get_unit_name, UNIVERSAL_EXPERIMENT
-from pioreactor.config import config
-from pioreactor.utils.timing import current_utc_time
+from pioreactor.config import config, leader_hostname
+from pioreactor.utils.timing import current_utc_time, RepeatedTimer
+from pioreactor.utils.sqlite_writer import SqliteWriter, OVERFLOW, AfterInsert
+from pioreactor.utils.rollups import rollup_upserts, ROLLUP_SOURCES
+from pioreactor.utils.log_store import LogStore, get_log_database
+from pioreactor.utils.sequences import SequenceTracker
+from pioreactor.actions.leader.migrate_database import (
+    migrate_database,
+    to_epoch,
+    TIME_SERIES_TABLES,
+    SEQUENCED_TABLES,
+)
 
 JOB_NAME = os.path.splitext(os.path.basename((__file__)))[0]
 
-SetAttrSplitTopic = namedtuple(
-    "SetAttrSplitTopic", ["pioreactor_unit", "experiment", "timestamp"]
-)
+
+class SetAttrSplitTopic:
+    """
+    The unit and experiment of a topic. The timestamp (now) is only computed if a parser asks for it:
+    most payloads carry their own.
+    """
+
+    __slots__ = ("pioreactor_unit", "experiment")
+
+    def __init__(self, pioreactor_unit, experiment):
+        self.pioreactor_unit = pioreactor_unit
+        self.experiment = experiment
+
+    @property
+    def timestamp(self):
+        return current_utc_time()
+
 
 TopicToParserToTable = namedtuple("TopicToParserToTable", ["topic", "parser", "table"])
 
+# what to do with a table's rows when the database writer falls behind. Tables not listed block the streamer until
+# there is room (see pioreactor.utils.sqlite_writer).
+OVERFLOW_POLICIES = {
+    "od_readings_raw": OVERFLOW.DROP_OLDEST,
+    "od_readings_filtered": OVERFLOW.DROP_OLDEST,
+    "kalman_filter_outputs": OVERFLOW.DROP_OLDEST,
+    "temperature_readings": OVERFLOW.DROP_OLDEST,
+    "stirring_rates": OVERFLOW.DROP_OLDEST,
+    "dosing_events": OVERFLOW.NEVER_DROP,
+    "led_events": OVERFLOW.NEVER_DROP,
+}
+
+# with ingest workers, rows of these tables keep their per-unit order: each unit's messages are always handled by
+# the same worker. Other tables' messages are spread across workers with a shared subscription.
+ORDERED_TABLES = {
+    "dosing_events",
+    "led_events",
+    "dosing_automation_settings",
+    "led_automation_settings",
+    "temperature_automation_settings",
+}
+
 
 @dataclass
 class TopicToParserToTableContrib:
     """
     plugins subclass this.
-    parser (callable) must accept (topic: str, payload: str)
+    parser (callable) must accept (topic: str, payload: str), and optionally a third argument, the
+    topic already split on "/".
 
     TODO: untested
     """
@@ -45,227 +99,550 @@ class TopicToParserToTableContrib:
 
 
 class MqttToDBStreamer(BackgroundJob):
+    """
+    Rows aren't inserted one message at a time. They are buffered per table and handed to the database
+    writer (one `executemany`) when a table has `batch_size` rows waiting, or every `flush_interval` seconds,
+    whichever comes first. Batching and writer metrics are published
+    to `pioreactor/<unit>/<experiment>/mqtt_to_db_streaming/batching_metrics` every minute.
+
+    Telemetry carries a sequence number per (unit, source), see pioreactor.utils.sequences. Rows whose sequence number
+    was seen recently are skipped before they are buffered (which also keeps them out of the rollups), and the rest
+    are inserted with INSERT OR IGNORE, so a unique index skips older duplicates. Counts of duplicates and gaps are
+    part of the batching metrics.
+
+    There is a single `pioreactor/#` subscription. Each message's topic is split once, and routed through
+    a trie of all the tables' topic patterns (including plugins'), so routing costs the same however many tables there are.
+
+    With `ingest_workers` > 1 in config.ini, messages are instead received and parsed by that many worker
+    processes (see `ingest_worker`), which send their parsed rows back here over a queue. This process still
+    owns the only database writer.
+    """
 
     topics_to_tables_from_plugins = []
 
     def __init__(self, topics_to_tables, **kwargs):
 
-        from sqlite3worker import Sqlite3Worker
+        self.batch_size = config.getint(
+            "mqtt_to_db_streaming", "batch_size", fallback=100
+        )
+        self.flush_interval = config.getfloat(
+            "mqtt_to_db_streaming", "flush_interval", fallback=2.0
+        )
+        topics_to_tables.extend(self.topics_to_tables_from_plugins)
+
+        # ingest workers are forked before this job starts any threads (MQTT clients, timers, the writer): a forked
+        # process only has the thread that forked it, and a lock held by any other thread at that moment is never released.
+        self.n_ingest_workers = config.getint(
+            "mqtt_to_db_streaming", "ingest_workers", fallback=1
+        )
+        if self.n_ingest_workers > 1:
+            self.start_ingest_workers(topics_to_tables)
 
         super(MqttToDBStreamer, self).__init__(job_name=JOB_NAME, **kwargs)
-        self.sqliteworker = Sqlite3Worker(
-            config["storage"]["database"], max_queue_size=250, raise_on_error=False
+        migrate_database(config["storage"]["database"])
+        self.writer = SqliteWriter(
+            config["storage"]["database"],
+            max_queue_size=config.getint(
+                "mqtt_to_db_streaming", "max_queue_size", fallback=1000
+            ),
+            # WAL checkpoints run on their own thread, off the write path. See pioreactor.utils.sqlite_writer
+            checkpoint_interval=config.getfloat(
+                "mqtt_to_db_streaming", "checkpoint_interval", fallback=10.0
+            ),
+            checkpoint_idle_after=config.getfloat(
+                "mqtt_to_db_streaming", "checkpoint_idle_after", fallback=5.0
+            ),
+            max_wal_size=config.getint(
+                "mqtt_to_db_streaming", "max_wal_size_mb", fallback=64
+            )
+            * 1024
+            * 1024,
+            force_restart_after=config.getfloat(
+                "mqtt_to_db_streaming", "checkpoint_force_restart_after", fallback=300.0
+            ),
         )
 
-        topics_to_tables.extend(self.topics_to_tables_from_plugins)
+        # log lines go to their own database, with their own writer. See pioreactor.utils.log_store
+        self.log_store = LogStore(get_log_database())
 
-        topics_and_callbacks = [
-            {
-                "topic": topic_to_table.topic,
-                "callback": self.create_on_message_callback(
-                    topic_to_table.parser, topic_to_table.table
-                ),
-            }
-            for topic_to_table in topics_to_tables
-        ]
+        # (table, columns, overflow) -> list of rows. Rows of the same table can have different columns (ex: automation
+        # settings), and rows from edge stores are never dropped, see ingest_edge_batch.
+        self._buffers = defaultdict(list)
+        self._oldest_row_at = {}
+        self._buffer_lock = threading.Lock()
+        # held while batches are taken from the buffers and handed to the writer, so they reach it in order.
+        self._flush_lock = threading.Lock()
+        self._reset_batching_metrics()
+
+        self.sequence_tracker = SequenceTracker(
+            window=config.getint("mqtt_to_db_streaming", "dedupe_window", fallback=1000)
+        )
 
-        self.start_passive_listeners(topics_and_callbacks)
+        self.flush_thread = RepeatedTimer(
+            self.flush_interval, self.flush_all, job_name=self.job_name
+        ).start()
+        self.batching_metrics_thread = RepeatedTimer(
+            60, self.publish_batching_metrics, job_name=self.job_name
+        ).start()
+
+        # batches uploaded from workers' edge stores are routed here, see pioreactor.utils.edge_store
+        self.router = create_router(topics_to_tables)
+        self.edge_watermarks = self.load_edge_watermarks()
+
+        if self.n_ingest_workers > 1:
+            self.start_consuming_rows_queue()
+        else:
+            self.start_passive_listeners()
+
+        # edge batches are stored on their own thread: ingest_edge_batch waits for the database, and mustn't block
+        # the MQTT client's network thread.
+        self.edge_batches = queue.Queue()
+        self.edge_batches_thread = threading.Thread(
+            target=self.consume_edge_batches, daemon=True
+        )
+        self.edge_batches_thread.start()
+        self.subscribe_and_callback(
+            self.edge_batches.put,
+            "pioreactor/+/+/edge_sync/batch",
+            qos=QOS.AT_LEAST_ONCE,
+            allow_retained=False,
+        )
 
     def on_disconnect(self):
-        self.sqliteworker.close()  # close the db safely
+        if self.n_ingest_workers > 1:
+            self.stop_ingest_workers()
+        self.edge_batches.put(None)
+        self.edge_batches_thread.join()
+        self.flush_thread.cancel()
+        self.batching_metrics_thread.cancel()
+        self.flush_all()
+        self.writer.close()  # writes what's left, and closes the db safely
+        self.log_store.close()
+
+    def buffer_row(self, table, new_row, overflow=None):
+        if table == "logs":
+            self.log_store.add(new_row)
+            return
+
+        if (
+            (table in SEQUENCED_TABLES)
+            and (new_row.get("seq") is not None)
+            and not self.sequence_tracker.is_new(
+                new_row["pioreactor_unit"], new_row["source"], new_row["seq"]
+            )
+        ):
+            return
+
+        add_timestamp_epoch(table, new_row)
+
+        key = (
+            table,
+            tuple(new_row.keys()),
+            overflow or OVERFLOW_POLICIES.get(table, OVERFLOW.BLOCK),
+        )
+        with self._buffer_lock:
+            self._buffers[key].append(tuple(new_row.values()))
+            self._oldest_row_at.setdefault(key, time.monotonic())
+            is_full = len(self._buffers[key]) >= self.batch_size
+
+        if is_full:
+            self._flush([key])
+
+    def flush_all(self):
+        with self._buffer_lock:
+            keys = list(self._buffers)
+        self._flush(keys)
+
+    def _flush(self, keys):
+        # the writer can block (see OVERFLOW.BLOCK), so it's called after releasing _buffer_lock, which every
+        # incoming message needs.
+        with self._flush_lock:
+            with self._buffer_lock:
+                batches = [
+                    (key, self._buffers.pop(key, []), self._oldest_row_at.pop(key, None))
+                    for key in keys
+                ]
+
+            for key, rows, oldest_row_at in batches:
+                if rows:
+                    self._write(key, rows, oldest_row_at)
+
+    def _write(self, key, rows, oldest_row_at):
+        table, columns, overflow = key
+        cols_placeholder = ", ".join(columns)
+        values_placeholder = ", ".join(["?"] * len(columns))
+        insert = "INSERT OR IGNORE" if table in SEQUENCED_TABLES else "INSERT"
+        SQL = f"""{insert} INTO {table} ({cols_placeholder}) VALUES ({values_placeholder})"""
+        # keep the downsampled rollups up to date, from the rows of this batch that were inserted: duplicates
+        # the tracker didn't catch (ex: after a restart) are ignored by the unique index, and mustn't be counted twice.
+        then = (
+            AfterInsert(table, columns, partial(rollup_upserts, table, columns))
+            if table in ROLLUP_SOURCES
+            else None
+        )
+        self.writer.executemany(SQL, rows, overflow=overflow, then=then)
+
+        with self._buffer_lock:
+            self._batch_sizes.append(len(rows))
+            self._flush_latencies.append(time.monotonic() - oldest_row_at)
+
+    def _reset_batching_metrics(self):
+        self._batch_sizes = []
+        self._flush_latencies = []
+
+    def publish_batching_metrics(self):
+        with self._buffer_lock:
+            batch_sizes, flush_latencies = self._batch_sizes, self._flush_latencies
+            rows_buffered = sum(len(rows) for rows in self._buffers.values())
+            self._reset_batching_metrics()
+
+        self.publish(
+            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/batching_metrics",
+            {
+                "timestamp": current_utc_time(),
+                "rows_buffered": rows_buffered,
+                "batches_written": len(batch_sizes),
+                "mean_batch_size": (sum(batch_sizes) / len(batch_sizes))
+                if batch_sizes
+                else None,
+                "max_batch_size": max(batch_sizes, default=None),
+                # time between a row arriving and its batch being sent to the database
+                "mean_flush_latency_s": (sum(flush_latencies) / len(flush_latencies))
+                if flush_latencies
+                else None,
+                "max_flush_latency_s": max(flush_latencies, default=None),
+                # cumulative counts from the writer: rows_queued, rows_written, rows_dropped, rows_failed, the queue_depth,
+                # and checkpoints: their count, durations and the wal_size_bytes
+                **self.writer.metrics(),
+                "logs": self.log_store.metrics(),
+                # duplicates skipped, gaps in sequences, late messages that filled a gap, and seqs still missing
+                "sequences": self.sequence_tracker.metrics(),
+            },
+        )
+
+    def route_message(self, message):
+        self.route(message.topic, message.payload)
 
-    def create_on_message_callback(self, parser, table):
-        def _callback(message):
-            # TODO: filter testing experiments here
+    def route(self, topic, payload, overflow=None):
+        # TODO: filter testing experiments here
+        split_topic = topic.split("/")
+        for parser, table in self.router.match(split_topic):
             try:
-                new_row = parser(message.topic, message.payload)
+                new_row = parser(topic, payload, split_topic)
             except Exception as e:
-                self.logger.debug(
-                    f"message.payload that caused error: `{message.payload}`"
-                )
+                self.logger.debug(f"message.payload that caused error: `{payload}`")
                 raise e
 
             if new_row is None:
                 # parsers can return None to exit out.
-                return
+                continue
 
-            cols_placeholder = ", ".join(new_row.keys())
-            values_placeholder = ", ".join([":" + c for c in new_row.keys()])
-            SQL = f"""INSERT INTO {table} ({cols_placeholder}) VALUES ({values_placeholder})"""
-            self.sqliteworker.execute(SQL, new_row)
+            self.buffer_row(table, new_row, overflow=overflow)
 
-        return _callback
+    def load_edge_watermarks(self):
+        from pioreactor.utils.sqlite_reader import get_reader
 
-    def start_passive_listeners(self, topics_and_callbacks):
-        for topic_and_callback in topics_and_callbacks:
-            self.subscribe_and_callback(
-                topic_and_callback["callback"],
-                topic_and_callback["topic"],
-                qos=QOS.EXACTLY_ONCE,
-                allow_retained=False,
+        return dict(
+            get_reader(config["storage"]["database"]).query(
+                "SELECT pioreactor_unit, seq FROM edge_sync_watermarks"
             )
+        )
 
+    def ingest_edge_batch(self, message):
+        """
+        Store a batch of messages uploaded from a worker's edge store, skipping those we've already stored, then
+        reply with the new watermark once they are in the database. If we can't, we don't reply, and the worker sends
+        the batch again later.
+        """
+        from pioreactor.utils.edge_store import decode_batch
+
+        unit = message.topic.split("/")[1]
+        watermark = self.edge_watermarks.get(unit, 0)
+        rows = decode_batch(message.payload)
+
+        n_ingested = 0
+        for seq, topic, payload in rows:
+            if seq <= watermark:
+                continue
+            try:
+                # the worker deletes what we acknowledge: these rows can't be dropped like live telemetry.
+                self.route(topic, payload, overflow=OVERFLOW.NEVER_DROP)
+            except Exception as e:
+                # a message we can't parse live is dropped live, too.
+                self.logger.debug(f"Skipping edge message {seq} from {unit}: {e}")
+            n_ingested += 1
+
+        new_watermark = max([watermark] + [seq for seq, _, _ in rows])
+        self.flush_all()
+        self.writer.execute(
+            """INSERT INTO edge_sync_watermarks (pioreactor_unit, seq) VALUES (?, ?)
+            ON CONFLICT (pioreactor_unit) DO UPDATE SET seq = MAX(seq, excluded.seq)""",
+            (unit, new_watermark),
+            overflow=OVERFLOW.NEVER_DROP,
+        )
+        if not self.writer.flush(timeout=30):
+            self.logger.debug(f"Timed out storing edge messages from {unit}.")
+            return
+
+        self.edge_watermarks[unit] = new_watermark
+        self.publish(
+            f"pioreactor/{unit}/{UNIVERSAL_EXPERIMENT}/edge_sync/watermark",
+            new_watermark,
+            retain=True,
+            qos=QOS.AT_LEAST_ONCE,
+        )
+        self.logger.debug(
+            f"Stored {n_ingested} edge messages from {unit}, up to {new_watermark}."
+        )
 
-def produce_metadata(topic):
-    # helper function for parsers below
-    split_topic = topic.split("/")
-    return (
-        SetAttrSplitTopic(split_topic[1], split_topic[2], current_utc_time()),
-        split_topic,
-    )
+    def consume_edge_batches(self):
+        while True:
+            message = self.edge_batches.get()
+            if message is None:
+                return
+            try:
+                self.ingest_edge_batch(message)
+            except Exception as e:
+                # the worker sends the batch again later.
+                self.logger.error(f"Failed to store edge batch from {message.topic}: {e}")
+
+    def start_ingest_workers(self, topics_to_tables):
+        import multiprocessing
+
+        # fork: the parsers are closures, and can't be pickled. This runs before the job has any threads, see __init__.
+        context = multiprocessing.get_context("fork")
+        self.rows_queue = context.Queue(maxsize=1000)
+        self.stop_ingest_event = context.Event()
+        self.ingest_workers = [
+            context.Process(
+                target=ingest_worker,
+                args=(
+                    index,
+                    self.n_ingest_workers,
+                    topics_to_tables,
+                    self.rows_queue,
+                    self.stop_ingest_event,
+                    self.batch_size,
+                    self.flush_interval,
+                ),
+                daemon=True,
+            )
+            for index in range(self.n_ingest_workers)
+        ]
+        for process in self.ingest_workers:
+            process.start()
 
+    def start_consuming_rows_queue(self):
+        self.rows_queue_thread = threading.Thread(
+            target=self.consume_rows_queue, daemon=True
+        )
+        self.rows_queue_thread.start()
+        self.logger.debug(f"Started {self.n_ingest_workers} ingest workers.")
 
-def mqtt_to_db_streaming():
+    def consume_rows_queue(self):
+        while True:
+            rows = self.rows_queue.get()
+            if rows is None:
+                return
+            for table, new_row in rows:
+                self.buffer_row(table, new_row)
+
+    def stop_ingest_workers(self):
+        # workers send what they have left, and exit.
+        self.stop_ingest_event.set()
+        for process in self.ingest_workers:
+            process.join(timeout=2 * self.flush_interval + 5)
+            if process.is_alive():
+                process.terminate()
+        self.rows_queue.put(None)
+        self.rows_queue_thread.join()
+
+    def start_passive_listeners(self):
+        # EXACTLY_ONCE is the maximum QoS: messages are delivered at the QoS they were published with,
+        # which pubsub.QOS_POLICIES sets.
+        self.subscribe_and_callback(
+            self.route_message,
+            "pioreactor/#",
+            qos=QOS.EXACTLY_ONCE,
+            allow_retained=False,
+        )
 
-    ###################
-    # parsers
-    ###################
-    # - must return a dictionary with the column names (order isn't important)
-    # - `produce_metadata` is a helper function, see defintion.
-    # - parsers can return None as well, to skip adding the message to the database.
-    #
 
-    def parse_od(topic, payload):
-        metadata, split_topic = produce_metadata(topic)
-        payload = json.loads(payload)
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "od_reading_v": payload["voltage"],
-            "angle": payload["angle"],
-            "channel": split_topic[-1],
-        }
+def add_timestamp_epoch(table, new_row):
+    if (table in TIME_SERIES_TABLES) and ("timestamp_epoch" not in new_row):
+        new_row["timestamp_epoch"] = to_epoch(new_row["timestamp"])
 
-    def parse_od_filtered(topic, payload):
-        metadata, split_topic = produce_metadata(topic)
-        payload = json.loads(payload)
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "normalized_od_reading": payload["od_filtered"],
-            "angle": payload["angle"],
-            "channel": split_topic[-1],
-        }
+def create_router(topics_to_tables):
+    router = TopicTrie()
+    for topic_to_table in topics_to_tables:
+        router.add(
+            topic_to_table.topic,
+            (with_split_topic(topic_to_table.parser), topic_to_table.table),
+        )
+    return router
 
-    def parse_dosing_events(topic, payload):
-        payload = json.loads(payload)
-        metadata, _ = produce_metadata(topic)
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "volume_change_ml": payload["volume_change"],
-            "event": payload["event"],
-            "source_of_event": payload["source_of_event"],
-        }
+def partition(pioreactor_unit, n_partitions):
+    return zlib.crc32(pioreactor_unit.encode()) % n_partitions
 
-    def parse_led_events(topic, payload):
-        payload = json.loads(payload)
-        metadata, _ = produce_metadata(topic)
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "channel": payload["channel"],
-            "intensity": payload["intensity"],
-            "event": payload["event"],
-            "source_of_event": payload["source_of_event"],
+def ingest_worker(
+    index, n_workers, topics_to_tables, rows_queue, stop_event, batch_size, flush_interval
+):
+    """
+    Runs in its own process. Receives messages, parses them, and sends the parsed rows, in batches, over
+    rows_queue to the MqttToDBStreamer (and its database writer).
+
+    Tables in ORDERED_TABLES are subscribed to by every worker, and each worker only keeps the units in its partition,
+    so a unit's rows are always handled, in order, by the same worker. The rest are subscribed to with a
+    shared subscription, `$share/db/<topic>`, and the broker spreads their messages across the workers.
+    A topic should be matched by either ordered or shared tables' patterns, not both, else it's received twice.
+    """
+    from paho.mqtt.client import Client
+    from pioreactor.logging import create_logger
+
+    logger = create_logger(f"{JOB_NAME}.ingest_worker", to_mqtt=False)
+    router = create_router(topics_to_tables)
+    subscriptions = sorted(
+        {
+            (
+                t.topic if t.table in ORDERED_TABLES else f"$share/db/{t.topic}",
+                QOS.EXACTLY_ONCE,
+            )
+            for t in topics_to_tables
         }
+    )
 
-    def parse_growth_rate(topic, payload):
-        metadata, _ = produce_metadata(topic)
-        payload = json.loads(payload)
+    batch = []
+    batch_lock = threading.Lock()
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "rate": float(payload["growth_rate"]),
-        }
+    def send_batch():
+        nonlocal batch
+        with batch_lock:
+            rows, batch = batch, []
+        if rows:
+            rows_queue.put(rows)
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        # clean session: the broker has forgotten our subscriptions.
+        client.subscribe(subscriptions)
+
+    def on_message(client, userdata, message):
+        # like the streamer's own subscriptions: retained messages were already written when first published.
+        if message.retain:
+            return
+
+        split_topic = message.topic.split("/")
+        for parser, table in router.match(split_topic):
+            if (table in ORDERED_TABLES) and partition(
+                split_topic[1], n_workers
+            ) != index:
+                continue
 
-    def parse_temperature(topic, payload):
-        metadata, _ = produce_metadata(topic)
+            try:
+                new_row = parser(message.topic, message.payload, split_topic)
+            except Exception as e:
+                logger.debug(f"message.payload that caused error: `{message.payload}`")
+                logger.error(e)
+                continue
+
+            if new_row is None:
+                continue
+
+            add_timestamp_epoch(table, new_row)
+            with batch_lock:
+                batch.append((table, new_row))
+                full = len(batch) >= batch_size
+
+            if full:
+                send_batch()
+
+    client = Client(client_id=f"{JOB_NAME}-ingest-{index}-{get_unit_name()}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(leader_hostname)
+    client.loop_start()
+
+    while not stop_event.wait(flush_interval):
+        send_batch()
+
+    client.loop_stop()
+    client.disconnect()
+    send_batch()
+
+
+def with_split_topic(parser):
+    """
+    Our parsers accept (topic, payload, split_topic). Plugins' parsers may only accept (topic, payload).
+    """
+    try:
+        n_parameters = len(inspect.signature(parser).parameters)
+    except (TypeError, ValueError):
+        n_parameters = 3
+
+    if n_parameters >= 3:
+        return parser
+    return lambda topic, payload, split_topic: parser(topic, payload)
+
+
+def parser_for(message_type):
+    """
+    A parser for a message type of pioreactor.structs: the payload is decoded (and checked) against the schema, and
+    mapped to its table's columns. Empty payloads (ex: a cleared retained message) are skipped.
+    """
 
+    def parse(topic, payload, split_topic):
         if not payload:
             return None
+        return message_type.from_json(payload).to_row(split_topic)
 
-        payload = json.loads(payload)
+    return parse
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "temperature_c": float(payload["temperature"]),
-        }
 
-    def parse_pid_logs(topic, payload):
-        metadata, _ = produce_metadata(topic)
-        payload = json.loads(payload)
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": metadata.timestamp,
-            "setpoint": payload["setpoint"],
-            "output_limits_lb": payload["output_limits_lb"],
-            "output_limits_ub": payload["output_limits_ub"],
-            "Kd": payload["Kd"],
-            "Ki": payload["Ki"],
-            "Kp": payload["Kp"],
-            "integral": payload["integral"],
-            "proportional": payload["proportional"],
-            "derivative": payload["derivative"],
-            "latest_input": payload["latest_input"],
-            "latest_output": payload["latest_output"],
-            "job_name": payload["job_name"],
-            "target_name": payload["target_name"],
-        }
+def produce_metadata(topic, split_topic=None):
+    # helper function for parsers below
+    split_topic = split_topic or topic.split("/")
+    return (
+        SetAttrSplitTopic(split_topic[1], split_topic[2]),
+        split_topic,
+    )
 
-    def parse_alt_media_fraction(topic, payload):
-        metadata, _ = produce_metadata(topic)
-        payload = json.loads(payload)
 
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "alt_media_fraction": float(payload["alt_media_fraction"]),
-        }
+def mqtt_to_db_streaming():
 
-    def parse_logs(topic, payload):
-        metadata, split_topic = produce_metadata(topic)
-        payload = json.loads(payload)
-        return {
-            "experiment": metadata.experiment,
-            "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": payload["timestamp"],
-            "message": payload["message"],
-            "task": payload["task"],
-            "level": payload["level"],
-            "source": split_topic[-1],  # should be app, ui, etc.
-        }
+    ###################
+    # parsers
+    ###################
+    # - must return a dictionary with the column names (order isn't important)
+    # - `produce_metadata` is a helper function, see defintion.
+    # - split_topic is the topic, already split on "/".
+    # - parsers can return None as well, to skip adding the message to the database.
+    # - messages with a schema in pioreactor.structs use `parser_for` instead.
+    #
+
+    def parse_kalman_filter_outputs(topic, payload, split_topic):
+        from pioreactor.utils.matrix_blobs import pack_array
 
-    def parse_kalman_filter_outputs(topic, payload):
-        metadata, _ = produce_metadata(topic)
-        payload = json.loads(payload)
+        metadata, _ = produce_metadata(topic, split_topic)
+        outputs = structs.KalmanFilterOutputs.from_json(payload)
         return {
             "experiment": metadata.experiment,
             "pioreactor_unit": metadata.pioreactor_unit,
-            "timestamp": metadata.timestamp,
-            "state": json.dumps(payload["state"]),
-            "covariance_matrix": json.dumps(payload["covariance_matrix"]),
+            "timestamp": outputs.timestamp,
+            # packed binary, see pioreactor.utils.matrix_blobs for decoding.
+            "state": pack_array(outputs.state, dtype="float64"),
+            "covariance_matrix": pack_array(
+                outputs.covariance_matrix, dtype="float32", upper_triangle=True
+            ),
         }
 
-    def parse_automation_settings(topic, payload):
+    def parse_automation_settings(topic, payload, split_topic):
         payload = json.loads(payload.decode())
         return payload
 
-    def parse_stirring_rates(topic, payload):
-        metadata = produce_metadata(topic)
+    def parse_stirring_rates(topic, payload, split_topic):
+        metadata, _ = produce_metadata(topic, split_topic)
         return {
             "experiment": metadata.experiment,
             "pioreactor_unit": metadata.pioreactor_unit,
@@ -273,8 +650,8 @@ def mqtt_to_db_streaming():
             "rpm": float(payload),
         }
 
-    def parse_od_statistics(topic, payload):
-        metadata, split_topic = produce_metadata(topic)
+    def parse_od_statistics(topic, payload, split_topic):
+        metadata, _ = produce_metadata(topic, split_topic)
         return {
             "experiment": metadata.experiment,
             "pioreactor_unit": metadata.pioreactor_unit,
@@ -287,33 +664,43 @@ def mqtt_to_db_streaming():
     topics_to_tables = [
         TopicToParserToTable(
             "pioreactor/+/+/growth_rate_calculating/od_filtered/+",
-            parse_od_filtered,
+            parser_for(structs.ODFiltered),
             "od_readings_filtered",
         ),
         TopicToParserToTable(
-            "pioreactor/+/+/od_reading/od_raw/+", parse_od, "od_readings_raw"
+            "pioreactor/+/+/od_reading/od_raw/+",
+            parser_for(structs.ODReading),
+            "od_readings_raw",
+        ),
+        TopicToParserToTable(
+            "pioreactor/+/+/dosing_events",
+            parser_for(structs.DosingEvent),
+            "dosing_events",
         ),
         TopicToParserToTable(
-            "pioreactor/+/+/dosing_events", parse_dosing_events, "dosing_events"
+            "pioreactor/+/+/led_events", parser_for(structs.LEDEvent), "led_events"
         ),
-        TopicToParserToTable("pioreactor/+/+/led_events", parse_led_events, "led_events"),
         TopicToParserToTable(
             "pioreactor/+/+/growth_rate_calculating/growth_rate",
-            parse_growth_rate,
+            parser_for(structs.GrowthRate),
             "growth_rates",
         ),
         TopicToParserToTable(
             "pioreactor/+/+/temperature_control/temperature",
-            parse_temperature,
+            parser_for(structs.Temperature),
             "temperature_readings",
         ),
-        TopicToParserToTable("pioreactor/+/+/pid_log", parse_pid_logs, "pid_logs"),
+        TopicToParserToTable(
+            "pioreactor/+/+/pid_log", parser_for(structs.PIDStats), "pid_logs"
+        ),
         TopicToParserToTable(
             "pioreactor/+/+/alt_media_calculating/alt_media_fraction",
-            parse_alt_media_fraction,
+            parser_for(structs.AltMediaFraction),
             "alt_media_fraction",
         ),
-        TopicToParserToTable("pioreactor/+/+/logs/+", parse_logs, "logs"),
+        TopicToParserToTable(
+            "pioreactor/+/+/logs/+", parser_for(structs.LogMessage), "logs"
+        ),
         TopicToParserToTable(
             "pioreactor/+/+/dosing_automation/dosing_automation_settings",
             parse_automation_settings,
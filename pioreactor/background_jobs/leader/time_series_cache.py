@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+This job runs on the leader, and keeps the recent history of the time series the UI charts (OD, growth rate,
+temperature) in memory, so live charts don't have to query the database.
+
+Each (experiment, unit, series) has a ring buffer of (time, value), fed from the same MQTT topics the
+database streamer listens to. On start, the buffers are filled from the database. Series are named after
+their table, ex: `growth_rates`, `od_readings_filtered/A0`.
+
+They are served over HTTP, to localhost only:
+
+    GET http://localhost:<port>/series?experiment=exp1&series=growth_rates&unit=unit1&since=1622548800&points=500
+
+returns
+
+    {"unit1": {"growth_rates": {"x": [<epoch seconds>, ...], "y": [...]}}}
+
+unit, series and since (epoch seconds) are optional. If points is given, each series is downsampled to at most that
+many points (see pioreactor.utils.downsampling.lttb).
+"""
+import json
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import click
+
+from pioreactor.background_jobs.base import BackgroundJob
+from pioreactor.config import config
+from pioreactor.pubsub import QOS, TopicTrie
+from pioreactor.utils.timing import RepeatedTimer
+from pioreactor.whoami import get_unit_name, UNIVERSAL_EXPERIMENT
+
+# topic -> (table, payload key of the value, is the series per channel?)
+TOPICS_TO_SERIES = {
+    "pioreactor/+/+/od_reading/od_raw/+": ("od_readings_raw", "voltage", True),
+    "pioreactor/+/+/growth_rate_calculating/od_filtered/+": (
+        "od_readings_filtered",
+        "od_filtered",
+        True,
+    ),
+    "pioreactor/+/+/growth_rate_calculating/growth_rate": (
+        "growth_rates",
+        "growth_rate",
+        False,
+    ),
+    "pioreactor/+/+/temperature_control/temperature": (
+        "temperature_readings",
+        "temperature",
+        False,
+    ),
+}
+
+# table -> value column, to fill the buffers from the database on start
+TABLE_VALUE_COLUMNS = {
+    "od_readings_raw": "od_reading_v",
+    "od_readings_filtered": "normalized_od_reading",
+    "growth_rates": "rate",
+    "temperature_readings": "temperature_c",
+}
+
+
+class RingBuffer:
+    """
+    The last `capacity` (time, value) pairs, in two preallocated arrays. Times are epoch seconds.
+    """
+
+    def __init__(self, capacity):
+        import numpy as np
+
+        self.capacity = capacity
+        self.times = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float32)
+        self.head = 0  # where the next value goes
+        self.size = 0
+
+    @property
+    def latest_time(self):
+        return self.times[self.head - 1] if self.size else None
+
+    def append(self, t, value):
+        # keep times sorted: ignore values older than the latest, ex: a retransmitted message.
+        if self.size and t < self.latest_time:
+            return
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def window(self, since=None):
+        """
+        (times, values), oldest first, of values at or after since.
+        """
+        import numpy as np
+
+        if self.size < self.capacity:
+            times, values = self.times[: self.size], self.values[: self.size]
+        else:
+            times = np.roll(self.times, -self.head)
+            values = np.roll(self.values, -self.head)
+
+        if since is not None:
+            start = np.searchsorted(times, since, side="left")
+            times, values = times[start:], values[start:]
+        return times.copy(), values.astype(np.float64)
+
+
+class TimeSeriesStore:
+    """
+    Ring buffers keyed by (experiment, unit, series). Values older than `hours` are not returned.
+    """
+
+    def __init__(self, hours=12, capacity=20_000):
+        self.hours = hours
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def append(self, experiment, unit, series, t, value):
+        key = (experiment, unit, series)
+        with self._lock:
+            if key not in self._buffers:
+                self._buffers[key] = RingBuffer(self.capacity)
+            self._buffers[key].append(t, value)
+
+    def query(self, experiment, units=None, series=None, since=None, points=None):
+        from pioreactor.utils.downsampling import lttb
+
+        oldest = time.time() - self.hours * 60 * 60
+        since = oldest if since is None else max(since, oldest)
+
+        with self._lock:
+            windows = {
+                (unit, series_): buffer.window(since)
+                for (experiment_, unit, series_), buffer in self._buffers.items()
+                if experiment_ == experiment
+                and (not units or unit in units)
+                and (not series or series_ in series)
+            }
+
+        result = {}
+        for (unit, series_), (times, values) in windows.items():
+            if points:
+                times, values = lttb(times, values, points)
+            result.setdefault(unit, {})[series_] = {
+                "x": times.tolist(),
+                "y": values.tolist(),
+            }
+        return result
+
+    def drop_stale(self):
+        """
+        Forget series with nothing in the window, ex: of experiments that have ended.
+        """
+        oldest = time.time() - self.hours * 60 * 60
+        with self._lock:
+            for key in [k for k, b in self._buffers.items() if b.latest_time < oldest]:
+                del self._buffers[key]
+
+
+def handle_query(store, query_string):
+    params = parse_qs(query_string)
+    if "experiment" not in params:
+        raise ValueError("experiment is required.")
+
+    return store.query(
+        params["experiment"][0],
+        units=params.get("unit"),
+        series=params.get("series"),
+        since=float(params["since"][0]) if "since" in params else None,
+        points=int(params["points"][0]) if "points" in params else None,
+    )
+
+
+class TimeSeriesCache(BackgroundJob):
+    def __init__(self, unit, experiment):
+        super(TimeSeriesCache, self).__init__(
+            job_name="time_series_cache", unit=unit, experiment=experiment
+        )
+        self.store = TimeSeriesStore(
+            hours=config.getfloat("time_series_cache", "hours", fallback=12),
+            capacity=config.getint("time_series_cache", "max_points", fallback=20_000),
+        )
+
+        self.router = TopicTrie()
+        for topic, series in TOPICS_TO_SERIES.items():
+            self.router.add(topic, series)
+
+        self.load_from_database()
+        self.start_passive_listeners()
+
+        self.server = self.start_server(
+            config.getint("time_series_cache", "port", fallback=8091)
+        )
+
+        self.cleanup_thread = RepeatedTimer(
+            60 * 60, self.store.drop_stale, job_name=self.job_name
+        ).start()
+
+    def on_disconnect(self):
+        self.cleanup_thread.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def on_message(self, message):
+        if not message.payload:
+            return
+
+        split_topic = message.topic.split("/")
+        for table, key, per_channel in self.router.match(split_topic):
+            payload = json.loads(message.payload)
+            series = f"{table}/{split_topic[-1]}" if per_channel else table
+            self.store.append(
+                split_topic[2],
+                split_topic[1],
+                series,
+                epoch(payload["timestamp"]),
+                float(payload[key]),
+            )
+
+    def start_passive_listeners(self):
+        self.subscribe_and_callback(
+            self.on_message,
+            list(TOPICS_TO_SERIES),
+            qos=QOS.AT_LEAST_ONCE,
+            allow_retained=False,
+        )
+
+    def load_from_database(self):
+        from pioreactor.utils.sqlite_reader import get_reader
+
+        reader = get_reader(config["storage"]["database"])
+        since = time.time() - self.store.hours * 60 * 60
+        n_rows = 0
+
+        for table, value_column in TABLE_VALUE_COLUMNS.items():
+            channel = "channel" if table.startswith("od_readings") else "NULL"
+            for experiment, unit, channel_, t, value in reader.iterate(
+                f"""SELECT experiment, pioreactor_unit, {channel}, timestamp_epoch, {value_column}
+                FROM {table} WHERE timestamp_epoch >= ? ORDER BY timestamp_epoch""",
+                (since,),
+            ):
+                series = table if channel_ is None else f"{table}/{channel_}"
+                self.store.append(experiment, unit, series, t, value)
+                n_rows += 1
+
+        self.logger.debug(f"Loaded {n_rows} recent values from the database.")
+
+    def start_server(self, port):
+        store = self.store
+        logger = self.logger
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/series":
+                    self.send_error(404)
+                    return
+
+                try:
+                    body = json.dumps(handle_query(store, url.query)).encode()
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def epoch(timestamp):
+    from pioreactor.actions.leader.migrate_database import to_epoch
+
+    return to_epoch(timestamp)
+
+
+@click.command(name="time_series_cache")
+def click_time_series_cache():
+    """
+    (leader only) Keep recent OD, growth rate and temperature in memory, and serve them to the UI.
+    """
+    TimeSeriesCache(unit=get_unit_name(), experiment=UNIVERSAL_EXPERIMENT)
+
+    signal.pause()
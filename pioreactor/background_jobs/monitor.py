@@ -3,6 +3,7 @@ from time import sleep
 from json import dumps
 from sys import modules
 from signal import pause
+from threading import Event
 
 import click
 
@@ -14,7 +15,9 @@ from pioreactor.whoami import (
 )
 from pioreactor.background_jobs.base import BackgroundJob
 from pioreactor.utils.timing import RepeatedTimer
-from pioreactor.pubsub import QOS
+from pioreactor.pubsub import QOS, drain_spool
+from pioreactor.config import config
+from pioreactor.utils.edge_store import is_edge_store_enabled
 from pioreactor.hardware_mappings import (
     PCB_LED_PIN as LED_PIN,
     PCB_BUTTON_PIN as BUTTON_PIN,
@@ -32,6 +35,8 @@ class Monitor(BackgroundJob):
      1. Reports metadata (voltage, CPU usage, etc.) about the Rpi / Pioreactor to the leader
      2. Controls the LED / Button interaction
      3. Correction after a restart
+     4. Replays messages that were spooled to disk while the leader was unreachable
+     5. Uploads the edge store's unsynced messages to the leader, if the edge store is enabled (see pioreactor.utils.edge_store)
 
     """
 
@@ -44,11 +49,25 @@ class Monitor(BackgroundJob):
 
         self.logger.debug(f"PioreactorApp version: {__version__}")
 
+        self.edge_store_enabled = is_edge_store_enabled()
+
         # set up a self check function to periodically check vitals and log them
         self.self_check_thread = RepeatedTimer(
             12 * 60 * 60, self.self_checks, job_name=self.job_name, run_immediately=True
         ).start()
 
+        # periodically try to send messages spooled while the leader was unreachable
+        self.drain_spool_thread = RepeatedTimer(
+            10, self.drain_spool, job_name=self.job_name, run_immediately=True
+        ).start()
+
+        if self.edge_store_enabled:
+            self.edge_watermark = 0  # the highest sequence number the leader has stored
+            self.edge_watermark_received = Event()
+            self.sync_edge_store_thread = RepeatedTimer(
+                10, self.sync_edge_store, job_name=self.job_name
+            ).start()
+
         # set up GPIO for accessing the button
         self.setup_GPIO()
         self.GPIO.add_event_detect(
@@ -83,6 +102,70 @@ class Monitor(BackgroundJob):
         # report on CPU usage, memory, disk space
         self.publish_self_statistics()
 
+        if self.edge_store_enabled:
+            self.prune_edge_store()
+
+    def drain_spool(self):
+        try:
+            n_sent = drain_spool()
+        except (ConnectionRefusedError, OSError) as e:
+            self.logger.debug(f"Unable to drain spool: {e}")
+        else:
+            if n_sent > 0:
+                self.logger.debug(f"Sent {n_sent} spooled messages.")
+
+    def sync_edge_store(self):
+        from pioreactor.utils.edge_store import get_edge_store, sync_edge_store
+
+        def publish_batch(batch, last_seq):
+            self.edge_watermark_received.clear()
+            self.publish(
+                f"pioreactor/{self.unit}/{self.experiment}/edge_sync/batch",
+                batch,
+                qos=QOS.AT_LEAST_ONCE,
+            )
+            # the leader replies once the batch is stored.
+            if not self.edge_watermark_received.wait(timeout=30):
+                return None
+            return self.edge_watermark
+
+        if not self.pub_client.is_connected():
+            return
+
+        store = get_edge_store()
+        n_unsynced = store.n_unsynced()
+        if n_unsynced == 0:
+            return
+
+        self.logger.debug(f"Uploading {n_unsynced} messages from the edge store.")
+        self.edge_watermark = sync_edge_store(
+            store,
+            publish_batch,
+            self.edge_watermark,
+            batch_size=config.getint("edge_store", "sync_batch_size", fallback=1000),
+        )
+
+    def set_edge_watermark(self, message):
+        from pioreactor.utils.edge_store import get_edge_store
+
+        if not message.payload:
+            return
+
+        watermark = int(message.payload)
+        store = get_edge_store()
+        store.continue_after(watermark)
+        store.mark_synced(watermark)
+        self.edge_watermark = max(self.edge_watermark, watermark)
+        self.edge_watermark_received.set()
+
+    def prune_edge_store(self):
+        from pioreactor.utils.edge_store import get_edge_store
+
+        n_deleted = get_edge_store().prune(
+            config.getfloat("edge_store", "keep_days", fallback=7)
+        )
+        self.logger.debug(f"Deleted {n_deleted} synced messages from the edge store.")
+
     def check_state_of_jobs_on_machine(self):
         """
         This compares jobs that are current running on the machine, vs
@@ -118,10 +201,7 @@ class Monitor(BackgroundJob):
         sleep(2.5)
 
         # unsubscribe
-        self.sub_client.message_callback_remove(
-            f"pioreactor/{self.unit}/{latest_exp}/+/$state"
-        )
-        self.sub_client.unsubscribe(f"pioreactor/{self.unit}/{latest_exp}/+/$state")
+        self.subscriptions.remove(f"pioreactor/{self.unit}/{latest_exp}/+/$state")
 
         if probable_restart:
             self.logger.log("Possible unexpected restart occurred?")
@@ -136,6 +216,9 @@ class Monitor(BackgroundJob):
         self.check_state_of_jobs_on_machine()
 
     def on_disconnect(self):
+        self.drain_spool_thread.cancel()
+        if self.edge_store_enabled:
+            self.sync_edge_store_thread.cancel()
         self.GPIO.cleanup(LED_PIN)
         self.GPIO.cleanup(BUTTON_PIN)
         gpio_helpers.set_gpio_availability(BUTTON_PIN, gpio_helpers.GPIO_AVAILABLE)
@@ -288,6 +371,13 @@ class Monitor(BackgroundJob):
             qos=QOS.AT_LEAST_ONCE,
         )
 
+        if self.edge_store_enabled:
+            self.subscribe_and_callback(
+                self.set_edge_watermark,
+                f"pioreactor/{self.unit}/{self.experiment}/edge_sync/watermark",
+                qos=QOS.AT_LEAST_ONCE,
+            )
+
 
 @click.command(name="monitor")
 def click_monitor():
@@ -67,7 +67,8 @@ from pioreactor.background_jobs.base import BackgroundJob
 from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
 from pioreactor.actions.led_intensity import led_intensity, CHANNELS as LED_CHANNELS
 from pioreactor.hardware_mappings import SCL, SDA
-from pioreactor.pubsub import QOS, subscribe
+from pioreactor.pubsub import QOS, PublishPolicy
+from pioreactor import structs
 
 
 class ADCReader(BackgroundSubJob):
@@ -105,6 +106,13 @@ class ADCReader(BackgroundSubJob):
         "A3",
         "batched_readings",
     ]
+    # readings are published every interval, and ODReader listens for them live: there's no need for the broker to
+    # retain them (first_ads_obs_time and interval are retained, as other jobs read them on start). Values retained
+    # by earlier versions are cleared when the job starts, see BackgroundJob.clear_unretained_attributes.
+    publish_policies = {
+        attr: PublishPolicy(retain=False)
+        for attr in ["A0", "A1", "A2", "A3", "batched_readings"]
+    }
 
     def __init__(
         self,
@@ -507,16 +515,10 @@ class ODReader(BackgroundJob):
             )
             self.start_ir_led()
 
-        msg = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/adc_reader/first_ads_obs_time",
-            timeout=20,
-        )
-        ads_start_time = float(msg.payload) if msg and msg.payload else 0
-        msg = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/adc_reader/interval", timeout=20
-        )
-
-        ads_interval = float(msg.payload) if msg and msg.payload else 0
+        # the ADC reader is our own subjob, so no need to ask the broker for its (retained) attributes.
+        # It may not have taken its first reading yet, but it's about to.
+        ads_start_time = self.adc_reader.first_ads_obs_time or time.time()
+        ads_interval = self.adc_reader.interval or 0
 
         if ads_interval < 1.5:
             # if this is too small, like 1.5s, we should just skip this whole thing and keep the IR LED always on.
@@ -589,10 +591,10 @@ class ODReader(BackgroundJob):
             return
 
         ads_readings = json.loads(message.payload)
-        od_readings = {"od_raw": {}}
+        od_readings = structs.ODReadings(od_raw={}, timestamp=ads_readings["timestamp"])
         for channel, angle in self.channel_angle_map.items():
             try:
-                od_readings["od_raw"][channel.lstrip("A")] = {
+                od_readings.od_raw[channel.lstrip("A")] = {
                     "voltage": self.temperature_compensator(ads_readings[channel]),
                     "angle": angle,
                 }
@@ -602,11 +604,9 @@ class ODReader(BackgroundJob):
                 )
                 self.set_state(self.DISCONNECTED)
 
-        od_readings["timestamp"] = ads_readings["timestamp"]
         self.publish(
             f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/od_raw_batched",
-            json.dumps(od_readings),
-            qos=QOS.EXACTLY_ONCE,
+            od_readings,
         )
 
     def publish_single(self, message):
@@ -615,14 +615,16 @@ class ODReader(BackgroundJob):
 
         channel = message.topic.rsplit("/", maxsplit=1)[1]
         payload = json.loads(message.payload)
-        payload["angle"] = self.channel_angle_map[channel]
-        payload["voltage"] = self.temperature_compensator(payload["voltage"])
+        od_reading = structs.ODReading(
+            voltage=self.temperature_compensator(payload["voltage"]),
+            angle=self.channel_angle_map[channel],
+            timestamp=payload["timestamp"],
+        )
         topic_suffix = channel.lstrip("A")
 
         self.publish(
             f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/od_raw/{topic_suffix}",
-            payload,
-            qos=QOS.EXACTLY_ONCE,
+            od_reading,
         )
 
     def start_passive_listeners(self):
@@ -632,14 +634,12 @@ class ODReader(BackgroundJob):
         self.subscribe_and_callback(
             self.publish_batch,
             f"pioreactor/{self.unit}/{self.experiment}/{ADCReader.JOB_NAME}/batched_readings",
-            qos=QOS.EXACTLY_ONCE,
             allow_retained=False,
         )
         for channel in self.channel_angle_map:
             self.subscribe_and_callback(
                 self.publish_single,
                 f"pioreactor/{self.unit}/{self.experiment}/{ADCReader.JOB_NAME}/{channel}",
-                qos=QOS.EXACTLY_ONCE,
                 allow_retained=False,
             )
 
@@ -8,7 +8,7 @@ from pioreactor.whoami import get_unit_name, get_latest_experiment_name
 from pioreactor.config import config
 from pioreactor.background_jobs.base import BackgroundJob
 from pioreactor.hardware_mappings import PWM_TO_PIN
-from pioreactor.pubsub import subscribe
+from pioreactor.pubsub import snapshot, PublishPolicy
 from pioreactor.utils.timing import RepeatedTimer
 from pioreactor.utils.pwm import PWM
 from pioreactor.utils import clamp
@@ -32,6 +32,8 @@ class Stirrer(BackgroundJob):
     """
 
     editable_settings = ["duty_cycle", "dc_increase_between_adc_readings"]
+    # with dc_increase_between_adc_readings, the duty cycle goes up and down again around every ADC reading.
+    publish_policies = {"duty_cycle": PublishPolicy(min_interval=10.0)}
     _previous_duty_cycle = None
 
     def __init__(
@@ -89,7 +91,7 @@ class Stirrer(BackgroundJob):
     def set_dc_increase_between_adc_readings(self, dc_increase_between_adc_readings):
         self.dc_increase_between_adc_readings = int(dc_increase_between_adc_readings)
         if not self.dc_increase_between_adc_readings:
-            self.sub_client.message_callback_remove(
+            self.subscriptions.remove(
                 f"pioreactor/{self.unit}/{self.experiment}/adc_reader/first_ads_obs_time"
             )
             try:
@@ -136,17 +138,18 @@ class Stirrer(BackgroundJob):
         # this could fail in the following way:
         # in the same experiment, the od_reading fails so that the ADC attributes are never
         # cleared. Later, this job starts, and it will pick up the _old_ ADC attributes.
-        ads_start_time = float(
-            subscribe(
-                f"pioreactor/{self.unit}/{self.experiment}/adc_reader/first_ads_obs_time"
-            ).payload
+        first_ads_obs_time_topic = (
+            f"pioreactor/{self.unit}/{self.experiment}/adc_reader/first_ads_obs_time"
         )
+        interval_topic = f"pioreactor/{self.unit}/{self.experiment}/adc_reader/interval"
+        retained = snapshot([first_ads_obs_time_topic, interval_topic], deadline=5)
 
-        ads_interval = float(
-            subscribe(
-                f"pioreactor/{self.unit}/{self.experiment}/adc_reader/interval"
-            ).payload
-        )
+        if (first_ads_obs_time_topic not in retained) or (interval_topic not in retained):
+            self.logger.debug("ADC reader's first_ads_obs_time or interval not found.")
+            return
+
+        ads_start_time = float(retained[first_ads_obs_time_topic])
+        ads_interval = float(retained[interval_topic])
 
         # get interval, and confirm that the requirements are possible: post_duration + pre_duration <= ADS interval
         if ads_interval <= (post_duration + pre_duration):
@@ -6,7 +6,8 @@ Continuously monitor the bioreactor and provide summary statistics on what's goi
 import json
 import os
 
-from pioreactor.pubsub import subscribe, QOS
+from pioreactor.pubsub import snapshot, QOS
+from pioreactor import structs
 from pioreactor.utils.timing import RepeatedTimer, current_utc_time
 from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
 from pioreactor.config import config
@@ -40,8 +41,8 @@ class AltMediaCalculator(BackgroundSubJob):
         self.publish_periodically_thread.cancel()
 
     def on_dosing_event(self, message):
-        payload = json.loads(message.payload)
-        volume, event = float(payload["volume_change"]), payload["event"]
+        dosing_event = structs.DosingEvent.from_json(message.payload)
+        volume, event = dosing_event.volume_change, dosing_event.event
         if event == "add_media":
             self.update_alt_media_fraction(volume, 0)
         elif event == "add_alt_media":
@@ -84,13 +85,13 @@ class AltMediaCalculator(BackgroundSubJob):
         return self.latest_alt_media_fraction
 
     def get_initial_alt_media_fraction(self):
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/alt_media_fraction",
-            timeout=2,
+        topic = (
+            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/alt_media_fraction"
         )
+        retained = snapshot(topic, deadline=2)
 
-        if message:
-            return json.loads(message.payload)["alt_media_fraction"]
+        if topic in retained:
+            return json.loads(retained[topic])["alt_media_fraction"]
         else:
             return 0
 
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
+
+from pioreactor.pubsub import QOS
+from pioreactor.utils.timing import current_utc_time
 from pioreactor.background_jobs.base import BackgroundJob
 
 
@@ -16,3 +20,56 @@ class BackgroundSubJob(BackgroundJob):
     def on_mqtt_disconnect(self):
         self.logger.debug("Disconnected from MQTT")
         return
+
+
+class AutomationSubJob(BackgroundSubJob):
+    """
+    The dosing, LED and temperature automations' base. Their editable settings are published together, to
+    `<job_name>/<job_name>_settings`, as one row covering when they were in effect: whenever one changes, and on
+    disconnect. Subclasses can coalesce quick edits with a PublishPolicy on `<job_name>_settings`.
+    """
+
+    latest_settings_started_at = current_utc_time()
+    latest_settings_ended_at = None
+
+    def __setattr__(self, name, value) -> None:
+        super(AutomationSubJob, self).__setattr__(name, value)
+        if name in self.editable_settings and name != "state":
+            self._publish_settings()
+
+    def _publish_settings(self):
+        # the settings are read when they are published, see publish_policies.
+        self.attribute_publisher.update(
+            f"{self.job_name}_settings",
+            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/{self.job_name}_settings",
+            self._end_latest_settings,
+            qos=QOS.EXACTLY_ONCE,
+        )
+
+    def _end_latest_settings(self):
+        # called when the settings are published: they cover the time since they were last published.
+        self.latest_settings_ended_at = current_utc_time()
+        details = self._settings_details()
+        self.latest_settings_started_at, self.latest_settings_ended_at = (
+            self.latest_settings_ended_at,
+            None,
+        )
+        return details
+
+    def _settings_details(self):
+        return json.dumps(
+            {
+                "pioreactor_unit": self.unit,
+                "experiment": self.experiment,
+                "started_at": self.latest_settings_started_at,
+                "ended_at": self.latest_settings_ended_at,
+                "automation": self.__class__.__name__,
+                "settings": json.dumps(
+                    {
+                        attr: getattr(self, attr, None)
+                        for attr in self.editable_settings
+                        if attr != "state"
+                    }
+                ),
+            }
+        )
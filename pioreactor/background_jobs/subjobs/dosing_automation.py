@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import time
-import json
 from threading import Thread
 
 from pioreactor.actions.add_media import add_media
 from pioreactor.actions.remove_waste import remove_waste
 from pioreactor.actions.add_alt_media import add_alt_media
-from pioreactor.pubsub import QOS
+from pioreactor.pubsub import QOS, PublishPolicy
+from pioreactor import structs
 from pioreactor.utils import is_pio_job_running
-from pioreactor.utils.timing import RepeatedTimer, brief_pause, current_utc_time
+from pioreactor.utils.timing import RepeatedTimer, brief_pause
 from pioreactor.automations import events
-from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
+from pioreactor.background_jobs.subjobs.base import AutomationSubJob
 from pioreactor.background_jobs.dosing_control import DosingController
 
 
@@ -23,7 +23,7 @@ class SummableList(list):
         return self + other
 
 
-class DosingAutomation(BackgroundSubJob):
+class DosingAutomation(AutomationSubJob):
     """
     This is the super class that automations inherit from. The `run` function will
     execute every `duration` minutes (selected at the start of the program). If `duration` is left
@@ -40,8 +40,8 @@ class DosingAutomation(BackgroundSubJob):
     latest_od_timestamp = None
     latest_growth_rate_timestamp = None
     latest_event = None
-    latest_settings_started_at = current_utc_time()
-    latest_settings_ended_at = None
+    # edits made within a few seconds of each other (ex: on start) are published, and stored, as one change.
+    publish_policies = {"dosing_automation_settings": PublishPolicy(min_interval=5.0)}
     editable_settings = ["volume", "target_od", "target_growth_rate", "duration"]
 
     def __init_subclass__(cls, **kwargs):
@@ -254,8 +254,7 @@ class DosingAutomation(BackgroundSubJob):
         return min(self.latest_od_timestamp, self.latest_growth_rate_timestamp)
 
     def on_disconnect(self):
-        self.latest_settings_ended_at = current_utc_time()
-        self._send_details_to_mqtt()
+        self._publish_settings()
 
         try:
             self.run_thread.join()
@@ -267,17 +266,11 @@ class DosingAutomation(BackgroundSubJob):
 
         self._clear_mqtt_cache()
 
-    def __setattr__(self, name, value) -> None:
-        super(DosingAutomation, self).__setattr__(name, value)
-        if name in self.editable_settings and name != "state":
-            self.latest_settings_ended_at = current_utc_time()
-            self._send_details_to_mqtt()
-            self.latest_settings_started_at = current_utc_time()
-            self.latest_settings_ended_at = None
-
     def _set_growth_rate(self, message):
         self.previous_growth_rate = self.latest_growth_rate
-        self.latest_growth_rate = float(json.loads(message.payload)["growth_rate"])
+        self.latest_growth_rate = structs.GrowthRate.from_json(
+            message.payload
+        ).growth_rate
         self.latest_growth_rate_timestamp = time.time()
 
     def _set_OD(self, message):
@@ -289,7 +282,7 @@ class DosingAutomation(BackgroundSubJob):
             return
 
         self.previous_od = self.latest_od
-        self.latest_od = float(json.loads(message.payload)["od_filtered"])
+        self.latest_od = structs.ODFiltered.from_json(message.payload).od_filtered
         self.latest_od_timestamp = time.time()
 
     def _clear_mqtt_cache(self):
@@ -304,28 +297,6 @@ class DosingAutomation(BackgroundSubJob):
                 qos=QOS.EXACTLY_ONCE,
             )
 
-    def _send_details_to_mqtt(self):
-        self.publish(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/dosing_automation_settings",
-            json.dumps(
-                {
-                    "pioreactor_unit": self.unit,
-                    "experiment": self.experiment,
-                    "started_at": self.latest_settings_started_at,
-                    "ended_at": self.latest_settings_ended_at,
-                    "automation": self.__class__.__name__,
-                    "settings": json.dumps(
-                        {
-                            attr: getattr(self, attr, None)
-                            for attr in self.editable_settings
-                            if attr != "state"
-                        }
-                    ),
-                }
-            ),
-            qos=QOS.EXACTLY_ONCE,
-        )
-
     def start_passive_listeners(self):
         self.subscribe_and_callback(
             self._set_OD,
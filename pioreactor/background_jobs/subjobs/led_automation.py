@@ -1,21 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import time
-import json
 from threading import Thread
 
 
-from pioreactor.pubsub import QOS
+from pioreactor.pubsub import QOS, PublishPolicy
+from pioreactor import structs
 from pioreactor.utils import is_pio_job_running
 from pioreactor.utils.timing import RepeatedTimer
-from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
+from pioreactor.background_jobs.subjobs.base import AutomationSubJob
 from pioreactor.background_jobs.led_control import LEDController
 from pioreactor.actions.led_intensity import led_intensity
 from pioreactor.automations import events
-from pioreactor.utils.timing import current_utc_time
 
 
-class LEDAutomation(BackgroundSubJob):
+class LEDAutomation(AutomationSubJob):
     """
     This is the super class that LED automations inherit from. The `run` function will
     execute every `duration` minutes (selected at the start of the program). If `duration` is left
@@ -31,8 +30,7 @@ class LEDAutomation(BackgroundSubJob):
     latest_od = None
     latest_od_timestamp = None
     latest_growth_rate_timestamp = None
-    latest_settings_started_at = current_utc_time()
-    latest_settings_ended_at = None
+    publish_policies = {"led_automation_settings": PublishPolicy(min_interval=5.0)}
     editable_settings = ["duration"]
 
     def __init_subclass__(cls, **kwargs):
@@ -177,8 +175,7 @@ class LEDAutomation(BackgroundSubJob):
     ########## Private & internal methods
 
     def on_disconnect(self):
-        self.latest_settings_ended_at = current_utc_time()
-        self._send_details_to_mqtt()
+        self._publish_settings()
 
         try:
             self.timer_thread.cancel()
@@ -193,17 +190,11 @@ class LEDAutomation(BackgroundSubJob):
 
         self._clear_mqtt_cache()
 
-    def __setattr__(self, name, value) -> None:
-        super(LEDAutomation, self).__setattr__(name, value)
-        if name in self.editable_settings and name != "state":
-            self.latest_settings_ended_at = current_utc_time()
-            self._send_details_to_mqtt()
-            self.latest_settings_started_at = current_utc_time()
-            self.latest_settings_ended_at = None
-
     def _set_growth_rate(self, message):
         self.previous_growth_rate = self.latest_growth_rate
-        self.latest_growth_rate = float(json.loads(message.payload)["growth_rate"])
+        self.latest_growth_rate = structs.GrowthRate.from_json(
+            message.payload
+        ).growth_rate
         self.latest_growth_rate_timestamp = time.time()
 
     def _set_OD(self, message):
@@ -215,7 +206,7 @@ class LEDAutomation(BackgroundSubJob):
             return
 
         self.previous_od = self.latest_od
-        self.latest_od = float(json.loads(message.payload)["od_filtered"])
+        self.latest_od = structs.ODFiltered.from_json(message.payload).od_filtered
         self.latest_od_timestamp = time.time()
 
     def _clear_mqtt_cache(self):
@@ -230,28 +221,6 @@ class LEDAutomation(BackgroundSubJob):
                 qos=QOS.EXACTLY_ONCE,
             )
 
-    def _send_details_to_mqtt(self):
-        self.publish(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/led_automation_settings",
-            json.dumps(
-                {
-                    "pioreactor_unit": self.unit,
-                    "experiment": self.experiment,
-                    "started_at": self.latest_settings_started_at,
-                    "ended_at": self.latest_settings_ended_at,
-                    "automation": self.__class__.__name__,
-                    "settings": json.dumps(
-                        {
-                            attr: getattr(self, attr, None)
-                            for attr in self.editable_settings
-                            if attr != "state"
-                        }
-                    ),
-                }
-            ),
-            qos=QOS.EXACTLY_ONCE,
-        )
-
     def start_passive_listeners(self):
         self.subscribe_and_callback(
             self._set_OD,
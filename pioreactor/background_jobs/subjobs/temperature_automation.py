@@ -1,13 +1,11 @@
 # -*- coding: utf-8 -*-
-import json
-
-from pioreactor.pubsub import QOS
-from pioreactor.utils.timing import current_utc_time
-from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
+from pioreactor.pubsub import QOS, PublishPolicy
+from pioreactor import structs
+from pioreactor.background_jobs.subjobs.base import AutomationSubJob
 from pioreactor.background_jobs.temperature_control import TemperatureController
 
 
-class TemperatureAutomation(BackgroundSubJob):
+class TemperatureAutomation(AutomationSubJob):
     """
     This is the super class that Temperature automations inherit from.
     The `execute` function, which is what subclasses will define, is updated every time a new temperature is recorded to MQTT.
@@ -25,8 +23,9 @@ class TemperatureAutomation(BackgroundSubJob):
     latest_temperature = None
     previous_temperature = None
 
-    latest_settings_started_at = current_utc_time()
-    latest_settings_ended_at = None
+    publish_policies = {
+        "temperature_automation_settings": PublishPolicy(min_interval=5.0)
+    }
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -76,37 +75,30 @@ class TemperatureAutomation(BackgroundSubJob):
     ########## Private & internal methods
 
     def on_disconnect(self):
-        self.latest_settings_ended_at = current_utc_time()
-        self._send_details_to_mqtt()
+        self._publish_settings()
 
         for job in self.sub_jobs:
             job.set_state("disconnected")
 
         self._clear_mqtt_cache()
 
-    def __setattr__(self, name, value) -> None:
-        super(TemperatureAutomation, self).__setattr__(name, value)
-        if name in self.editable_settings and name != "state":
-            self.latest_settings_ended_at = current_utc_time()
-            self._send_details_to_mqtt()
-            self.latest_settings_started_at, self.latest_settings_ended_at = (
-                current_utc_time(),
-                None,
-            )
-
     def _set_growth_rate(self, message):
         if not message.payload:
             return
 
         self.previous_growth_rate = self.latest_growth_rate
-        self.latest_growth_rate = float(json.loads(message.payload)["growth_rate"])
+        self.latest_growth_rate = structs.GrowthRate.from_json(
+            message.payload
+        ).growth_rate
 
     def _set_temperature(self, message):
         if not message.payload:
             return
 
         self.previous_temperature = self.latest_temperature
-        self.latest_temperature = float(json.loads(message.payload)["temperature"])
+        self.latest_temperature = structs.Temperature.from_json(
+            message.payload
+        ).temperature
 
         if self.state == self.READY:
             self.execute()
@@ -123,28 +115,6 @@ class TemperatureAutomation(BackgroundSubJob):
                 qos=QOS.EXACTLY_ONCE,
             )
 
-    def _send_details_to_mqtt(self):
-        self.publish(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/temperature_automation_settings",
-            json.dumps(
-                {
-                    "pioreactor_unit": self.unit,
-                    "experiment": self.experiment,
-                    "started_at": self.latest_settings_started_at,
-                    "ended_at": self.latest_settings_ended_at,
-                    "automation": self.__class__.__name__,
-                    "settings": json.dumps(
-                        {
-                            attr: getattr(self, attr, None)
-                            for attr in self.editable_settings
-                            if attr != "state"
-                        }
-                    ),
-                }
-            ),
-            qos=QOS.EXACTLY_ONCE,
-        )
-
     def start_passive_listeners(self):
         self.subscribe_and_callback(
             self._set_growth_rate,
@@ -7,7 +7,7 @@ import os
 import json
 
 
-from pioreactor.pubsub import subscribe, QOS
+from pioreactor.pubsub import snapshot, QOS
 from pioreactor.background_jobs.subjobs.base import BackgroundSubJob
 
 JOB_NAME = os.path.splitext(os.path.basename((__file__)))[0]
@@ -27,8 +27,10 @@ class ThroughputCalculator(BackgroundSubJob):
             job_name=JOB_NAME, unit=unit, experiment=experiment, **kwargs
         )
 
-        self.media_throughput = self.get_initial_media_throughput()
-        self.alt_media_throughput = self.get_initial_alt_media_throughput()
+        (
+            self.media_throughput,
+            self.alt_media_throughput,
+        ) = self.get_initial_media_and_alt_media_throughput()
 
         self.start_passive_listeners()
 
@@ -51,25 +53,17 @@ class ThroughputCalculator(BackgroundSubJob):
 
         return
 
-    def get_initial_media_throughput(self):
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/media_throughput",
-            timeout=2,
+    def get_initial_media_and_alt_media_throughput(self):
+        media_topic = (
+            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/media_throughput"
         )
-        if message:
-            return float(message.payload)
-        else:
-            return 0
+        alt_media_topic = f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/alt_media_throughput"
+        retained = snapshot([media_topic, alt_media_topic], deadline=2)
 
-    def get_initial_alt_media_throughput(self):
-        message = subscribe(
-            f"pioreactor/{self.unit}/{self.experiment}/{self.job_name}/alt_media_throughput",
-            timeout=2,
+        return (
+            float(retained.get(media_topic, 0)),
+            float(retained.get(alt_media_topic, 0)),
         )
-        if message:
-            return float(message.payload)
-        else:
-            return 0
 
     def start_passive_listeners(self) -> None:
         self.subscribe_and_callback(
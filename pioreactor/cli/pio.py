@@ -33,7 +33,14 @@ def pio():
 
 
 @pio.command(name="logs", short_help="show recent logs")
-def logs():
+@click.option(
+    "--all-units",
+    is_flag=True,
+    help="(leader only) show and stream the logs of all units, from the log store",
+)
+@click.option("-n", "--lines", default=100, show_default=True, help="lines of history")
+@click.option("--level", multiple=True, help="only show these levels (with --all-units)")
+def logs(all_units, lines, level):
     """
     Tail & stream the logs from this unit to the terminal. CTRL-C to exit.
     """
@@ -41,6 +48,10 @@ def logs():
     from json import loads
     import time
 
+    if all_units and not am_I_leader():
+        click.echo("--all-units is only available on the leader.")
+        sys.exit(1)
+
     def cb(msg):
         payload = loads(msg.payload.decode())
 
@@ -49,9 +60,17 @@ def logs():
             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} [{payload['task']}] {payload['level']} {payload['message']}"
         )
 
-    click.echo(tail("-n", 100, config["logging"]["log_file"]))
+    if all_units:
+        from pioreactor.utils.log_store import query_logs
 
-    subscribe_and_callback(cb, f"pioreactor/{get_unit_name()}/+/logs/+")
+        for line in query_logs(levels=level, limit=lines):
+            click.echo(
+                f"{line['timestamp']} {line['pioreactor_unit']} [{line['task']}] {line['level']} {line['message']}"
+            )
+        subscribe_and_callback(cb, "pioreactor/+/+/logs/+")
+    else:
+        click.echo(tail("-n", lines, config["logging"]["log_file"]))
+        subscribe_and_callback(cb, f"pioreactor/{get_unit_name()}/+/logs/+")
 
     while True:
         pass
@@ -191,9 +210,15 @@ if am_I_active_worker():
 if am_I_leader():
     run_always.add_command(jobs.mqtt_to_db_streaming.click_mqtt_to_db_streaming)
     run_always.add_command(jobs.watchdog.click_watchdog)
+    run_always.add_command(jobs.database_retention.click_database_retention)
+    run_always.add_command(jobs.time_series_cache.click_time_series_cache)
 
     run.add_command(actions.export_experiment_data.click_export_experiment_data)
     run.add_command(actions.backup_database.click_backup_database)
+    run.add_command(actions.migrate_database.click_migrate_database)
+    run.add_command(actions.backfill_rollups.click_backfill_rollups)
+    run.add_command(actions.query_time_series.click_query_time_series)
+    run.add_command(actions.archive_experiment.click_archive_experiment)
 
     @pio.command(short_help="access the db CLI")
     def db():
@@ -2,6 +2,8 @@
 import socket
 import time
 import threading
+from collections import namedtuple
+from functools import lru_cache
 from pioreactor.config import leader_hostname
 
 
@@ -11,6 +13,192 @@ class QOS:
     EXACTLY_ONCE = 2
 
 
+# Topic patterns -> (qos, retain). These take precedence over what the caller asked for. A retain of None
+# means "whatever the caller asked for". Order matters: the first matching pattern is used.
+# High-rate telemetry doesn't need QoS 2's four-packet handshake, but dosing events and job state do.
+# These can be overwritten (or added to) in the [mqtt.qos] section of config.ini, ex:
+#
+#   [mqtt.qos]
+#   pioreactor/+/+/od_reading/od_raw/+=0
+#   pioreactor/+/+/my_job/my_attr=1,retain
+#
+QOS_POLICIES = {
+    "pioreactor/+/+/+/$state": (QOS.EXACTLY_ONCE, True),
+    "pioreactor/+/+/dosing_events": (QOS.EXACTLY_ONCE, False),
+    "pioreactor/+/+/led_events": (QOS.EXACTLY_ONCE, False),
+    "pioreactor/+/+/logs/+": (QOS.EXACTLY_ONCE, None),
+    "pioreactor/+/+/adc_reader/+": (QOS.AT_LEAST_ONCE, None),
+    "pioreactor/+/+/od_reading/od_raw_batched": (QOS.AT_LEAST_ONCE, None),
+    "pioreactor/+/+/od_reading/od_raw/+": (QOS.AT_LEAST_ONCE, None),
+    "pioreactor/+/+/growth_rate_calculating/od_filtered/+": (QOS.AT_LEAST_ONCE, None),
+    "pioreactor/+/+/growth_rate_calculating/kalman_filter_outputs": (
+        QOS.AT_MOST_ONCE,
+        None,
+    ),
+    # job attributes, ex: growth_rate, temperature, rpm, ... These are mostly retained, so a duplicate is harmless.
+    "pioreactor/+/+/+/+": (QOS.AT_LEAST_ONCE, None),
+}
+
+
+def parse_qos_policy(value):
+    # "1" or "1,retain" or "1,no_retain"
+    qos, *rest = [v.strip() for v in value.split(",")]
+    if not rest:
+        return int(qos), None
+    elif rest[0] == "retain":
+        return int(qos), True
+    elif rest[0] == "no_retain":
+        return int(qos), False
+    else:
+        raise ValueError(f"Unable to parse QoS policy `{value}`.")
+
+
+@lru_cache(maxsize=1024)
+def get_qos_policy(topic):
+    """
+    Returns (qos, retain) for the first pattern matching topic (or subscription), else None.
+    """
+    from paho.mqtt.client import topic_matches_sub
+    from pioreactor.config import config
+
+    policies = (
+        {k: parse_qos_policy(v) for k, v in config["mqtt.qos"].items()}
+        if config.has_section("mqtt.qos")
+        else {}
+    )
+    policies = {
+        **policies,
+        **{k: v for k, v in QOS_POLICIES.items() if k not in policies},
+    }
+
+    for pattern, policy in policies.items():
+        if topic_matches_sub(pattern, topic):
+            return policy
+    return None
+
+
+def apply_qos_policy(topic, qos=0, retain=False):
+    """
+    Returns the (qos, retain) to use for topic: the policy's, if a pattern matches, else the caller's.
+    """
+    policy = get_qos_policy(topic)
+    if policy is None:
+        return qos, retain
+
+    policy_qos, policy_retain = policy
+    return policy_qos, (retain if policy_retain is None else policy_retain)
+
+
+class SPOOL:
+    # what to do with a message when the leader is unreachable
+    KEEP = "keep"  # write to the on-disk spool, and replay when the leader is back
+    DROP = "drop"  # not worth keeping, give up immediately
+
+
+# Topics not matched below keep the original behaviour: retry, and eventually raise.
+# These can be overwritten (or added to) in the [mqtt.spool] section of config.ini, ex:
+#
+#   [mqtt.spool]
+#   pioreactor/+/+/od_reading/od_raw/+=drop
+#
+SPOOL_POLICIES = {
+    "pioreactor/+/+/dosing_events": SPOOL.KEEP,
+    "pioreactor/+/+/led_events": SPOOL.KEEP,
+    "pioreactor/+/+/pid_log": SPOOL.KEEP,
+    "pioreactor/+/+/od_reading/od_raw/+": SPOOL.KEEP,
+    "pioreactor/+/+/od_reading/od_raw_batched": SPOOL.DROP,
+    "pioreactor/+/+/growth_rate_calculating/growth_rate": SPOOL.KEEP,
+    "pioreactor/+/+/growth_rate_calculating/od_filtered/+": SPOOL.KEEP,
+    "pioreactor/+/+/growth_rate_calculating/kalman_filter_outputs": SPOOL.DROP,
+    "pioreactor/+/+/temperature_control/temperature": SPOOL.KEEP,
+    "pioreactor/+/+/alt_media_calculating/alt_media_fraction": SPOOL.KEEP,
+}
+
+
+@lru_cache(maxsize=512)
+def get_spool_policy(topic):
+    from paho.mqtt.client import topic_matches_sub
+    from pioreactor.config import config
+
+    policies = dict(config["mqtt.spool"]) if config.has_section("mqtt.spool") else {}
+    policies = {
+        **policies,
+        **{k: v for k, v in SPOOL_POLICIES.items() if k not in policies},
+    }
+
+    for pattern, policy in policies.items():
+        if topic_matches_sub(pattern, topic):
+            return policy
+    return None
+
+
+@lru_cache(1)
+def get_spool():
+    from pioreactor.config import config
+    from pioreactor.utils.spool import Spool
+
+    return Spool(
+        config.get("storage", "spool_directory", fallback="/home/pi/.pioreactor/spool")
+    )
+
+
+def should_spool(topic, is_connected=True):
+    """
+    Messages that are worth keeping are spooled if we can't reach the broker, or if older messages are still
+    waiting in the spool (so that the drainer replays everything in order). Whether any are waiting is tracked in
+    memory, see Spool.is_empty.
+    """
+    from pioreactor.utils.edge_store import is_edge_store_enabled, is_edge_topic
+
+    if get_spool_policy(topic) != SPOOL.KEEP:
+        return False
+    elif is_edge_store_enabled() and is_edge_topic(topic):
+        # the edge store keeps these instead, see record_at_edge.
+        return False
+    return (not is_connected) or (not get_spool().is_empty())
+
+
+def record_at_edge(topic, message, is_connected=True):
+    """
+    With the edge store enabled (see pioreactor.utils.edge_store), messages on its topics are recorded there. Returns
+    True if the message shouldn't be published now: we aren't connected, and it's uploaded later instead.
+    """
+    from pioreactor.utils.edge_store import (
+        is_edge_store_enabled,
+        is_edge_topic,
+        get_edge_store,
+    )
+
+    if not (is_edge_store_enabled() and is_edge_topic(topic)):
+        return False
+
+    get_edge_store().record(topic, message, synced=is_connected)
+    return not is_connected
+
+
+def spool_message(topic, message, qos=0, retain=False):
+    get_spool().append(topic, message, qos=qos, retain=retain)
+
+
+def drain_spool(hostname=leader_hostname):
+    """
+    Replay the spool, in order, to the broker. Returns the number of messages sent. If the broker is still
+    unreachable, this raises, and the remaining messages are kept for next time.
+    """
+    from paho.mqtt import publish as mqtt_publish
+
+    def publish_batch(batch):
+        mqtt_publish.multiple(
+            [
+                {"topic": topic, "payload": payload, "qos": qos, "retain": retain}
+                for (topic, payload, qos, retain) in batch
+            ],
+            hostname=hostname,
+        )
+
+    return get_spool().drain(publish_batch)
+
+
 def create_client(hostname=leader_hostname, last_will=None, client_id=None, keepalive=60):
     from paho.mqtt.client import Client
 
@@ -37,19 +225,117 @@ def create_client(hostname=leader_hostname, last_will=None, client_id=None, keep
             return client
 
 
+# hostname -> (was the broker reachable, time.monotonic() when we found out). See is_leader_reachable.
+_reachability = {}
+REACHABILITY_TTL = 5.0  # seconds
+
+
+def set_leader_reachable(hostname, reachable):
+    _reachability[hostname] = (reachable, time.monotonic())
+
+
+def is_leader_reachable(hostname=leader_hostname, port=1883, timeout=0.5):
+    """
+    A quick check, so that messages we don't have to wait for (see has_fallback) aren't stuck behind a connection
+    attempt to a leader that is down. The outcome of the last publish is reused for REACHABILITY_TTL seconds,
+    after that we try to open a TCP connection to the broker, with a short timeout.
+    """
+    reachable, checked_at = _reachability.get(hostname, (None, 0.0))
+    if time.monotonic() - checked_at < REACHABILITY_TTL:
+        return reachable
+
+    try:
+        socket.create_connection((hostname, port), timeout=timeout).close()
+        reachable = True
+    except OSError:  # includes refused connections, timeouts and unknown hosts
+        reachable = False
+
+    set_leader_reachable(hostname, reachable)
+    return reachable
+
+
+def has_fallback(topic):
+    # messages with a spool policy, or kept at the edge, have somewhere to go if the leader is unreachable.
+    from pioreactor.utils.edge_store import is_edge_store_enabled, is_edge_topic
+
+    return (get_spool_policy(topic) is not None) or (
+        is_edge_store_enabled() and is_edge_topic(topic)
+    )
+
+
+def keep_or_drop_unpublished(topic, message, qos, retain, hostname, logger):
+    """
+    For a message we can't publish now: record it at the edge, spool it or drop it, per its topic. Returns False if
+    its topic has no fallback, and the caller should keep trying.
+    """
+    if record_at_edge(topic, message, is_connected=False):
+        logger.debug(f"Unable to connect to host: {hostname}. Kept {topic} at the edge.")
+        return True
+
+    policy = get_spool_policy(topic)
+    if policy == SPOOL.KEEP:
+        logger.debug(f"Unable to connect to host: {hostname}. Spooling {topic}.")
+        spool_message(topic, message, qos=qos, retain=retain)
+        return True
+    elif policy == SPOOL.DROP:
+        logger.debug(f"Unable to connect to host: {hostname}. Dropping {topic}.")
+        return True
+
+    return False
+
+
 def publish(topic, message, hostname=leader_hostname, retries=10, **mqtt_kwargs):
+    """
+    If the leader is unreachable, messages whose topic has a spool policy (see SPOOL_POLICIES) return
+    immediately: either spooled to disk to be replayed later, or dropped. They don't wait on a connection
+    attempt to a leader that's known to be down, see is_leader_reachable.
+
+    qos and retain are overridden by the topic's QoS policy, if any (see QOS_POLICIES).
+
+    message can be a pioreactor.structs message, and is sent as json. If it has a source, it's given a new sequence
+    number (see pioreactor.utils.sequences).
+    """
     from paho.mqtt import publish as mqtt_publish
+    from pioreactor.structs import Message
+    from pioreactor.utils.sequences import sequence
+
+    if isinstance(message, Message):
+        message = sequence(message).to_json()
+
+    qos, retain = apply_qos_policy(
+        topic, mqtt_kwargs.pop("qos", 0), mqtt_kwargs.pop("retain", False)
+    )
+    mqtt_kwargs.update(qos=qos, retain=retain)
+
+    if should_spool(topic):
+        spool_message(topic, message, qos=qos, retain=retain)
+        return
+
+    if has_fallback(topic) and not is_leader_reachable(
+        hostname, port=mqtt_kwargs.get("port", 1883)
+    ):
+        from pioreactor.logging import create_logger
+
+        logger = create_logger("pubsub.publish", to_mqtt=False)
+        if keep_or_drop_unpublished(topic, message, qos, retain, hostname, logger):
+            return
 
     retry_count = 1
     while True:
         try:
             mqtt_publish.single(topic, payload=message, hostname=hostname, **mqtt_kwargs)
+            set_leader_reachable(hostname, True)
+            record_at_edge(topic, message, is_connected=True)
             return
         except (ConnectionRefusedError, socket.gaierror, OSError, socket.timeout):
             # possible that leader is down/restarting, keep trying, but log to local machine.
             from pioreactor.logging import create_logger
 
+            set_leader_reachable(hostname, False)
             logger = create_logger("pubsub.publish", to_mqtt=False)
+            if keep_or_drop_unpublished(topic, message, qos, retain, hostname, logger):
+                return
+
             logger.debug(
                 f"Attempt {retry_count}: Unable to connect to host: {hostname}",
                 exc_info=True,
@@ -173,6 +459,418 @@ def subscribe(
             raise ConnectionRefusedError(f"Unable to connect to host: {hostname}.")
 
 
+class SubscriptionRegistry:
+    """
+    Remembers every active subscription (and its callbacks) of a client, so that all of them can be
+    restored after a reconnect with a single, multi-topic SUBSCRIBE packet.
+
+    Each topic has one paho callback, a dispatcher, that fans out to the topic's callbacks. Adding
+    the same callback (as determined by `key`) to a topic twice is a no-op, so callers can safely re-run their
+    subscription code.
+
+    Example
+    ---------
+
+    > registry = SubscriptionRegistry(client)
+    > registry.add([("pioreactor/unit1/exp/dosing_events", QOS.EXACTLY_ONCE)], paho_callback, key=my_callback)
+    > ...
+    > registry.restore()  # in on_connect
+    > registry.remove("pioreactor/unit1/exp/dosing_events")
+
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.RLock()
+        self._qos = {}  # topic -> qos
+        self._callbacks = {}  # topic -> list of (key, callback)
+
+    def add(self, topics_and_qos, callback, key=None):
+        """
+        topics_and_qos is a list of (topic, qos). callback has paho's signature: (client, userdata, message).
+        New topics (or topics needing a higher QoS) are sent in a single SUBSCRIBE.
+        """
+        key = callback if key is None else key
+        to_subscribe = []
+
+        with self._lock:
+            for topic, qos in topics_and_qos:
+                if topic not in self._callbacks:
+                    self._callbacks[topic] = []
+                    self.client.message_callback_add(
+                        topic, self._create_dispatcher(topic)
+                    )
+
+                if all(
+                    existing_key != key for (existing_key, _) in self._callbacks[topic]
+                ):
+                    self._callbacks[topic].append((key, callback))
+
+                if (topic not in self._qos) or (qos > self._qos[topic]):
+                    self._qos[topic] = qos
+                    to_subscribe.append((topic, qos))
+
+            if to_subscribe:
+                self.client.subscribe(to_subscribe)
+
+    def remove(self, topic, key=None):
+        """
+        Remove the callback `key` from topic, or all of topic's callbacks if key is None. We unsubscribe
+        from the topic once it has no callbacks left.
+        """
+        with self._lock:
+            if topic not in self._callbacks:
+                return
+
+            self._callbacks[topic] = [
+                (existing_key, callback)
+                for (existing_key, callback) in self._callbacks[topic]
+                if (key is not None) and (existing_key != key)
+            ]
+
+            if not self._callbacks[topic]:
+                del self._callbacks[topic]
+                del self._qos[topic]
+                self.client.message_callback_remove(topic)
+                self.client.unsubscribe(topic)
+
+    def restore(self):
+        """
+        Resubscribe to all topics. Call this after a reconnect: with a clean session, the broker has forgotten
+        our subscriptions (paho keeps the callbacks, though).
+        """
+        with self._lock:
+            if self._qos:
+                self.client.subscribe(list(self._qos.items()))
+
+    @property
+    def topics(self):
+        with self._lock:
+            return list(self._qos)
+
+    def _create_dispatcher(self, topic):
+        def _dispatch(client, userdata, message):
+            with self._lock:
+                callbacks = [callback for (_, callback) in self._callbacks.get(topic, [])]
+
+            for callback in callbacks:
+                callback(client, userdata, message)
+
+        return _dispatch
+
+
+# how often a job's attribute is published, see AttributePublisher.
+#   min_interval: seconds between publishes of the attribute.
+#   change_threshold: numbers that changed by less than this (since last published) are held back.
+#   retain: overrides the publish's retain, if not None.
+PublishPolicy = namedtuple(
+    "PublishPolicy",
+    ["min_interval", "change_threshold", "retain"],
+    defaults=(0.0, None, None),
+)
+
+
+class AttributePublisher:
+    """
+    Coalesces the publishes of a job's attributes, per their PublishPolicy. Attributes without a policy are
+    published right away.
+
+    With a min_interval, the first change after a quiet period is published right away, and changes during the
+    interval are held: only the latest is published, when the interval is up. With a change_threshold, a number
+    that moved less than that from the value last published is held until a larger change, or a flush.
+
+    flush() publishes every held value, ex: on a state transition. After close(), everything is published right away.
+
+    Example
+    ---------
+
+    > publisher = AttributePublisher(job.publish, {"duty_cycle": PublishPolicy(min_interval=5.0)})
+    > publisher.update("duty_cycle", "pioreactor/unit1/exp/stirring/duty_cycle", 50, retain=True)   # published
+    > publisher.update("duty_cycle", "pioreactor/unit1/exp/stirring/duty_cycle", 55, retain=True)   # held
+    > publisher.update("duty_cycle", "pioreactor/unit1/exp/stirring/duty_cycle", 60, retain=True)   # replaces 55, published in 5s
+    > publisher.flush()  # or now
+
+    A value can be a function, called when it's published, ex: to build a large payload only if it's sent.
+    """
+
+    def __init__(self, publish, policies=None):
+        self._publish = publish
+        self.policies = policies or {}
+        self.n_coalesced = 0
+
+        self._lock = threading.Lock()
+        self._last_published = {}  # attr -> (monotonic time, value)
+        self._pending = {}  # attr -> (topic, value, publish kwargs)
+        self._timers = {}  # attr -> timer, publishing the pending value later
+        self._closed = False
+
+    def update(self, attr, topic, value, **kwargs):
+        policy = self.policies.get(attr)
+        if (policy is not None) and (policy.retain is not None):
+            kwargs["retain"] = policy.retain
+
+        if (policy is None) or self._closed:
+            self._send(attr, topic, value, kwargs)
+            return
+
+        with self._lock:
+            if attr in self._pending:
+                self.n_coalesced += 1
+            self._pending[attr] = (topic, value, kwargs)
+
+            if attr in self._timers:
+                # the latest value is published when the interval is up
+                return
+
+            if attr in self._last_published:
+                wait = policy.min_interval - (
+                    time.monotonic() - self._last_published[attr][0]
+                )
+                if wait > 0:
+                    self._start_timer(attr, wait)
+                    return
+
+        self._publish_pending(attr)
+
+    def flush(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers = {}
+            attrs = list(self._pending)
+
+        for attr in attrs:
+            self._publish_pending(attr, force=True)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._closed = True
+
+    def _start_timer(self, attr, wait):
+        # must hold self._lock
+        def on_interval():
+            with self._lock:
+                self._timers.pop(attr, None)
+            self._publish_pending(attr)
+
+        timer = threading.Timer(wait, on_interval)
+        timer.daemon = True
+        self._timers[attr] = timer
+        timer.start()
+
+    def _publish_pending(self, attr, force=False):
+        with self._lock:
+            if attr not in self._pending:
+                return
+            topic, value, kwargs = self._pending.pop(attr)
+            if callable(value):
+                value = value()
+
+            threshold = self.policies[attr].change_threshold
+            if (
+                not force
+                and (threshold is not None)
+                and (attr in self._last_published)
+                and _moved_less_than(self._last_published[attr][1], value, threshold)
+            ):
+                self._pending[attr] = (topic, value, kwargs)
+                return
+
+        self._send(attr, topic, value, kwargs)
+
+    def _send(self, attr, topic, value, kwargs):
+        if callable(value):
+            value = value()
+        with self._lock:
+            self._last_published[attr] = (time.monotonic(), value)
+        self._publish(topic, value, **kwargs)
+
+
+def _moved_less_than(previous, value, threshold):
+    numbers = (int, float)
+    if isinstance(previous, numbers) and isinstance(value, numbers):
+        return abs(value - previous) < threshold
+    return previous == value
+
+
+class TopicTrie:
+    """
+    Match a topic against many subscription patterns (with + and # wildcards) at once. Patterns are stored
+    by segment in a tree, so matching a topic costs the same however many patterns there are: it walks
+    the topic's segments once, following the literal, + and # branches.
+
+    Example
+    ---------
+
+    > trie = TopicTrie()
+    > trie.add("pioreactor/+/+/od_reading/od_raw/+", "od_readings_raw")
+    > trie.add("pioreactor/+/+/logs/#", "logs")
+    > trie.match("pioreactor/unit1/exp/od_reading/od_raw/A0".split("/"))
+    ["od_readings_raw"]
+
+    """
+
+    def __init__(self):
+        self._root = {}  # segment -> node. A node's values are under the key None.
+
+    def add(self, pattern, value):
+        node = self._root
+        for segment in pattern.split("/"):
+            node = node.setdefault(segment, {})
+        node.setdefault(None, []).append(value)
+
+    def match(self, split_topic):
+        """
+        split_topic is the topic, already split on "/". Returns the values of every matching pattern.
+        """
+        matches = []
+        nodes = [self._root]
+        for segment in split_topic:
+            next_nodes = []
+            for node in nodes:
+                if "#" in node:
+                    matches.extend(node["#"].get(None, []))
+                if segment in node:
+                    next_nodes.append(node[segment])
+                if "+" in node:
+                    next_nodes.append(node["+"])
+            nodes = next_nodes
+            if not nodes:
+                return matches
+
+        for node in nodes:
+            matches.extend(node.get(None, []))
+            # "a/#" also matches "a"
+            if "#" in node:
+                matches.extend(node["#"].get(None, []))
+        return matches
+
+    def __len__(self):
+        def count(node):
+            return len(node.get(None, [])) + sum(
+                count(child) for segment, child in node.items() if segment is not None
+            )
+
+        return count(self._root)
+
+
+# process-local cache of retained values, see `snapshot`
+_retained_cache = {}
+
+
+def update_retained_cache(message):
+    """
+    Live subscriptions call this to keep any cached retained values fresh. Only topics that
+    were previously snapshot-ed with use_cache=True are tracked.
+    """
+    if message.topic not in _retained_cache:
+        return
+    elif message.payload:
+        _retained_cache[message.topic] = message.payload
+    else:
+        # an empty payload clears a retained value
+        del _retained_cache[message.topic]
+
+
+def snapshot(topics, deadline=2.0, hostname=leader_hostname, retries=10, use_cache=False):
+    """
+    Fetch the retained values of many topics over a single connection, instead of a `subscribe` (and connection) per topic.
+    Wildcards are allowed. Returns a dict of {topic: payload}; topics without a retained value are absent.
+
+    To know when the broker has sent us all its retained values, we subscribe to a private topic
+    in the same SUBSCRIBE packet, and publish to it once subscribed. The broker delivers in order, so when our own
+    message comes back, we are done. `deadline` (seconds) is an upper bound in case that doesn't happen.
+
+    Parameters
+    -------------
+    use_cache: bool
+        Serve (non-wildcard) topics from a process-local cache, and add the fetched values to it. Live subscriptions
+        in this process (BackgroundJob.subscribe_and_callback, subscribe_and_callback) keep the cache up to date.
+
+    Example
+    ---------
+
+    > retained = snapshot([f"pioreactor/{unit}/{exp}/stirring/duty_cycle", f"pioreactor/{unit}/{exp}/od_blank/+"])
+    > retained.get(f"pioreactor/{unit}/{exp}/stirring/duty_cycle")
+    b"50"
+
+    """
+    import uuid
+    import paho.mqtt.client as mqtt
+
+    topics = [topics] if isinstance(topics, str) else list(topics)
+    results = {}
+
+    if use_cache:
+        results.update({t: _retained_cache[t] for t in topics if t in _retained_cache})
+        topics = [t for t in topics if t not in results]
+        if not topics:
+            return results
+
+    exact_topics = {t for t in topics if ("+" not in t) and ("#" not in t)}
+    all_exact = len(exact_topics) == len(topics)
+    sentinel = f"pioreactor/$snapshot/{uuid.uuid4().hex}"
+    fetched = {}
+    finished = threading.Event()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe([(topic, QOS.AT_MOST_ONCE) for topic in topics + [sentinel]])
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        client.publish(sentinel, b"1", qos=QOS.AT_MOST_ONCE)
+
+    def on_message(client, userdata, message):
+        if message.topic == sentinel:
+            finished.set()
+            return
+
+        if message.payload:
+            fetched[message.topic] = message.payload
+
+        if all_exact and exact_topics.issubset(fetched):
+            finished.set()
+
+    retry_count = 1
+    while True:
+        try:
+            client = mqtt.Client()
+            client.on_connect = on_connect
+            client.on_subscribe = on_subscribe
+            client.on_message = on_message
+            client.connect(hostname)
+            client.loop_start()
+            finished.wait(deadline)
+            client.disconnect()
+            client.loop_stop()
+            break
+
+        except (ConnectionRefusedError, socket.gaierror, OSError, socket.timeout):
+            from pioreactor.logging import create_logger
+
+            logger = create_logger("pubsub.snapshot", to_mqtt=False)
+            logger.debug(
+                f"Attempt {retry_count}: Unable to connect to host: {hostname}",
+                exc_info=True,
+            )
+
+            time.sleep(5 * retry_count)  # linear backoff
+            retry_count += 1
+
+        if retry_count == retries:
+            from pioreactor.logging import create_logger
+
+            logger = create_logger("pubsub.snapshot", to_mqtt=False)
+            logger.error(f"Unable to connect to host: {hostname}. Exiting.")
+            raise ConnectionRefusedError(f"Unable to connect to host: {hostname}.")
+
+    if use_cache:
+        _retained_cache.update({t: p for t, p in fetched.items() if t in exact_topics})
+
+    results.update(fetched)
+    return results
+
+
 def subscribe_and_callback(
     callback,
     topics,
@@ -214,6 +912,7 @@ def subscribe_and_callback(
                 if not allow_retained and message.retain:
                     return
 
+                update_retained_cache(message)
                 return actual_callback(message)
 
             except Exception as e:
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Schemas of the messages jobs publish to MQTT, shared by the publishers, the jobs subscribing to them, and the
+database streamer, which stores most of them.
+
+Each message type is a dataclass with __slots__ (no per-instance __dict__), registered with a one byte type id.
+Payloads are decoded strictly: a missing field, or a value that can't be converted to the field's type, raises
+SchemaError when the message is received, not later when it's inserted into the database.
+
+Example
+---------
+
+    > GrowthRate(growth_rate=0.25, timestamp="2021-06-01T12:00:00.000000").to_json()
+    '{"growth_rate": 0.25, "timestamp": "2021-06-01T12:00:00.000000"}'
+    > GrowthRate.from_json(message.payload)
+    GrowthRate(growth_rate=0.25, timestamp='2021-06-01T12:00:00.000000')
+    > GrowthRate.from_json(message.payload).to_row("pioreactor/unit1/exp1/growth_rate_calculating/growth_rate".split("/"))
+    {"experiment": "exp1", "pioreactor_unit": "unit1", "rate": 0.25, "timestamp": "2021-06-01T12:00:00.000000"}
+
+Telemetry messages also have a `source` (the job that published them) and a `seq`, increasing per (unit, source),
+filled in when they are published (see pioreactor.utils.sequences). The streamer uses them to skip duplicates. Both
+are optional: messages from older workers, or published with the raw json, don't have them.
+
+There is also a compact binary codec, `to_bytes` and `decode_bytes`, for storing and sending messages
+outside of MQTT. MQTT payloads stay JSON, as the UI reads them.
+"""
+import json
+import struct
+from dataclasses import dataclass, fields, MISSING
+from typing import Optional
+
+
+class SchemaError(ValueError):
+    pass
+
+
+# type id -> message type
+MESSAGE_TYPES = {}
+
+# table -> message type, for the tables the streamer fills from a message type's rows
+TABLES = {}
+
+
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+def _as_is(type_):
+    def check(value):
+        if not isinstance(value, type_):
+            raise TypeError(f"expected {type_.__name__}, got {type(value).__name__}")
+        return value
+
+    return check
+
+
+def _converter(type_):
+    if type_ in (float, int, str):
+        return type_
+    elif type_ == Optional[float]:
+        return _optional(float)
+    elif type_ == Optional[str]:
+        return _optional(str)
+    elif type_ == Optional[int]:
+        return _optional(int)
+    return _as_is(type_)
+
+
+def _binary_kind(type_):
+    # f: float64, i: int64, s: utf8 string, j: anything else, as a json string
+    return {float: "f", int: "i", str: "s"}.get(type_, "j")
+
+
+class Message:
+    __slots__ = ()
+
+    # set by @message
+    _type_id = None
+    _table = None
+    _converters = ()  # (field, converter, default)
+    _binary_kinds = ()  # (field, kind)
+    _columns = ()  # (field, column)
+    _topic_columns = ()  # (column, index into the split topic)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, payload):
+        try:
+            return cls(
+                *[
+                    convert(payload[name])
+                    if (name in payload) or (default is MISSING)
+                    else default
+                    for name, convert, default in cls._converters
+                ]
+            )
+        except KeyError as e:
+            raise SchemaError(f"{cls.__name__} is missing `{e.args[0]}`.")
+        except (TypeError, ValueError) as e:
+            raise SchemaError(f"{cls.__name__} has an invalid value: {e}")
+
+    @classmethod
+    def from_json(cls, payload):
+        try:
+            payload = json.loads(payload)
+        except ValueError as e:
+            raise SchemaError(f"{cls.__name__} isn't valid json: {e}")
+        if not isinstance(payload, dict):
+            raise SchemaError(f"{cls.__name__} must be a json object.")
+        return cls.from_dict(payload)
+
+    def to_bytes(self):
+        parts = [struct.pack("<B", self._type_id)]
+        for name, kind in self._binary_kinds:
+            value = getattr(self, name)
+            if kind == "f":
+                parts.append(struct.pack("<d", value))
+            elif kind == "i":
+                parts.append(struct.pack("<q", value))
+            else:
+                encoded = (value if kind == "s" else json.dumps(value)).encode()
+                parts.append(struct.pack("<I", len(encoded)))
+                parts.append(encoded)
+        return b"".join(parts)
+
+    def to_row(self, split_topic):
+        """
+        The database row of this message, received on split_topic.
+        """
+        row = {"experiment": split_topic[2], "pioreactor_unit": split_topic[1]}
+        for name, column in self._columns:
+            row[column] = getattr(self, name)
+        for column, index in self._topic_columns:
+            row[column] = split_topic[index]
+        if "timestamp" not in row:
+            from pioreactor.utils.timing import current_utc_time
+
+            row["timestamp"] = current_utc_time()
+        return row
+
+
+def decode_bytes(payload):
+    """
+    Inverse of Message.to_bytes: the type is read from the payload's first byte.
+    """
+    try:
+        cls = MESSAGE_TYPES[payload[0]]
+    except (IndexError, KeyError):
+        raise SchemaError("Unknown message type.")
+
+    values, offset = [], 1
+    try:
+        for _, kind in cls._binary_kinds:
+            if kind == "f":
+                values.append(struct.unpack_from("<d", payload, offset)[0])
+                offset += 8
+            elif kind == "i":
+                values.append(struct.unpack_from("<q", payload, offset)[0])
+                offset += 8
+            else:
+                (length,) = struct.unpack_from("<I", payload, offset)
+                value = bytes(payload[offset + 4 : offset + 4 + length]).decode()
+                values.append(value if kind == "s" else json.loads(value))
+                offset += 4 + length
+    except struct.error as e:
+        raise SchemaError(f"{cls.__name__} is truncated: {e}")
+    return cls(*values)
+
+
+def message(type_id, table=None, columns=None, topic_columns=None):
+    """
+    Class decorator: makes the class a dataclass with __slots__, and registers it.
+
+    type_id: int
+        unique, 0-255. Never reuse one: it's stored with binary encoded messages.
+    table: str
+        the table the streamer stores this message in, if any.
+    columns: dict
+        field -> column, for fields stored under a different name. Fields mapped to None aren't stored.
+    topic_columns: dict
+        column -> index into the split topic, for columns that come from the topic, ex: the channel.
+    """
+    columns = columns or {}
+
+    def wrap(cls):
+        assert type_id not in MESSAGE_TYPES, f"type id {type_id} is taken."
+        cls = dataclass(cls)
+        schema = fields(cls)
+        names = tuple(f.name for f in schema)
+
+        # a new class, as __slots__ has to be there when the class is created.
+        namespace = {
+            key: value
+            for key, value in cls.__dict__.items()
+            if key not in names + ("__dict__", "__weakref__")
+        }
+        namespace["__slots__"] = names
+        slotted = type(cls.__name__, (Message,), namespace)
+
+        slotted._type_id = type_id
+        slotted._table = table
+        slotted._converters = tuple(
+            (f.name, _converter(f.type), f.default) for f in schema
+        )
+        slotted._binary_kinds = tuple((f.name, _binary_kind(f.type)) for f in schema)
+        slotted._columns = tuple(
+            (name, columns.get(name, name))
+            for name in names
+            if columns.get(name, name) is not None
+        )
+        slotted._topic_columns = tuple((topic_columns or {}).items())
+
+        MESSAGE_TYPES[type_id] = slotted
+        if table is not None:
+            TABLES[table] = slotted
+        return slotted
+
+    return wrap
+
+
+@message(
+    1,
+    table="od_readings_raw",
+    columns={"voltage": "od_reading_v"},
+    topic_columns={"channel": -1},
+)
+class ODReading:
+    """
+    pioreactor/<unit>/<experiment>/od_reading/od_raw/<channel>
+    """
+
+    voltage: float
+    angle: str
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(2)
+class ODReadings:
+    """
+    pioreactor/<unit>/<experiment>/od_reading/od_raw_batched
+
+    od_raw is {<channel>: {"voltage": <float>, "angle": <str>}}
+    """
+
+    od_raw: dict
+    timestamp: str
+
+
+@message(
+    3,
+    table="od_readings_filtered",
+    columns={"od_filtered": "normalized_od_reading"},
+    topic_columns={"channel": -1},
+)
+class ODFiltered:
+    """
+    pioreactor/<unit>/<experiment>/growth_rate_calculating/od_filtered/<channel>
+    """
+
+    od_filtered: float
+    angle: str
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(4, table="growth_rates", columns={"growth_rate": "rate"})
+class GrowthRate:
+    """
+    pioreactor/<unit>/<experiment>/growth_rate_calculating/growth_rate
+    """
+
+    growth_rate: float
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(5)
+class KalmanFilterOutputs:
+    """
+    pioreactor/<unit>/<experiment>/growth_rate_calculating/kalman_filter_outputs
+
+    Stored packed, see pioreactor.utils.matrix_blobs.
+    """
+
+    state: list
+    covariance_matrix: list
+    timestamp: str
+
+
+@message(6, table="dosing_events", columns={"volume_change": "volume_change_ml"})
+class DosingEvent:
+    """
+    pioreactor/<unit>/<experiment>/dosing_events
+    """
+
+    volume_change: float
+    event: str
+    source_of_event: Optional[str]
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(7, table="led_events")
+class LEDEvent:
+    """
+    pioreactor/<unit>/<experiment>/led_events
+    """
+
+    channel: str
+    intensity: float
+    event: str
+    source_of_event: Optional[str]
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(8, table="temperature_readings", columns={"temperature": "temperature_c"})
+class Temperature:
+    """
+    pioreactor/<unit>/<experiment>/temperature_control/temperature
+    """
+
+    temperature: float
+    timestamp: str
+    source: Optional[str] = None
+    seq: Optional[int] = None
+
+
+@message(9, table="pid_logs", columns={"K0": None})
+class PIDStats:
+    """
+    pioreactor/<unit>/<experiment>/pid_log
+
+    There is no timestamp: it's the time the message is received.
+    """
+
+    setpoint: float
+    output_limits_lb: Optional[float]
+    output_limits_ub: Optional[float]
+    Kd: float
+    Ki: float
+    Kp: float
+    K0: Optional[float]
+    integral: Optional[float]
+    proportional: Optional[float]
+    derivative: Optional[float]
+    latest_input: Optional[float]
+    latest_output: Optional[float]
+    job_name: str
+    target_name: str
+
+
+@message(10, table="alt_media_fraction")
+class AltMediaFraction:
+    """
+    pioreactor/<unit>/<experiment>/alt_media_calculating/alt_media_fraction
+    """
+
+    alt_media_fraction: float
+    timestamp: str
+
+
+@message(11, table="logs", topic_columns={"source": -1})
+class LogMessage:
+    """
+    pioreactor/<unit>/<experiment>/logs/<source>
+    """
+
+    message: str
+    task: str
+    level: str
+    timestamp: str
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import zipfile
+import pytest
+from pioreactor.config import config
+from pioreactor.actions.leader.archive_experiment import archive_experiment, read_manifest
+from pioreactor.actions.leader.export_experiment_data import export_experiment_data
+
+pytest.importorskip("pyarrow")
+
+
+def test_archive_then_export_reads_from_archive(tmp_path, monkeypatch):
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+    monkeypatch.setitem(config["storage"], "archive_directory", str(tmp_path / "archive"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.executemany(
+        "INSERT INTO experiments (experiment, timestamp) VALUES (?, ?)",
+        [("old_exp", "2021-01-01T00:00:00"), ("new_exp", "2021-02-01T00:00:00")],
+    )
+    connection.executemany(
+        "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES (?, ?, ?, ?)",
+        [
+            (f"2021-01-01T00:00:{i:02d}", exp, 0.1 * i, unit)
+            for i in range(30)
+            for exp in ["old_exp", "new_exp"]
+            for unit in ["unit1", "unit2"]
+        ],
+    )
+    connection.commit()
+
+    with pytest.raises(ValueError):
+        archive_experiment("new_exp")
+
+    archive_experiment("old_exp")
+
+    manifest = read_manifest("old_exp")
+    assert (
+        sum(part["rows"] for part in manifest["tables"]["growth_rates"]["units"]["unit1"])
+        == 30
+    )
+    assert connection.execute(
+        "SELECT COUNT(*) FROM growth_rates WHERE experiment='old_exp'"
+    ).fetchone() == (0,)
+    assert connection.execute(
+        "SELECT COUNT(*) FROM growth_rates WHERE experiment='new_exp'"
+    ).fetchone() == (60,)
+
+    export_experiment_data("old_exp", str(tmp_path / "export.zip"), ["growth_rates"])
+
+    with zipfile.ZipFile(tmp_path / "export.zip") as zf:
+        (csv_file,) = zf.namelist()
+        assert csv_file.startswith("old_exp-growth_rates-")
+        assert len(zf.read(csv_file).decode().splitlines()) == 61  # header + rows
+
+
+def test_archive_keeps_rows_that_arrive_while_archiving(tmp_path, monkeypatch):
+    from pioreactor.actions.leader import archive_experiment as archive_module
+
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+    monkeypatch.setitem(config["storage"], "archive_directory", str(tmp_path / "archive"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.executemany(
+        "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES (?, ?, ?, ?)",
+        [(f"2021-01-01T00:00:{i:02d}", "old_exp", 0.1 * i, "unit1") for i in range(10)],
+    )
+    connection.commit()
+
+    # a row arrives after the export, before the delete.
+    def late_row():
+        connection.execute(
+            "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES ('2021-01-01T00:01:00', 'old_exp', 1.0, 'unit1')"
+        )
+        connection.commit()
+        return "2021-01-02T00:00:00"
+
+    monkeypatch.setattr(archive_module, "current_utc_time", late_row)
+    archive_experiment("old_exp", force=True)
+
+    (part,) = read_manifest("old_exp")["tables"]["growth_rates"]["units"]["unit1"]
+    assert part["rows"] == 10
+    assert part["max_rowid"] == 10
+    assert connection.execute(
+        "SELECT COUNT(*) FROM growth_rates WHERE experiment='old_exp'"
+    ).fetchone() == (1,)
+
+
+def test_logs_are_archived_and_exported_from_the_log_database(tmp_path, monkeypatch):
+    from pioreactor.utils.log_store import create_log_database
+
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+    monkeypatch.setitem(config["storage"], "log_database", str(tmp_path / "logs.sqlite"))
+    monkeypatch.setitem(config["storage"], "archive_directory", str(tmp_path / "archive"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    create_log_database(config["storage"]["log_database"])
+    log_connection = sqlite3.connect(config["storage"]["log_database"])
+    log_connection.executemany(
+        "INSERT INTO logs (timestamp, experiment, message, pioreactor_unit, source, level, task) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (f"2021-01-01T00:00:{i:02d}", exp, "hi", "unit1", "app", "INFO", "stirring")
+            for i in range(5)
+            for exp in ["old_exp", "new_exp"]
+        ],
+    )
+    log_connection.commit()
+
+    export_experiment_data("new_exp", str(tmp_path / "live.zip"), ["logs"])
+    with zipfile.ZipFile(tmp_path / "live.zip") as zf:
+        (csv_file,) = zf.namelist()
+        assert len(zf.read(csv_file).decode().splitlines()) == 6
+
+    archive_experiment("old_exp", force=True)
+    assert log_connection.execute(
+        "SELECT COUNT(*) FROM logs WHERE experiment='old_exp'"
+    ).fetchone() == (0,)
+
+    export_experiment_data("old_exp", str(tmp_path / "archived.zip"), ["logs"])
+    with zipfile.ZipFile(tmp_path / "archived.zip") as zf:
+        (csv_file,) = zf.namelist()
+        assert len(zf.read(csv_file).decode().splitlines()) == 6
+
+
+def test_export_reads_archived_and_live_rows_with_filters(tmp_path, monkeypatch):
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+    monkeypatch.setitem(config["storage"], "archive_directory", str(tmp_path / "archive"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    insert = "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES (?, ?, ?, ?)"
+    connection.executemany(
+        insert,
+        [
+            (f"2021-01-01T00:00:{i:02d}", "old_exp", 0.1 * i, unit)
+            for i in range(10)
+            for unit in ["unit1", "unit2"]
+        ],
+    )
+    connection.commit()
+    archive_experiment("old_exp", force=True)
+
+    # arrives after the archive
+    connection.execute(insert, ("2021-01-01T00:01:00", "old_exp", 1.0, "unit1"))
+    connection.commit()
+
+    export_experiment_data(
+        "old_exp",
+        str(tmp_path / "export.zip"),
+        ["growth_rates"],
+        units=["unit1"],
+        since="2021-01-01T00:00:05Z",
+    )
+    with zipfile.ZipFile(tmp_path / "export.zip") as zf:
+        (csv_file,) = zf.namelist()
+        lines = zf.read(csv_file).decode().splitlines()
+
+    assert len(lines) == 1 + 5 + 1  # header, archived rows since 00:05, the late row
+    assert all("unit2" not in line for line in lines)
+
+
+def test_archive_keeps_rows_without_a_unit(tmp_path, monkeypatch):
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+    monkeypatch.setitem(config["storage"], "archive_directory", str(tmp_path / "archive"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    # ex: a plugin's table
+    connection.execute(
+        "CREATE TABLE plugin_readings (timestamp TEXT, experiment TEXT, pioreactor_unit TEXT, value REAL)"
+    )
+    connection.executemany(
+        "INSERT INTO plugin_readings VALUES (?, ?, ?, ?)",
+        [
+            (f"2021-01-01T00:00:{i:02d}", "old_exp", unit, float(i))
+            for i in range(5)
+            for unit in ["unit1", None]
+        ],
+    )
+    connection.commit()
+
+    archive_experiment("old_exp", force=True)
+
+    units = read_manifest("old_exp")["tables"]["plugin_readings"]["units"]
+    assert units["unit1"][0]["rows"] == 5
+    assert units["null"][0]["rows"] == 5
+    assert connection.execute("SELECT COUNT(*) FROM plugin_readings").fetchone() == (0,)
@@ -188,3 +188,25 @@ def test_state_transition_callbacks():
 
     publish(f"pioreactor/{unit}/{exp}/monitor/$state", "ready")
     assert tj.on_sleeping_to_ready
+
+
+def test_unretained_attributes_are_cleared_on_start():
+    from pioreactor.pubsub import PublishPolicy, subscribe
+
+    unit = get_unit_name()
+    exp = get_latest_experiment_name()
+
+    class JobWithReadings(BackgroundJob):
+        editable_settings = ["reading"]
+        publish_policies = {"reading": PublishPolicy(retain=False)}
+
+    # retained by an earlier version, or a run that didn't disconnect cleanly
+    publish(f"pioreactor/{unit}/{exp}/job_with_readings/reading", "1.0", retain=True)
+    pause()
+
+    job = JobWithReadings(job_name="job_with_readings", unit=unit, experiment=exp)
+    pause()
+    assert (
+        subscribe(f"pioreactor/{unit}/{exp}/job_with_readings/reading", timeout=1) is None
+    )
+    job.set_state("disconnected")
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import pytest
+import sh
+
+from pioreactor.config import config
+from pioreactor.actions.leader.backup_database import get_backup_settings, copy_to_workers
+
+
+@pytest.fixture
+def backup_config():
+    previous = (
+        dict(config["backup_database"]) if config.has_section("backup_database") else None
+    )
+
+    def set_backup_config(settings):
+        config["backup_database"] = settings
+
+    yield set_backup_config
+    if previous is None:
+        config.remove_section("backup_database")
+    else:
+        config["backup_database"] = previous
+
+
+def test_get_backup_settings(backup_config):
+    backup_config(
+        {"pages_per_step": "500", "pause_between_steps": "0.1", "bwlimit_kbps": "4000"}
+    )
+
+    assert get_backup_settings(throttle=False) == (500, 0.1, 4000)
+    # throttled while od_reading is running: smaller steps, longer pauses, less bandwidth.
+    assert get_backup_settings(throttle=True) == (50, pytest.approx(1.0), 1000)
+
+    backup_config({"pages_per_step": "5", "bwlimit_kbps": "2"})
+    assert get_backup_settings(throttle=True) == (1, pytest.approx(0.5), 1)
+
+
+class FakeRsync:
+    # records which workers were copied to, and fails the copies to `offline` workers.
+    def __init__(self, offline):
+        self.offline = offline
+        self.copied_to = []
+        self.bwlimits = set()
+
+    def __call__(self, *args, _bg=False):
+        assert _bg
+        *options, source, destination = args
+        unit = destination.split(":")[0]
+        self.copied_to.append(unit)
+        self.bwlimits.update(o for o in options if o.startswith("--bwlimit"))
+        return FakeTransfer(unit in self.offline)
+
+
+class FakeTransfer:
+    def __init__(self, fails):
+        self.fails = fails
+
+    def wait(self):
+        if self.fails:
+            raise sh.ErrorReturnCode_255("rsync", b"", b"ssh: connect to host")
+
+
+def test_copy_to_workers_tries_the_next_worker_when_one_fails(monkeypatch):
+    rsync = FakeRsync(offline={"worker1", "worker3"})
+    # sh finds commands on attribute access, so rsync isn't an attribute of the module yet.
+    monkeypatch.setattr(sh, "rsync", rsync, raising=False)
+
+    n_copies = copy_to_workers(
+        "backup.sqlite",
+        ["worker1", "worker2", "worker3", "worker4", "worker5"],
+        500,
+        logging.getLogger("test"),
+    )
+    assert n_copies == 2
+    # first two in parallel, then one at a time until there are two copies.
+    assert rsync.copied_to == ["worker1", "worker2", "worker3", "worker4"]
+    assert rsync.bwlimits == {"--bwlimit=500"}
+
+
+def test_copy_to_workers_gives_up_when_no_workers_are_left(monkeypatch):
+    rsync = FakeRsync(offline={"worker1", "worker2", "worker3"})
+    monkeypatch.setattr(sh, "rsync", rsync, raising=False)
+
+    logger = logging.getLogger("test")
+    assert (
+        copy_to_workers("backup.sqlite", ["worker1", "worker2", "worker3"], 500, logger)
+        == 0
+    )
+    assert rsync.copied_to == ["worker1", "worker2", "worker3"]
+
+    assert copy_to_workers("backup.sqlite", [], 500, logger) == 0
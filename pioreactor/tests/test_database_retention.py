@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from pioreactor.background_jobs.leader.database_retention import (
+    parse_duration,
+    parse_retention_rule,
+    enforce_rule,
+    thin,
+)
+from pioreactor.utils import local_intermittent_storage
+
+
+def ago(**kwargs):
+    return (datetime.utcnow() - timedelta(**kwargs)).isoformat()
+
+
+def forget_thinning(table):
+    with local_intermittent_storage("database_retention") as cache:
+        for key in [table, f"{table}.last_kept"]:
+            if key.encode() in cache.keys():
+                del cache[key]
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "test.sqlite"))
+    connection.executescript(open("sql/create_tables.sql").read())
+    yield connection
+    connection.close()
+
+
+def test_parse_retention_rule():
+    assert parse_duration("90s") == 90
+    assert parse_duration("14d") == 14 * 24 * 60 * 60
+
+    rule = parse_retention_rule("logs.DEBUG", "14d")
+    assert (rule.table, rule.level, rule.thin_interval) == ("logs", "DEBUG", None)
+
+    rule = parse_retention_rule("kalman_filter_outputs", "7d thin 1m")
+    assert (rule.table, rule.max_age, rule.thin_interval) == (
+        "kalman_filter_outputs",
+        7 * 24 * 60 * 60,
+        60,
+    )
+
+    rule = parse_retention_rule("experiments._testing_*", "1d")
+    assert (rule.table, rule.experiment_glob) == (None, "_testing_*")
+
+    with pytest.raises(ValueError):
+        parse_retention_rule("pid_logs", "14 days")
+
+    with pytest.raises(ValueError):
+        parse_retention_rule("pid_logs", "7d keep 1m")
+
+
+def test_delete_old_logs_of_a_level(connection):
+    connection.executemany(
+        "INSERT INTO logs (timestamp, experiment, message, pioreactor_unit, source, level) VALUES (?, 'exp', 'msg', 'unit1', 'app', ?)",
+        [(ago(days=20), "DEBUG")] * 1200
+        + [(ago(days=20), "INFO"), (ago(days=1), "DEBUG")],
+    )
+    connection.commit()
+
+    n_deleted = enforce_rule(
+        connection, parse_retention_rule("logs.DEBUG", "14d"), batch_size=500
+    )
+    assert n_deleted == 1200
+    assert connection.execute("SELECT level FROM logs ORDER BY level").fetchall() == [
+        ("DEBUG",),
+        ("INFO",),
+    ]
+
+
+def test_thin_keeps_one_row_per_unit_per_interval(connection):
+    forget_thinning("kalman_filter_outputs")
+
+    start = datetime.utcnow() - timedelta(days=10)
+    rows = [
+        (
+            (start + timedelta(seconds=10 * i)).isoformat(),
+            (start + timedelta(seconds=10 * i)).timestamp(),
+            unit,
+        )
+        for i in range(60)  # 10 minutes
+        for unit in ["unit1", "unit2"]
+    ]
+    connection.executemany(
+        "INSERT INTO kalman_filter_outputs (timestamp, timestamp_epoch, pioreactor_unit, experiment, state, covariance_matrix) VALUES (?, ?, ?, 'exp', x'', x'')",
+        rows,
+    )
+    connection.executemany(
+        "INSERT INTO kalman_filter_outputs (timestamp, timestamp_epoch, pioreactor_unit, experiment, state, covariance_matrix) VALUES (?, ?, 'unit1', 'exp', x'', x'')",
+        [(ago(hours=1), 0.0)] * 10,
+    )
+    connection.commit()
+
+    rule = parse_retention_rule("kalman_filter_outputs", "7d thin 1m")
+    enforce_rule(connection, rule, batch_size=7)
+
+    counts = dict(
+        connection.execute(
+            "SELECT pioreactor_unit, COUNT(*) FROM kalman_filter_outputs WHERE timestamp < ? GROUP BY pioreactor_unit",
+            (ago(days=7),),
+        ).fetchall()
+    )
+    # 10 minutes of data, possibly straddling 11 one-minute buckets
+    assert counts["unit1"] in (10, 11)
+    assert counts["unit2"] in (10, 11)
+
+    # recent rows are untouched
+    assert connection.execute(
+        "SELECT COUNT(*) FROM kalman_filter_outputs WHERE timestamp > ?", (ago(days=1),)
+    ).fetchone() == (10,)
+
+    # running again doesn't rescan (or delete) anything
+    assert enforce_rule(connection, rule) == 0
+
+
+def test_thin_resumes_where_it_stopped_as_rows_age(connection):
+    forget_thinning("kalman_filter_outputs")
+
+    # minute aligned, so 10 minutes of rows every 10s fill exactly 10 buckets.
+    start = (time.time() - 10 * 24 * 60 * 60) // 60 * 60
+
+    def rows(unit, offset):
+        return [
+            (
+                datetime.utcfromtimestamp(start + offset + 10 * i).isoformat(),
+                start + offset + 10 * i,
+                unit,
+            )
+            for i in range(60)
+        ]
+
+    def at(seconds):
+        return datetime.utcfromtimestamp(start + seconds).isoformat()
+
+    # unit3's rows arrive (ex: from an edge store) after unit2's, which are more recent.
+    connection.executemany(
+        "INSERT INTO kalman_filter_outputs (timestamp, timestamp_epoch, pioreactor_unit, experiment, state, covariance_matrix) VALUES (?, ?, ?, 'exp', x'', x'')",
+        rows("unit1", 0) + rows("unit2", 30 * 60) + rows("unit3", 0),
+    )
+    connection.execute(
+        "INSERT INTO kalman_filter_outputs (timestamp, timestamp_epoch, pioreactor_unit, experiment, state, covariance_matrix) VALUES (?, ?, 'unit4', 'exp', x'', x'')",
+        (ago(hours=1), time.time() - 60 * 60),
+    )
+    connection.commit()
+
+    # stops in unit1's first bucket, then at unit2's first row, then at the end.
+    for cutoff in [at(35), at(15 * 60), at(24 * 60 * 60)]:
+        thin(connection, "kalman_filter_outputs", cutoff, 60, batch_size=7)
+
+    counts = dict(
+        connection.execute(
+            "SELECT pioreactor_unit, COUNT(*) FROM kalman_filter_outputs GROUP BY pioreactor_unit"
+        ).fetchall()
+    )
+    assert counts == {"unit1": 10, "unit2": 10, "unit3": 10, "unit4": 1}
+
+
+def test_delete_old_testing_experiments_from_all_tables(connection):
+    connection.executemany(
+        "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES (?, ?, 0.1, 'unit1')",
+        [
+            (ago(days=2), "_testing_abc"),
+            (ago(hours=1), "_testing_abc"),
+            (ago(days=2), "real_experiment"),
+        ],
+    )
+    connection.execute(
+        "INSERT INTO experiments (experiment, timestamp) VALUES (?, ?)",
+        ("_testing_abc", ago(days=2)),
+    )
+    connection.commit()
+
+    n_deleted = enforce_rule(
+        connection, parse_retention_rule("experiments._testing_*", "1d")
+    )
+    assert n_deleted == 2
+    assert connection.execute(
+        "SELECT experiment FROM growth_rates ORDER BY experiment"
+    ).fetchall() == [("_testing_abc",), ("real_experiment",)]
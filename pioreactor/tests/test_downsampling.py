@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from pioreactor.utils.downsampling import lttb
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(10_000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321] = 10.0  # a spike that averaging would hide
+
+    x_out, y_out = lttb(x, y, 200)
+
+    assert len(x_out) == len(y_out) == 200
+    assert x_out[0] == 0 and x_out[-1] == 9_999
+    assert np.all(np.diff(x_out) > 0)
+    assert 10.0 in y_out
+
+
+def test_lttb_returns_short_series_unchanged():
+    x, y = lttb([0, 1, 2], [1, 2, 3], 10)
+    assert x.tolist() == [0, 1, 2]
+    assert y.tolist() == [1, 2, 3]
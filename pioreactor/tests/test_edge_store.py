@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import threading
+from pioreactor.utils.edge_store import (
+    EdgeStore,
+    encode_batch,
+    decode_batch,
+    sync_edge_store,
+)
+from pioreactor.background_jobs.base import BackgroundJob
+from pioreactor.pubsub import QOS, subscribe_and_callback
+from pioreactor.whoami import get_unit_name, get_latest_experiment_name
+
+TOPIC = "pioreactor/unit1/exp1/growth_rate_calculating/growth_rate"
+
+
+def test_edge_store_records_and_marks_synced(tmp_path):
+    store = EdgeStore(str(tmp_path / "edge.sqlite"))
+    store.record(TOPIC, '{"growth_rate": 0.1}', synced=True)
+    store.record(TOPIC, '{"growth_rate": 0.2}', synced=False)
+    store.record(TOPIC, '{"growth_rate": 0.3}', synced=False)
+
+    assert store.n_unsynced() == 2
+    rows = store.unsynced()
+    assert [seq for seq, _, _ in rows] == [2, 3]
+    assert decode_batch(encode_batch(rows)) == [(s, t, bytes(p)) for s, t, p in rows]
+
+    store.mark_synced(2)
+    assert [seq for seq, _, _ in store.unsynced()] == [3]
+
+    # a recreated store continues after the leader's watermark
+    store.continue_after(100)
+    store.record(TOPIC, '{"growth_rate": 0.4}', synced=False)
+    assert [seq for seq, _, _ in store.unsynced()] == [3, 101]
+
+    assert store.prune(keep_days=0) == 2
+    store.close()
+
+
+def test_sync_is_idempotent_across_resends(tmp_path):
+    store = EdgeStore(str(tmp_path / "edge.sqlite"))
+    for i in range(25):
+        store.record(TOPIC, f'{{"growth_rate": {i}}}', synced=False)
+
+    # the leader: stores messages it hasn't seen, and replies with its watermark - but the first reply is lost.
+    stored, leader_watermark, replies = [], [0], [None]
+
+    def publish_batch(batch, last_seq):
+        for seq, _, payload in decode_batch(batch):
+            if seq > leader_watermark[0]:
+                stored.append(payload)
+        leader_watermark[0] = max(leader_watermark[0], last_seq)
+        return replies.pop() if replies else leader_watermark[0]
+
+    watermark = sync_edge_store(store, publish_batch, watermark=0, batch_size=10)
+    assert watermark == 0
+    assert store.n_unsynced() == 25
+
+    watermark = sync_edge_store(store, publish_batch, watermark=watermark, batch_size=10)
+    assert watermark == 25
+    assert store.n_unsynced() == 0
+    assert len(stored) == 25
+
+
+def test_sync_uploads_batches_over_mqtt(tmp_path):
+    unit = get_unit_name()
+    exp = get_latest_experiment_name()
+    batch_topic = f"pioreactor/{unit}/{exp}/edge_sync/batch"
+
+    store = EdgeStore(str(tmp_path / "edge.sqlite"))
+    for i in range(5):
+        store.record(TOPIC, f'{{"growth_rate": {i}}}', synced=False)
+
+    # stands in for the leader's streamer: stores the batch, and acknowledges it.
+    received, watermark, acknowledged = [], [0], threading.Event()
+
+    def leader(message):
+        rows = decode_batch(message.payload)
+        received.extend(rows)
+        watermark[0] = rows[-1][0]
+        acknowledged.set()
+
+    subscribe_and_callback(leader, batch_topic, allow_retained=False)
+    job = BackgroundJob(job_name="edge_sync_test", unit=unit, experiment=exp)
+
+    def publish_batch(batch, last_seq):
+        acknowledged.clear()
+        job.publish(batch_topic, batch, qos=QOS.AT_LEAST_ONCE)
+        return watermark[0] if acknowledged.wait(timeout=10) else None
+
+    try:
+        assert sync_edge_store(store, publish_batch, watermark=0) == 5
+        assert [payload for _, _, payload in received][-1] == b'{"growth_rate": 4}'
+        assert store.n_unsynced() == 0
+    finally:
+        job.set_state(job.DISCONNECTED)
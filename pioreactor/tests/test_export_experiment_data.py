@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import sqlite3
+import zipfile
+
+import pytest
+
+from pioreactor.config import config
+from pioreactor.actions.leader.export_experiment_data import export_experiment_data
+from pioreactor.actions.leader.migrate_database import to_epoch
+
+
+def test_export_streams_ordered_rows_into_zip(tmp_path, monkeypatch):
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.executemany(
+        "INSERT INTO growth_rates (timestamp, experiment, rate, pioreactor_unit) VALUES (?, ?, ?, ?)",
+        [
+            (
+                f"2021-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+                "exp",
+                0.1,
+                unit,
+            )
+            for i in reversed(range(6_000))
+            for unit in ["unit2", "unit1"]
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+    export_experiment_data("exp", str(tmp_path / "export.zip"), ["growth_rates"])
+
+    # nothing but the zip is written
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["export.zip", "test.sqlite"]
+
+    with zipfile.ZipFile(tmp_path / "export.zip") as zf:
+        (name,) = zf.namelist()
+        with zf.open(name) as f:
+            rows = list(csv.DictReader(io.TextIOWrapper(f, encoding="utf-8")))
+
+    assert len(rows) == 12_000
+    keys = [(row["pioreactor_unit"], row["timestamp"]) for row in rows]
+    assert keys == sorted(keys)
+
+
+def test_export_parquet_with_filters(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    monkeypatch.setitem(config["storage"], "database", str(tmp_path / "test.sqlite"))
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.executemany(
+        "INSERT INTO growth_rates (timestamp, timestamp_epoch, experiment, rate, pioreactor_unit) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                f"2021-01-{day:02d}T00:00:00",
+                to_epoch(f"2021-01-{day:02d}T00:00:00"),
+                "exp",
+                0.1,
+                unit,
+            )
+            for day in range(1, 31)
+            for unit in ["unit1", "unit2", "unit3"]
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+    export_experiment_data(
+        "exp",
+        str(tmp_path / "export.zip"),
+        ["growth_rates"],
+        format="parquet",
+        units=["unit1", "unit3"],
+        # compared as times, not strings: "2021-01-10T00:00:00" < "2021-01-10T00:00:00Z" as strings.
+        since="2021-01-10T00:00:00Z",
+        until="2021-01-20T00:00:00+00:00",
+        columns=["timestamp", "pioreactor_unit", "rate"],
+    )
+
+    with zipfile.ZipFile(tmp_path / "export.zip") as zf:
+        (name,) = zf.namelist()
+        assert name.endswith(".parquet")
+        table = pq.read_table(io.BytesIO(zf.read(name)))
+
+    assert table.column_names == [
+        "timestamp_localtime",
+        "timestamp",
+        "rate",
+        "pioreactor_unit",
+    ]
+    assert table.num_rows == 2 * 10
+    assert set(table.column("pioreactor_unit").to_pylist()) == {"unit1", "unit3"}
+    assert min(table.column("timestamp").to_pylist()) == "2021-01-10T00:00:00"
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import pytest
+from pioreactor.config import config
+from pioreactor.utils.log_store import LogStore, query_logs
+
+
+def log_line(i, level="DEBUG", task="stirring", unit="unit1"):
+    return {
+        "timestamp": f"2021-01-01T00:00:{i % 60:02d}.{i:06d}",
+        "experiment": "exp",
+        "message": f"line {i}",
+        "pioreactor_unit": unit,
+        "source": "app",
+        "level": level,
+        "task": task,
+    }
+
+
+@pytest.fixture
+def logs_config():
+    previous = dict(config["storage.logs"]) if config.has_section("storage.logs") else None
+
+    def set_logs_config(settings):
+        config["storage.logs"] = settings
+
+    yield set_logs_config
+    if previous is None:
+        config.remove_section("storage.logs")
+    else:
+        config["storage.logs"] = previous
+
+
+def test_chatty_task_is_rate_limited_but_warnings_are_kept(tmp_path, logs_config):
+    logs_config({"rate_limit": "1", "rate_limit_burst": "10"})
+    database = str(tmp_path / "logs.sqlite")
+    store = LogStore(database)
+
+    kept = sum(store.add(log_line(i)) for i in range(100))
+    assert kept < 20
+
+    # other tasks have their own limit
+    assert store.add(log_line(0, task="od_reading"))
+
+    # warnings are never limited
+    assert all(store.add(log_line(i, level="WARNING")) for i in range(50))
+
+    store.close()
+    assert store.metrics()["lines_rate_limited"] == 100 - kept
+
+    warnings = query_logs(levels=["warning"], limit=1000, database=database)
+    assert len(warnings) == 50
+    assert [line["message"] for line in warnings] == [f"line {i}" for i in range(50)]
+
+    assert len(query_logs(units=["unit2"], database=database)) == 0
+
+
+def test_sampling_by_level(tmp_path, logs_config):
+    logs_config({"sample.DEBUG": "0.0", "rate_limit": "1000", "rate_limit_burst": "1000"})
+    store = LogStore(str(tmp_path / "logs.sqlite"))
+
+    assert not any(store.add(log_line(i)) for i in range(100))
+    assert all(store.add(log_line(i, level="INFO")) for i in range(100))
+    assert store.metrics()["lines_sampled_out"] == 100
+
+    store.close()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import numpy as np
+from pioreactor.utils.matrix_blobs import pack_array, unpack_array, unpack_arrays
+
+
+def test_roundtrip_vectors_and_matrices():
+    state = [1.0, 0.001, -0.0002]
+    covariance = np.array([[1.0, 0.1, 0.2], [0.1, 2.0, 0.3], [0.2, 0.3, 3.0]])
+
+    assert np.allclose(unpack_array(pack_array(state)), state)
+    assert np.allclose(unpack_array(pack_array(covariance)), covariance)
+    assert np.allclose(
+        unpack_array(pack_array(covariance, dtype="float32", upper_triangle=True)),
+        covariance,
+    )
+
+    # upper triangle of a 6x6 float32 is much smaller than JSON
+    big_covariance = np.random.rand(6, 6) * 1e-4
+    assert (
+        len(pack_array(big_covariance, dtype="float32", upper_triangle=True))
+        < len(json.dumps(big_covariance.tolist())) / 4
+    )
+
+
+def test_unpack_arrays_is_vectorized_and_handles_legacy_json():
+    covariances = np.random.rand(50, 4, 4)
+    covariances = covariances + covariances.transpose(0, 2, 1)
+    blobs = [pack_array(c, upper_triangle=True) for c in covariances]
+
+    decoded = unpack_arrays(blobs)
+    assert decoded.shape == (50, 4, 4)
+    assert np.allclose(decoded, covariances)
+
+    states = unpack_arrays([pack_array([1.0, 2.0]), pack_array([3.0, 4.0])])
+    assert states.shape == (2, 2)
+
+    mixed = unpack_arrays([json.dumps(covariances[0].tolist()), blobs[1]])
+    assert np.allclose(mixed, covariances[:2])
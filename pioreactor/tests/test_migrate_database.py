@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import numpy as np
+from pioreactor.utils.matrix_blobs import unpack_array
+from pioreactor.actions.leader.migrate_database import (
+    migrate_database,
+    to_epoch,
+    MIGRATIONS,
+)
+
+
+def test_migrations_add_indexes_and_backfill_epochs(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+
+    # the schema before any migrations
+    connection = sqlite3.connect(database)
+    connection.executescript(
+        """
+        CREATE TABLE growth_rates (
+            timestamp              TEXT  NOT NULL,
+            experiment             TEXT  NOT NULL,
+            rate                   REAL  NOT NULL,
+            pioreactor_unit        TEXT  NOT NULL
+        );
+        CREATE INDEX growth_rates_ix ON growth_rates (experiment);
+        CREATE TABLE kalman_filter_outputs (
+            timestamp                TEXT NOT NULL,
+            pioreactor_unit          TEXT NOT NULL,
+            experiment               TEXT NOT NULL,
+            state                    TEXT NOT NULL,
+            covariance_matrix        TEXT NOT NULL
+        );
+        INSERT INTO kalman_filter_outputs VALUES ('2021-06-01T00:00:00', 'unit1', 'exp', '[1.0, 0.1]', '[[1.0, 0.5], [0.5, 2.0]]');
+        """
+    )
+    connection.executemany(
+        "INSERT INTO growth_rates VALUES (?, 'exp', 0.1, 'unit1')",
+        [("2021-06-01T00:00:00",), ("2021-06-01T00:00:01.500000",)],
+    )
+    connection.commit()
+
+    assert migrate_database(database) == MIGRATIONS[-1][0]
+
+    index_columns = [
+        row[2] for row in connection.execute("PRAGMA index_info(growth_rates_ix)")
+    ]
+    assert index_columns == ["experiment", "pioreactor_unit", "timestamp"]
+
+    epochs = [
+        row[0]
+        for row in connection.execute(
+            "SELECT timestamp_epoch FROM growth_rates ORDER BY timestamp"
+        )
+    ]
+    assert abs(epochs[0] - to_epoch("2021-06-01T00:00:00")) < 1e-3
+    assert abs(epochs[1] - 1622505601.5) < 1e-3
+
+    state, covariance_matrix = connection.execute(
+        "SELECT state, covariance_matrix FROM kalman_filter_outputs"
+    ).fetchone()
+    assert isinstance(state, bytes)
+    assert np.allclose(unpack_array(covariance_matrix), [[1.0, 0.5], [0.5, 2.0]])
+
+    # running again is a no-op
+    assert migrate_database(database) == MIGRATIONS[-1][0]
+
+
+def test_create_tables_is_compatible_with_migrations(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = sqlite3.connect(database)
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.commit()
+
+    assert migrate_database(database) == MIGRATIONS[-1][0]
+
+
+def test_backfill_finishes_with_unparseable_timestamps(tmp_path, monkeypatch):
+    from pioreactor.actions.leader import migrate_database as migrations
+
+    monkeypatch.setattr(migrations, "BACKFILL_CHUNK_SIZE", 2)
+    database = str(tmp_path / "test.sqlite")
+    connection = sqlite3.connect(database)
+    connection.execute(
+        """
+        CREATE TABLE growth_rates (
+            timestamp              TEXT  NOT NULL,
+            experiment             TEXT  NOT NULL,
+            rate                   REAL  NOT NULL,
+            pioreactor_unit        TEXT  NOT NULL
+        )"""
+    )
+    connection.executemany(
+        "INSERT INTO growth_rates VALUES (?, 'exp', 0.1, 'unit1')",
+        [("2021-06-01T00:00:00",), ("not a timestamp",), ("2021-06-01T00:00:02",)],
+    )
+    connection.commit()
+
+    assert migrate_database(database) == MIGRATIONS[-1][0]
+    epochs = [
+        row[0]
+        for row in connection.execute(
+            "SELECT timestamp_epoch FROM growth_rates ORDER BY rowid"
+        )
+    ]
+    assert epochs[1] is None
+    assert abs(epochs[2] - to_epoch("2021-06-01T00:00:02")) < 1e-3
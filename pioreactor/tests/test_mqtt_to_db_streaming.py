@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import sqlite3, time, json
-import numpy as np
+import pytest
 from pioreactor.config import config
 import pioreactor.background_jobs.leader.mqtt_to_db_streaming as m2db
+from pioreactor.utils.matrix_blobs import pack_array, unpack_arrays
 from pioreactor.background_jobs.od_reading import ODReader
 from pioreactor.background_jobs.growth_rate_calculating import GrowthRateCalculator
 
@@ -21,8 +22,10 @@ def test_kalman_filter_entries():
             "experiment": metadata.experiment,
             "pioreactor_unit": metadata.pioreactor_unit,
             "timestamp": metadata.timestamp,
-            "state": json.dumps(payload["state"]),
-            "covariance_matrix": json.dumps(payload["covariance_matrix"]),
+            "state": pack_array(payload["state"]),
+            "covariance_matrix": pack_array(
+                payload["covariance_matrix"], dtype="float32", upper_triangle=True
+            ),
         }
 
     # init the database
@@ -64,10 +67,75 @@ def test_kalman_filter_entries():
     assert len(results) > 0
 
     cursor.execute(
-        'SELECT json_array_length("state"), json_array_length("covariance_matrix"), json("covariance_matrix") FROM kalman_filter_outputs WHERE experiment = ? ORDER BY timestamp DESC LIMIT 1',
+        'SELECT "state", "covariance_matrix" FROM kalman_filter_outputs WHERE experiment = ? ORDER BY timestamp DESC',
         (exp,),
     )
-    results = cursor.fetchone()
-    assert results[0] == 4
-    assert results[1] == 4
-    assert np.array(json.loads(results[2])).shape == (4, 4)
+    states, covariance_matrices = zip(*cursor.fetchall())
+    assert unpack_arrays(states).shape[1:] == (4,)
+    assert unpack_arrays(covariance_matrices).shape[1:] == (4, 4)
+
+
+@pytest.fixture
+def ingest_workers_config():
+    previous = (
+        dict(config["mqtt_to_db_streaming"])
+        if config.has_section("mqtt_to_db_streaming")
+        else None
+    )
+    config["mqtt_to_db_streaming"] = {"ingest_workers": "2", "flush_interval": "0.5"}
+    yield
+    if previous is None:
+        config.remove_section("mqtt_to_db_streaming")
+    else:
+        config["mqtt_to_db_streaming"] = previous
+
+
+def test_ingest_workers_write_to_database(monkeypatch, ingest_workers_config):
+    monkeypatch.setitem(config["storage"], "database", "test.sqlite")
+    monkeypatch.setitem(config["od_config.od_sampling"], "samples_per_second", "0.2")
+
+    unit = "unit"
+    exp = "test_ingest_workers_write_to_database"
+
+    def parse_growth_rate(topic, payload, split_topic):
+        payload = json.loads(payload)
+        return {
+            "experiment": split_topic[2],
+            "pioreactor_unit": split_topic[1],
+            "timestamp": payload["timestamp"],
+            "rate": float(payload["growth_rate"]),
+        }
+
+    connection = sqlite3.connect(config["storage"]["database"])
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.commit()
+
+    ODReader(
+        channel_angle_map={"A0": "135", "A1": "90"},
+        sampling_rate=0.5,
+        unit=unit,
+        experiment=exp,
+        fake_data=True,
+    )
+    GrowthRateCalculator(unit=unit, experiment=exp)
+
+    streamer = m2db.MqttToDBStreamer(
+        [
+            m2db.TopicToParserToTable(
+                "pioreactor/+/+/growth_rate_calculating/growth_rate",
+                parse_growth_rate,
+                "growth_rates",
+            )
+        ],
+        unit=unit,
+        experiment=exp,
+    )
+    assert len(streamer.ingest_workers) == 2
+
+    time.sleep(10)
+    streamer.set_state("disconnected")
+
+    (count,) = connection.execute(
+        "SELECT COUNT(*) FROM growth_rates WHERE experiment = ?", (exp,)
+    ).fetchone()
+    assert count > 0
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+from pioreactor.pubsub import (
+    apply_qos_policy,
+    parse_qos_policy,
+    QOS,
+    TopicTrie,
+    AttributePublisher,
+    PublishPolicy,
+)
+
+
+def test_qos_policy_overrides_callers_qos():
+    assert apply_qos_policy(
+        "pioreactor/unit1/exp/od_reading/od_raw/0", qos=QOS.EXACTLY_ONCE
+    ) == (QOS.AT_LEAST_ONCE, False)
+    assert apply_qos_policy(
+        "pioreactor/unit1/exp/growth_rate_calculating/kalman_filter_outputs",
+        qos=QOS.EXACTLY_ONCE,
+    ) == (QOS.AT_MOST_ONCE, False)
+    assert apply_qos_policy("pioreactor/unit1/exp/dosing_events", retain=True) == (
+        QOS.EXACTLY_ONCE,
+        False,
+    )
+
+
+def test_qos_policy_keeps_callers_retain():
+    assert apply_qos_policy(
+        "pioreactor/unit1/exp/stirring/duty_cycle", qos=QOS.EXACTLY_ONCE, retain=True
+    ) == (QOS.AT_LEAST_ONCE, True)
+    assert apply_qos_policy("pioreactor/unit1/exp/stirring/$state", retain=False) == (
+        QOS.EXACTLY_ONCE,
+        True,
+    )
+
+
+def test_qos_policy_applies_to_subscriptions():
+    assert apply_qos_policy("pioreactor/+/+/od_reading/od_raw/+") == (
+        QOS.AT_LEAST_ONCE,
+        False,
+    )
+
+
+def test_unmatched_topics_use_callers_qos():
+    assert apply_qos_policy(
+        "pioreactor/unit1/exp/stirring/duty_cycle/set", qos=QOS.EXACTLY_ONCE
+    ) == (QOS.EXACTLY_ONCE, False)
+
+
+def test_parse_qos_policy():
+    assert parse_qos_policy("0") == (0, None)
+    assert parse_qos_policy("1, retain") == (1, True)
+    assert parse_qos_policy("2,no_retain") == (2, False)
+
+
+class RecordingClient:
+    # records what the registry asks of a paho client
+    def __init__(self):
+        self.subscribe_calls = []
+        self.unsubscribe_calls = []
+        self.message_callbacks = {}
+
+    def subscribe(self, topics_and_qos):
+        self.subscribe_calls.append(topics_and_qos)
+
+    def unsubscribe(self, topic):
+        self.unsubscribe_calls.append(topic)
+
+    def message_callback_add(self, topic, callback):
+        self.message_callbacks[topic] = callback
+
+    def message_callback_remove(self, topic):
+        del self.message_callbacks[topic]
+
+
+def test_subscription_registry_dedupes_and_restores_in_one_subscribe():
+    from pioreactor.pubsub import SubscriptionRegistry
+
+    client = RecordingClient()
+    registry = SubscriptionRegistry(client)
+    received = []
+
+    def callback(client, userdata, message):
+        received.append(message)
+
+    registry.add([("a/b", 0), ("a/c", 1)], callback)
+    registry.add(
+        [("a/b", 0), ("a/c", 1)], callback
+    )  # re-running subscriptions is a no-op
+    registry.add([("a/b", 2)], lambda *args: received.append("other"), key="other")
+
+    assert client.subscribe_calls == [[("a/b", 0), ("a/c", 1)], [("a/b", 2)]]
+
+    client.message_callbacks["a/b"](client, None, "msg")
+    assert received == ["msg", "other"]
+
+    registry.restore()
+    assert client.subscribe_calls[-1] == [("a/b", 2), ("a/c", 1)]
+
+    registry.remove("a/b", key="other")
+    assert client.unsubscribe_calls == []
+    registry.remove("a/b")
+    assert client.unsubscribe_calls == ["a/b"]
+    assert registry.topics == ["a/c"]
+
+
+def test_topic_trie_matches_like_mqtt():
+    from paho.mqtt.client import topic_matches_sub
+
+    patterns = [
+        "pioreactor/+/+/od_reading/od_raw/+",
+        "pioreactor/+/+/logs/+",
+        "pioreactor/+/+/dosing_events",
+        "pioreactor/+/od_blank/+",
+        "pioreactor/+/+/growth_rate_calculating/#",
+        "pioreactor/unit1/#",
+    ]
+    trie = TopicTrie()
+    for pattern in patterns:
+        trie.add(pattern, pattern)
+    assert len(trie) == len(patterns)
+
+    topics = [
+        "pioreactor/unit1/exp/od_reading/od_raw/A0",
+        "pioreactor/unit2/exp/od_reading/od_raw/A0",
+        "pioreactor/unit2/exp/od_reading/od_raw",
+        "pioreactor/unit2/exp/logs/app",
+        "pioreactor/unit2/exp/dosing_events",
+        "pioreactor/unit2/od_blank/A0",
+        "pioreactor/unit2/exp/growth_rate_calculating",
+        "pioreactor/unit2/exp/growth_rate_calculating/growth_rate",
+        "pioreactor/unit1",
+        "pioreactor/unit2/exp/stirring/$state",
+    ]
+    for topic in topics:
+        assert sorted(trie.match(topic.split("/"))) == sorted(
+            p for p in patterns if topic_matches_sub(p, topic)
+        ), topic
+
+
+def test_attribute_publisher_coalesces_within_the_interval():
+    published = []
+    publisher = AttributePublisher(
+        lambda topic, value, **kwargs: published.append((topic, value, kwargs)),
+        {"duty_cycle": PublishPolicy(min_interval=0.2)},
+    )
+
+    for value in [10, 20, 30]:
+        publisher.update("duty_cycle", "t/duty_cycle", value, retain=True)
+    publisher.update("state", "t/$state", "ready", retain=True)
+
+    # the first is published right away, as is anything without a policy
+    assert [v for _, v, _ in published] == [10, "ready"]
+
+    time.sleep(0.4)
+    assert [v for _, v, _ in published] == [10, "ready", 30]
+    assert publisher.n_coalesced == 1
+
+
+def test_attribute_publisher_flushes_held_values_and_applies_policies():
+    published = []
+    publisher = AttributePublisher(
+        lambda topic, value, **kwargs: published.append((value, kwargs["retain"])),
+        {
+            "temperature": PublishPolicy(change_threshold=0.5),
+            "A0": PublishPolicy(retain=False),
+        },
+    )
+
+    publisher.update("temperature", "t/temperature", 30.0, retain=True)
+    publisher.update("temperature", "t/temperature", 30.2, retain=True)  # held
+    publisher.update("temperature", "t/temperature", 30.3, retain=True)  # held
+    publisher.update("A0", "t/A0", lambda: 1.5, retain=True)
+    assert published == [(30.0, True), (1.5, False)]
+
+    publisher.flush()
+    assert published[-1] == (30.3, True)
+
+    publisher.close()
+    publisher.update("temperature", "t/temperature", 30.4, retain=True)
+    assert published[-1] == (30.4, True)
+
+
+class FakeBroker:
+    """
+    Stands in for paho's Client in `snapshot`: delivers the retained values matching a subscription, then
+    our own message to the sentinel topic, like the broker does (unless drop_sentinel).
+    """
+
+    def __init__(self, retained, drop_sentinel=False, failed_connects=0):
+        self.retained = retained
+        self.drop_sentinel = drop_sentinel
+        self.failed_connects = failed_connects
+        self.connects = 0
+
+    def Client(self):
+        broker = self
+
+        class Client:
+            def connect(self, hostname):
+                broker.connects += 1
+                if broker.connects <= broker.failed_connects:
+                    raise ConnectionRefusedError()
+
+            def loop_start(self):
+                self.on_connect(self, None, {}, 0)
+
+            def subscribe(self, topics_and_qos):
+                from paho.mqtt.client import topic_matches_sub
+
+                self.subscriptions = [topic for topic, _ in topics_and_qos]
+                for topic, payload in broker.retained.items():
+                    if any(topic_matches_sub(sub, topic) for sub in self.subscriptions):
+                        self.on_message(self, None, Message(topic, payload))
+                self.on_subscribe(self, None, 1, [0])
+
+            def publish(self, topic, payload, qos=0):
+                if (topic in self.subscriptions) and not broker.drop_sentinel:
+                    self.on_message(self, None, Message(topic, payload))
+
+            def disconnect(self):
+                pass
+
+            def loop_stop(self):
+                pass
+
+        return Client()
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def test_snapshot_finishes_when_the_sentinel_comes_back(monkeypatch):
+    import paho.mqtt.client
+    from pioreactor.pubsub import snapshot
+
+    broker = FakeBroker(
+        {
+            "pioreactor/unit1/exp/od_blank/0": b"0.05",
+            "pioreactor/unit1/exp/od_blank/1": b"0.06",
+            "pioreactor/unit1/exp/stirring/duty_cycle": b"50",
+            "pioreactor/unit1/exp/stirring/rpm": b"",  # a cleared retained value
+            "pioreactor/unit2/exp/od_blank/0": b"0.07",
+        }
+    )
+    monkeypatch.setattr(paho.mqtt.client, "Client", broker.Client)
+
+    start = time.time()
+    retained = snapshot(
+        [
+            "pioreactor/unit1/exp/od_blank/+",
+            "pioreactor/unit1/exp/stirring/duty_cycle",
+            "pioreactor/unit1/exp/stirring/rpm",
+        ],
+        deadline=5,
+    )
+    assert time.time() - start < 1
+    assert retained == {
+        "pioreactor/unit1/exp/od_blank/0": b"0.05",
+        "pioreactor/unit1/exp/od_blank/1": b"0.06",
+        "pioreactor/unit1/exp/stirring/duty_cycle": b"50",
+    }
+
+
+def test_snapshot_waits_until_the_deadline_without_the_sentinel(monkeypatch):
+    import paho.mqtt.client
+    from pioreactor.pubsub import snapshot
+
+    broker = FakeBroker({"pioreactor/unit1/exp/od_blank/0": b"0.05"}, drop_sentinel=True)
+    monkeypatch.setattr(paho.mqtt.client, "Client", broker.Client)
+
+    start = time.time()
+    assert snapshot(["pioreactor/unit1/exp/od_blank/+"], deadline=0.5) == {
+        "pioreactor/unit1/exp/od_blank/0": b"0.05"
+    }
+    assert time.time() - start >= 0.5
+
+    # without wildcards, we know when we have every topic, and don't wait.
+    start = time.time()
+    assert snapshot(["pioreactor/unit1/exp/od_blank/0"], deadline=5) == {
+        "pioreactor/unit1/exp/od_blank/0": b"0.05"
+    }
+    assert time.time() - start < 1
+
+
+def test_snapshot_retries_connecting(monkeypatch):
+    import paho.mqtt.client
+    from pioreactor.pubsub import snapshot
+
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+    broker = FakeBroker(
+        {"pioreactor/unit1/exp/stirring/duty_cycle": b"50"}, failed_connects=2
+    )
+    monkeypatch.setattr(paho.mqtt.client, "Client", broker.Client)
+    assert snapshot(["pioreactor/unit1/exp/stirring/duty_cycle"], retries=10) == {
+        "pioreactor/unit1/exp/stirring/duty_cycle": b"50"
+    }
+    assert broker.connects == 3
+
+    broker = FakeBroker({}, failed_connects=100)
+    monkeypatch.setattr(paho.mqtt.client, "Client", broker.Client)
+    with pytest.raises(ConnectionRefusedError):
+        snapshot(["pioreactor/unit1/exp/stirring/duty_cycle"], retries=3)
+    assert 1 < broker.connects < 100
+
+
+def test_snapshot_serves_and_fills_the_cache(monkeypatch):
+    import paho.mqtt.client
+    from pioreactor import pubsub
+
+    monkeypatch.setattr(pubsub, "_retained_cache", {})
+
+    broker = FakeBroker(
+        {
+            "pioreactor/unit1/exp/stirring/duty_cycle": b"50",
+            "pioreactor/unit1/exp/od_blank/0": b"0.05",
+        }
+    )
+    monkeypatch.setattr(paho.mqtt.client, "Client", broker.Client)
+
+    topics = [
+        "pioreactor/unit1/exp/stirring/duty_cycle",
+        "pioreactor/unit1/exp/od_blank/+",
+    ]
+    assert pubsub.snapshot(topics, use_cache=True) == {
+        "pioreactor/unit1/exp/stirring/duty_cycle": b"50",
+        "pioreactor/unit1/exp/od_blank/0": b"0.05",
+    }
+    # only exact topics are cached.
+    assert pubsub._retained_cache == {"pioreactor/unit1/exp/stirring/duty_cycle": b"50"}
+    assert broker.connects == 1
+
+    # served from the cache, without connecting.
+    assert pubsub.snapshot(topics[:1], use_cache=True) == {
+        "pioreactor/unit1/exp/stirring/duty_cycle": b"50"
+    }
+    assert broker.connects == 1
+
+    # live subscriptions keep the cache fresh.
+    pubsub.update_retained_cache(
+        Message("pioreactor/unit1/exp/stirring/duty_cycle", b"60")
+    )
+    assert pubsub.snapshot(topics[:1], use_cache=True) == {
+        "pioreactor/unit1/exp/stirring/duty_cycle": b"60"
+    }
+    pubsub.update_retained_cache(Message("pioreactor/unit1/exp/stirring/duty_cycle", b""))
+    assert pubsub._retained_cache == {}
+
+
+def test_publish_doesnt_wait_for_an_unreachable_leader(monkeypatch, tmp_path):
+    import socket
+    from paho.mqtt import publish as mqtt_publish
+    from pioreactor import pubsub
+    from pioreactor.utils.spool import Spool
+
+    probes, published = [], []
+
+    def unreachable(address, timeout=None):
+        probes.append(address)
+        raise socket.timeout()
+
+    monkeypatch.setattr(pubsub, "_reachability", {})
+    monkeypatch.setattr(socket, "create_connection", unreachable)
+    monkeypatch.setattr(
+        mqtt_publish, "single", lambda *args, **kwargs: published.append(args)
+    )
+    spool = Spool(str(tmp_path))
+    monkeypatch.setattr(pubsub, "get_spool", lambda: spool)
+
+    # dropped, and spooled, without a connection attempt.
+    pubsub.publish(
+        "pioreactor/unit1/exp/growth_rate_calculating/kalman_filter_outputs", "{}"
+    )
+    pubsub.publish("pioreactor/unit1/exp/dosing_events", "{}")
+    assert published == []
+    assert not spool.is_empty()
+
+    # the probe's result is reused for a while.
+    assert len(probes) == 1
+
+
+def test_publish_still_tries_topics_without_a_fallback(monkeypatch):
+    import socket
+    from paho.mqtt import publish as mqtt_publish
+    from pioreactor import pubsub
+
+    def unreachable(address, timeout=None):
+        raise ConnectionRefusedError()
+
+    published = []
+    monkeypatch.setattr(pubsub, "_reachability", {})
+    monkeypatch.setattr(socket, "create_connection", unreachable)
+    monkeypatch.setattr(
+        mqtt_publish, "single", lambda *args, **kwargs: published.append(args)
+    )
+
+    # ex: commands, which have no spool policy. The probe isn't needed for them.
+    pubsub.publish("pioreactor/unit1/exp/stirring/$state/set", "disconnected")
+    assert published == [("pioreactor/unit1/exp/stirring/$state/set",)]
+
+    # a successful publish marks the leader as reachable again.
+    assert pubsub.is_leader_reachable(pubsub.leader_hostname)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from datetime import datetime
+
+from pioreactor.actions.leader.query_time_series import query_time_series
+from pioreactor.utils.rollups import (
+    create_rollup_tables_sql,
+    backfill_sql,
+    choose_source,
+    BUCKETS,
+)
+
+
+def test_choose_source_picks_the_coarsest_table_with_enough_points():
+    assert choose_source("growth_rates", 7 * 24 * 60 * 60, 500) == (
+        "growth_rates_rollup_15m",
+        "bucket_epoch",
+        "mean",
+    )
+    assert choose_source("growth_rates", 24 * 60 * 60, 500)[0] == "growth_rates_rollup_1m"
+    assert choose_source("growth_rates", 60 * 60, 500) == (
+        "growth_rates",
+        "timestamp_epoch",
+        "rate",
+    )
+
+
+def test_query_time_series_reads_rollups_and_downsamples(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = sqlite3.connect(database)
+    connection.executescript(open("sql/create_tables.sql").read())
+    for statement in create_rollup_tables_sql():
+        connection.execute(statement)
+
+    # two days of growth rates, every 30 seconds
+    start = 1622505600.0
+    rows = [
+        (
+            "exp",
+            unit,
+            datetime.utcfromtimestamp(start + 30 * i).isoformat(),
+            float(i % 100),
+            start + 30 * i,
+        )
+        for i in range(2 * 24 * 120)
+        for unit in ["unit1", "unit2"]
+    ]
+    connection.executemany(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate, timestamp_epoch) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    for bucket in BUCKETS:
+        connection.execute(backfill_sql("growth_rates", bucket), ("exp",))
+    connection.commit()
+
+    # the whole experiment, from the 15m rollup: 192 buckets, downsampled to 50
+    result = query_time_series("growth_rates", "exp", points=50, database=database)
+    assert set(result) == {"unit1", "unit2"}
+    series = result["unit1"]["growth_rates"]
+    assert len(series["x"]) == len(series["y"]) == 50
+    assert series["x"][0] == start
+    assert series["x"] == sorted(series["x"])
+
+    # an hour, of one unit, from the raw table: 120 rows, fewer than the points asked for
+    result = query_time_series(
+        "growth_rates",
+        "exp",
+        units=["unit2"],
+        since="2021-06-01T01:00:00",
+        until="2021-06-01T02:00:00",
+        points=500,
+        database=database,
+    )
+    assert set(result) == {"unit2"}
+    series = result["unit2"]["growth_rates"]
+    assert len(series["x"]) == 120
+    assert series["x"][0] == start + 60 * 60
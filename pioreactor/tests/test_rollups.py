@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from pioreactor.utils.rollups import (
+    create_rollup_tables_sql,
+    rollup_upserts,
+    backfill_sql,
+    rollup_table,
+)
+
+
+def test_incremental_rollups_match_backfill():
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(open("sql/create_tables.sql").read())
+    for statement in create_rollup_tables_sql():
+        connection.execute(statement)
+
+    columns = ("experiment", "pioreactor_unit", "timestamp", "rate", "timestamp_epoch")
+    rows = [
+        ("exp", unit, "", float(i % 7), 1622505600.0 + 10 * i)
+        for i in range(200)
+        for unit in ["unit1", "unit2"]
+    ]
+    connection.executemany(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate, timestamp_epoch) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+
+    # the streamer sees rows in batches, which can straddle buckets
+    for batch in [rows[:123], rows[123:]]:
+        for sql, params in rollup_upserts("growth_rates", columns, batch):
+            connection.executemany(sql, params)
+
+    for bucket in ["1m", "15m"]:
+        incremental = connection.execute(
+            f"SELECT * FROM {rollup_table('growth_rates', bucket)} ORDER BY pioreactor_unit, bucket_epoch"
+        ).fetchall()
+
+        connection.execute(f"DELETE FROM {rollup_table('growth_rates', bucket)}")
+        connection.execute(backfill_sql("growth_rates", bucket), ("exp",))
+        backfilled = connection.execute(
+            f"SELECT * FROM {rollup_table('growth_rates', bucket)} ORDER BY pioreactor_unit, bucket_epoch"
+        ).fetchall()
+
+        assert len(incremental) == len(backfilled)
+        for a, b in zip(incremental, backfilled):
+            assert a[:4] == b[:4]  # keys and timestamp
+            assert a[4:6] == b[4:6]  # min, max
+            assert abs(a[6] - b[6]) < 1e-9  # mean
+            assert a[7] == b[7]  # count
+
+    assert rollup_upserts("dosing_events", columns, rows) == []
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from pioreactor import structs
+from pioreactor.utils.sequences import SequenceAllocator, SequenceTracker
+
+
+def test_allocator_continues_after_release_and_skips_after_crash(tmp_path):
+    allocator = SequenceAllocator(str(tmp_path), "od_reading", block_size=10)
+    first = allocator.next()
+    assert [allocator.next() for _ in range(3)] == [first + 1, first + 2, first + 3]
+
+    # a clean exit gives back the rest of the block
+    allocator.release()
+    allocator = SequenceAllocator(str(tmp_path), "od_reading", block_size=10)
+    assert allocator.next() == first + 4
+
+    # a crash (no release) skips the rest of the block, but never reuses numbers
+    crashed_at = allocator.next()
+    allocator = SequenceAllocator(str(tmp_path), "od_reading", block_size=10)
+    assert allocator.next() > crashed_at
+
+
+def test_allocators_of_the_same_source_never_overlap(tmp_path):
+    a = SequenceAllocator(str(tmp_path), "add_media", block_size=5)
+    b = SequenceAllocator(str(tmp_path), "add_media", block_size=5)
+    seqs = [a.next() for _ in range(12)] + [b.next() for _ in range(12)]
+    assert len(set(seqs)) == len(seqs)
+
+
+def test_tracker_skips_duplicates_and_counts_gaps():
+    tracker = SequenceTracker(window=100)
+    assert tracker.is_new("unit1", "od_reading", 1)
+    assert tracker.is_new("unit1", "od_reading", 2)
+    assert not tracker.is_new("unit1", "od_reading", 2)
+    assert tracker.is_new("unit2", "od_reading", 2)
+
+    assert tracker.is_new("unit1", "od_reading", 6)
+    assert tracker.metrics() == {"duplicates": 1, "gaps": 1, "late": 0, "missing": 3}
+
+    assert tracker.is_new("unit1", "od_reading", 4)
+    assert tracker.metrics() == {"duplicates": 1, "gaps": 1, "late": 1, "missing": 2}
+
+    # missing numbers that fall out of the window are forgotten
+    assert tracker.is_new("unit1", "od_reading", 200)
+    assert tracker.metrics()["missing"] == 99
+
+
+def test_messages_without_sequence_numbers_are_still_accepted():
+    event = structs.DosingEvent.from_json(
+        '{"volume_change": 1.0, "event": "add_media", "source_of_event": "app", "timestamp": "2021-06-01T00:00:00"}'
+    )
+    assert event.seq is None
+    row = event.to_row("pioreactor/unit1/exp1/dosing_events".split("/"))
+    assert row["seq"] is None and row["source"] is None
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+from pioreactor.utils.spool import Spool
+
+
+def test_spool_drains_in_order(tmp_path):
+    spool = Spool(str(tmp_path), max_segment_bytes=100)
+
+    for i in range(25):
+        spool.append("pioreactor/unit/exp/dosing_events", f"{i}", qos=2)
+
+    assert not spool.is_empty()
+
+    sent = []
+    assert spool.drain(sent.extend, batch_size=7) == 25
+    assert [int(payload) for (_, payload, _, _) in sent] == list(range(25))
+    assert sent[0] == ("pioreactor/unit/exp/dosing_events", b"0", 2, False)
+    assert spool.is_empty()
+
+
+def test_spool_keeps_messages_if_drain_fails(tmp_path):
+    spool = Spool(str(tmp_path))
+
+    for i in range(10):
+        spool.append("pioreactor/unit/exp/od_reading/od_raw/0", f"{i}", retain=True)
+
+    sent = []
+
+    def flaky_publish_batch(batch):
+        if len(sent) >= 4:
+            raise ConnectionRefusedError()
+        sent.extend(batch)
+
+    with pytest.raises(ConnectionRefusedError):
+        spool.drain(flaky_publish_batch, batch_size=4)
+
+    # new messages arrive while the leader is still down
+    spool.append("pioreactor/unit/exp/od_reading/od_raw/0", "10")
+
+    assert spool.drain(sent.extend, batch_size=4) == 7
+    assert [int(payload) for (_, payload, _, _) in sent] == list(range(11))
+
+
+def test_spool_tracks_emptiness_without_checking_disk_every_time(tmp_path):
+    spool = Spool(str(tmp_path), recheck_interval=60)
+    assert spool.is_empty()
+
+    # another process spools while we are disconnected...
+    other = Spool(str(tmp_path))
+    other.append("pioreactor/unit/exp/dosing_events", "1", qos=2)
+    other.close()
+    assert spool.is_empty()
+
+    # ...which we see once we reconnect.
+    spool.refresh()
+    assert not spool.is_empty()
+
+    other.drain(lambda batch: None)
+    assert other.is_empty()
+    assert not spool.is_empty()  # until recheck_interval
+
+    spool.refresh()
+    assert spool.is_empty()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+
+import pytest
+from pioreactor.utils.sqlite_reader import SqliteReader
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = sqlite3.connect(database, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE growth_rates (pioreactor_unit TEXT, rate REAL)")
+    connection.executemany(
+        "INSERT INTO growth_rates VALUES (?, ?)",
+        [("unit1", 0.1 * i) for i in range(2500)],
+    )
+    yield database, connection
+    connection.close()
+
+
+def test_cache_is_invalidated_by_writes_from_other_connections(database):
+    database, writer = database
+    reader = SqliteReader(database)
+    query = "SELECT COUNT(*) FROM growth_rates"
+
+    assert reader.query(query, cache=True) == [(2500,)]
+    assert reader.query(query, cache=True) == [(2500,)]
+    assert reader.metrics()["cache_hits"] == 1
+
+    writer.execute("INSERT INTO growth_rates VALUES ('unit2', 1.0)")
+
+    assert reader.query(query, cache=True) == [(2501,)]
+    assert reader.metrics()["cache_misses"] == 2
+    reader.close()
+
+
+def test_iterate_streams_all_rows(database):
+    database, _ = database
+    reader = SqliteReader(database)
+
+    rows = reader.iterate("SELECT rate FROM growth_rates ORDER BY rowid", fetch_size=100)
+    assert sum(1 for _ in rows) == 2500
+
+    # the connection went back to the pool.
+    assert reader.metrics()["open_connections"] == 1
+    assert reader.query("SELECT 1") == [(1,)]
+    assert reader.metrics()["open_connections"] == 1
+    reader.close()
+
+
+def test_readers_cant_write(database):
+    database, _ = database
+    reader = SqliteReader(database)
+
+    with pytest.raises(sqlite3.OperationalError):
+        reader.query("DELETE FROM growth_rates")
+    reader.close()
+
+
+def test_pool_is_bounded(database):
+    database, _ = database
+    reader = SqliteReader(database, pool_size=2)
+
+    def run():
+        for _ in range(50):
+            reader.query(
+                "SELECT COUNT(*) FROM growth_rates WHERE pioreactor_unit = ?", ("unit1",)
+            )
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reader.metrics()["open_connections"] <= 2
+    assert reader.metrics()["queries"] == 300
+    reader.close()
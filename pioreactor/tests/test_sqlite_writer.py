@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import time
+from pioreactor.utils.sqlite_writer import SqliteWriter, OVERFLOW, AfterInsert
+
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE t (x INTEGER PRIMARY KEY, source TEXT)")
+    connection.commit()
+    return connection
+
+
+def test_writer_writes_and_counts_failures(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = create_database(database)
+
+    writer = SqliteWriter(database)
+    writer.executemany("INSERT INTO t (x, source) VALUES (?, ?)", [(1, "a"), (2, "a")])
+    writer.execute("INSERT INTO t (x, source) VALUES (?, ?)", (1, "duplicate"))
+    writer.execute("INSERT INTO t (x, source) VALUES (?, ?)", (3, "a"))
+    assert writer.flush(timeout=5)
+
+    metrics = writer.metrics()
+    assert metrics["rows_queued"] == 4
+    assert metrics["rows_written"] == 3
+    assert metrics["rows_failed"] == 1
+
+    writer.close()
+    assert connection.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 3
+
+
+def test_writer_then_sees_only_inserted_rows(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = create_database(database)
+    connection.execute("CREATE TABLE totals (n INTEGER)")
+    connection.execute("INSERT INTO totals (n) VALUES (0)")
+    connection.commit()
+
+    inserted = []
+
+    def count(rows):
+        inserted.extend(rows)
+        return [("UPDATE totals SET n = n + ?", [(len(rows),)])]
+
+    then = AfterInsert("t", ("x", "source"), count)
+    writer = SqliteWriter(database)
+    sql = "INSERT OR IGNORE INTO t (x, source) VALUES (?, ?)"
+    writer.executemany(sql, [(1, "a"), (2, "a")], then=then)
+    writer.executemany(sql, [(2, "duplicate"), (3, "a")], then=then)
+    writer.close()
+
+    assert connection.execute("SELECT n FROM totals").fetchone()[0] == 3
+    assert inserted == [(1, "a"), (2, "a"), (3, "a")]
+
+
+def test_writer_survives_a_failing_then(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = create_database(database)
+
+    def fail(rows):
+        raise ValueError("bad value")
+
+    writer = SqliteWriter(database)
+    sql = "INSERT INTO t (x, source) VALUES (?, ?)"
+    writer.executemany(sql, [(1, "a")], then=AfterInsert("t", ("x",), fail))
+    writer.execute(sql, (2, "a"))
+    assert writer.flush(timeout=5)
+
+    metrics = writer.metrics()
+    assert metrics["rows_failed"] == 1
+    assert metrics["rows_written"] == 1
+
+    writer.execute(sql, (3, "a"))
+    writer.close()
+    assert [x for (x,) in connection.execute("SELECT x FROM t ORDER BY x")] == [2, 3]
+
+
+def test_writer_overflow_policies(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = create_database(database)
+
+    # hold the database lock so the writer falls behind
+    connection.execute("BEGIN EXCLUSIVE")
+
+    writer = SqliteWriter(database, max_queue_size=1)
+    sql = "INSERT INTO t (x, source) VALUES (?, ?)"
+    writer.execute(sql, (1, "in_flight"))
+    time.sleep(0.25)
+
+    writer.execute(sql, (2, "telemetry"), overflow=OVERFLOW.DROP_OLDEST)
+    writer.execute(sql, (3, "telemetry"), overflow=OVERFLOW.DROP_OLDEST)
+    writer.execute(sql, (4, "dosing"), overflow=OVERFLOW.NEVER_DROP)
+    assert writer.metrics()["queue_depth"] == 2
+
+    connection.execute("COMMIT")
+    writer.close()
+
+    assert writer.metrics()["rows_dropped"] == 1
+    assert [x for (x,) in connection.execute("SELECT x FROM t ORDER BY x")] == [1, 3, 4]
+
+
+def test_writer_checkpoints_in_background_and_truncates_when_idle(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    connection = create_database(database)
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    writer = SqliteWriter(database, checkpoint_interval=0.05, checkpoint_idle_after=0.2)
+    for i in range(2000):
+        writer.execute("INSERT INTO t (x, source) VALUES (?, ?)", (i, "a" * 100))
+    assert writer.flush(timeout=5)
+
+    # no automatic checkpoints: the WAL holds everything we wrote
+    assert writer.metrics()["wal_size_bytes"] > 0
+
+    time.sleep(1.0)
+    metrics = writer.metrics()
+    assert metrics["checkpoints"] >= 1
+    assert metrics["checkpoints_truncate"] >= 1
+    assert metrics["max_checkpoint_duration_s"] is not None
+    assert metrics["wal_size_bytes"] == 0
+
+    writer.close()
+    assert connection.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2000
+
+
+def test_writer_restarts_the_wal_only_when_quiet(tmp_path):
+    database = str(tmp_path / "test.sqlite")
+    create_database(database)
+
+    writer = SqliteWriter(
+        database, checkpoint_idle_after=60, max_wal_size=100, force_restart_after=0.2
+    )
+    assert writer._choose_checkpoint_mode(wal_size=10) == "PASSIVE"
+    assert writer._choose_checkpoint_mode(wal_size=1000) == "RESTART"
+
+    # busy: stay PASSIVE, until the WAL has been too large for force_restart_after
+    writer._in_flight = 1
+    assert writer._choose_checkpoint_mode(wal_size=1000) == "PASSIVE"
+    time.sleep(0.25)
+    assert writer._choose_checkpoint_mode(wal_size=1000) == "RESTART"
+    assert writer._choose_checkpoint_mode(wal_size=10) == "PASSIVE"
+
+    writer._in_flight = 0
+    writer.close()
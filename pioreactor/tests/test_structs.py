@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pioreactor import structs
+from pioreactor.background_jobs.leader.mqtt_to_db_streaming import parser_for
+
+
+def test_messages_have_slots_and_round_trip():
+    dosing_event = structs.DosingEvent(
+        volume_change=1.5,
+        event="add_media",
+        source_of_event=None,
+        timestamp="2021-06-01T12:00:00.000000",
+    )
+    assert not hasattr(dosing_event, "__dict__")
+
+    assert structs.DosingEvent.from_json(dosing_event.to_json()) == dosing_event
+    assert structs.decode_bytes(dosing_event.to_bytes()) == dosing_event
+
+    kalman_filter_outputs = structs.KalmanFilterOutputs(
+        state=[1.0, 0.1], covariance_matrix=[[1.0, 0.0], [0.0, 1.0]], timestamp="t"
+    )
+    assert structs.decode_bytes(kalman_filter_outputs.to_bytes()) == kalman_filter_outputs
+
+
+def test_decoding_converts_and_checks_payloads():
+    growth_rate = structs.GrowthRate.from_json(
+        '{"growth_rate": "0.25", "timestamp": "t"}'
+    )
+    assert growth_rate.growth_rate == 0.25
+
+    with pytest.raises(structs.SchemaError, match="missing `timestamp`"):
+        structs.GrowthRate.from_json('{"growth_rate": 0.25}')
+
+    with pytest.raises(structs.SchemaError):
+        structs.GrowthRate.from_json('{"growth_rate": "fast", "timestamp": "t"}')
+
+    with pytest.raises(structs.SchemaError):
+        structs.ODReadings.from_json('{"od_raw": [], "timestamp": "t"}')
+
+
+def test_parsers_map_messages_to_rows():
+    parse = parser_for(structs.ODFiltered)
+    row = parse(
+        "pioreactor/unit1/exp1/growth_rate_calculating/od_filtered/0",
+        b'{"od_filtered": 1.2, "angle": "90", "timestamp": "t", "source": "growth_rate_calculating", "seq": 3}',
+        "pioreactor/unit1/exp1/growth_rate_calculating/od_filtered/0".split("/"),
+    )
+    assert row == {
+        "experiment": "exp1",
+        "pioreactor_unit": "unit1",
+        "normalized_od_reading": 1.2,
+        "angle": "90",
+        "timestamp": "t",
+        "source": "growth_rate_calculating",
+        "seq": 3,
+        "channel": "0",
+    }
+    assert parse("", b"", [""]) is None
+
+    # every table's message type maps to that table's columns
+    assert structs.TABLES["pid_logs"] is structs.PIDStats
+    assert "K0" not in dict(structs.PIDStats._columns)
+
+
+def test_row_mappings_match_the_database_tables():
+    import sqlite3
+    from pioreactor.utils.log_store import CREATE_LOGS_SQL
+
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(open("sql/create_tables.sql").read())
+    connection.executescript(CREATE_LOGS_SQL)
+
+    for table, message_type in structs.TABLES.items():
+        table_columns = {
+            row[1] for row in connection.execute(f"PRAGMA table_info({table})")
+        }
+        columns = {column for _, column in message_type._columns}
+        columns |= {column for column, _ in message_type._topic_columns}
+        assert columns | {"experiment", "pioreactor_unit", "timestamp"} <= table_columns
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+from pioreactor.background_jobs.leader.time_series_cache import (
+    RingBuffer,
+    TimeSeriesStore,
+    handle_query,
+)
+
+
+def test_ring_buffer_keeps_the_latest_values_in_order():
+    buffer = RingBuffer(capacity=5)
+    for i in range(8):
+        buffer.append(float(i), i * 10)
+
+    times, values = buffer.window()
+    assert times.tolist() == [3, 4, 5, 6, 7]
+    assert values.tolist() == [30, 40, 50, 60, 70]
+
+    times, values = buffer.window(since=5.5)
+    assert times.tolist() == [6, 7]
+
+    # out of order values are ignored
+    buffer.append(1.0, -1)
+    assert buffer.window()[0].tolist() == [3, 4, 5, 6, 7]
+
+
+def test_store_query_filters_and_downsamples():
+    store = TimeSeriesStore(hours=1, capacity=10_000)
+    now = time.time()
+
+    for i in range(5_000):
+        t = now - 5_000 + i
+        store.append("exp", "unit1", "growth_rates", t, 0.1)
+        store.append("exp", "unit2", "growth_rates", t, 0.2)
+        store.append("exp", "unit1", "od_readings_filtered/A0", t, 1.0)
+        store.append("other_exp", "unit1", "growth_rates", t, 0.3)
+
+    result = store.query("exp", units=["unit1"], series=["growth_rates"])
+    assert list(result) == ["unit1"]
+    assert list(result["unit1"]) == ["growth_rates"]
+    # only the last hour
+    assert 3_599 <= len(result["unit1"]["growth_rates"]["x"]) <= 3_601
+
+    result = handle_query(store, "experiment=exp&points=100")
+    assert set(result) == {"unit1", "unit2"}
+    assert len(result["unit1"]["od_readings_filtered/A0"]["y"]) == 100
+
+    with pytest.raises(ValueError):
+        handle_query(store, "unit=unit1")
+
+
+def test_store_drops_stale_series():
+    store = TimeSeriesStore(hours=1)
+    store.append("old_exp", "unit1", "growth_rates", time.time() - 2 * 60 * 60, 0.1)
+    store.append("exp", "unit1", "growth_rates", time.time(), 0.1)
+
+    store.drop_stale()
+
+    assert store.query("old_exp") == {}
+    assert list(store.query("exp")) == ["unit1"]
@@ -75,19 +75,18 @@ def pio_jobs_running():
     return jobs
 
 
-def execute_query_against_db(query):
+def execute_query_against_db(query, params=(), cache=False):
+    """
+    Read-only. Uses a pool of connections shared in this process, see utils/sqlite_reader.py. With
+    cache=True, identical queries are served from a cache until the database is next written to.
+    """
     if not am_I_leader():
         raise IOError("Need to be leader to run this.")
 
-    import sqlite3
+    from pioreactor.utils.sqlite_reader import get_reader
     from pioreactor.config import config
 
-    conn = sqlite3.connect(config["storage"]["database"])
-    cur = conn.cursor()
-    cur.execute(query)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return get_reader(config["storage"]["database"]).query(query, params, cache=cache)
 
 
 def pump_ml_to_duration(ml, duty_cycle, duration_=0):
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampling of time series for charts.
+"""
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: reduce (x, y) to n_out points that keep the visual shape of the series
+    (peaks and troughs survive, unlike with averaging or taking every k-th point). x must be sorted.
+
+    Returns (x, y) as arrays. The first and last points are always kept.
+
+    Reference: Sveinn Steinarsson, "Downsampling Time Series for Visual Representation", 2013.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.shape[0]
+
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # the points between the first and last are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # every bucket's average, at once. The point chosen from a bucket depends on the one chosen from the bucket
+    # before it, so that part stays a loop, but over buckets, not points.
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[: n - 1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[: n - 1], edges[:-1]) / counts
+    # the "next bucket" of the last bucket is the last point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # choose the point making the largest triangle with the previously selected point and the next bucket's average
+        areas = np.abs(
+            (x[previous] - next_x[i]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y[i] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return x[selected], y[selected]
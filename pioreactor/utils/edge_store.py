@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+An optional SQLite store, on each worker, of the telemetry it produces (OD, growth rate, dosing events and temperature).
+Enable it with:
+
+    [edge_store]
+    enabled=1
+
+Every message on EDGE_TOPICS is recorded with a sequence number, increasing per unit. Messages published while the
+leader is reachable are recorded as synced. Otherwise publishing returns immediately (instead of retrying, or
+using the spool), and the message is left unsynced.
+
+The monitor job uploads unsynced messages to the leader in zlib compressed batches, on
+`pioreactor/<unit>/$experiment/edge_sync/batch`. The leader's streamer ingests them like live messages, skipping
+sequence numbers it has already seen (so re-sends are harmless), and replies with the highest sequence number it has
+stored, on the retained `pioreactor/<unit>/$experiment/edge_sync/watermark`. Messages up to the watermark are
+then marked synced, and synced messages are deleted after `keep_days`.
+"""
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+EDGE_TOPICS = [
+    "pioreactor/+/+/od_reading/od_raw/+",
+    "pioreactor/+/+/growth_rate_calculating/od_filtered/+",
+    "pioreactor/+/+/growth_rate_calculating/growth_rate",
+    "pioreactor/+/+/dosing_events",
+    "pioreactor/+/+/temperature_control/temperature",
+]
+
+CREATE_EDGE_SQL = """
+CREATE TABLE IF NOT EXISTS edge_messages (
+    seq                    INTEGER  PRIMARY KEY AUTOINCREMENT,
+    recorded_at            REAL     NOT NULL,
+    topic                  TEXT     NOT NULL,
+    payload                BLOB,
+    synced                 INTEGER  NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS edge_messages_unsynced_ix ON edge_messages (seq) WHERE synced = 0;
+"""
+
+# seq, topic length, payload length
+BATCH_RECORD_HEADER = struct.Struct("<qII")
+
+
+def encode_batch(rows):
+    """
+    rows: list of (seq, topic, payload bytes). Returns the zlib compressed batch.
+    """
+    parts = []
+    for seq, topic, payload in rows:
+        topic_bytes = topic.encode("utf-8")
+        payload = payload or b""
+        parts.append(BATCH_RECORD_HEADER.pack(seq, len(topic_bytes), len(payload)))
+        parts.append(topic_bytes)
+        parts.append(payload)
+    return zlib.compress(b"".join(parts))
+
+
+def decode_batch(batch):
+    data = zlib.decompress(batch)
+    rows, offset = [], 0
+    while offset < len(data):
+        seq, topic_length, payload_length = BATCH_RECORD_HEADER.unpack_from(data, offset)
+        offset += BATCH_RECORD_HEADER.size
+        topic = data[offset : offset + topic_length].decode("utf-8")
+        offset += topic_length
+        rows.append((seq, topic, data[offset : offset + payload_length]))
+        offset += payload_length
+    return rows
+
+
+class EdgeStore:
+    """
+    Example
+    ---------
+
+    > store = EdgeStore("/home/pi/.pioreactor/edge.sqlite")
+    > store.record("pioreactor/unit1/exp1/growth_rate_calculating/growth_rate", payload, synced=False)
+    > store.unsynced(after_seq=0, limit=1000)
+    [(1, "pioreactor/unit1/exp1/growth_rate_calculating/growth_rate", b'{"growth_rate": ...}')]
+    > store.mark_synced(up_to_seq=1)
+
+    """
+
+    def __init__(self, database):
+        self.database = database
+        # jobs publish from many threads.
+        self._connection = sqlite3.connect(
+            database, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous = 1")
+        self._connection.executescript(CREATE_EDGE_SQL)
+        self._lock = threading.Lock()
+
+    def record(self, topic, payload, synced):
+        from pioreactor.utils.spool import encode_payload
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO edge_messages (recorded_at, topic, payload, synced) VALUES (?, ?, ?, ?)",
+                (time.time(), topic, encode_payload(payload), int(synced)),
+            )
+
+    def unsynced(self, after_seq=0, limit=1000):
+        with self._lock:
+            return self._connection.execute(
+                """SELECT seq, topic, payload FROM edge_messages
+                WHERE synced = 0 AND seq > ? ORDER BY seq LIMIT ?""",
+                (after_seq, limit),
+            ).fetchall()
+
+    def mark_synced(self, up_to_seq):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE edge_messages SET synced = 1 WHERE synced = 0 AND seq <= ?",
+                (up_to_seq,),
+            )
+
+    def continue_after(self, seq):
+        """
+        Make sure new sequence numbers are greater than seq, ex: the leader's watermark, if this store was
+        recreated. Otherwise the leader would skip its messages as already seen.
+        """
+        with self._lock:
+            updated = self._connection.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'edge_messages'",
+                (seq,),
+            ).rowcount
+            if not updated:
+                self._connection.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('edge_messages', ?)",
+                    (seq,),
+                )
+
+    def prune(self, keep_days):
+        with self._lock:
+            return self._connection.execute(
+                "DELETE FROM edge_messages WHERE synced = 1 AND recorded_at < ?",
+                (time.time() - keep_days * 24 * 60 * 60,),
+            ).rowcount
+
+    def n_unsynced(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM edge_messages WHERE synced = 0"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def is_edge_store_enabled():
+    from pioreactor.config import config
+
+    return config.getboolean("edge_store", "enabled", fallback=False)
+
+
+@lru_cache(maxsize=512)
+def is_edge_topic(topic):
+    from paho.mqtt.client import topic_matches_sub
+
+    return any(topic_matches_sub(pattern, topic) for pattern in EDGE_TOPICS)
+
+
+@lru_cache(1)
+def get_edge_store():
+    from pioreactor.config import config
+
+    return EdgeStore(
+        config.get(
+            "storage", "edge_database", fallback="/home/pi/.pioreactor/edge.sqlite"
+        )
+    )
+
+
+def sync_edge_store(store, publish_batch, watermark, batch_size=1000, max_batches=10):
+    """
+    Send unsynced messages after `watermark`, oldest first, in batches. `publish_batch(batch, last_seq)` sends an
+    encoded batch, and returns the leader's new watermark once it has stored it (or None if it didn't reply in time,
+    in which case we stop, and the same messages are sent again next time). Returns the latest watermark.
+    """
+    for _ in range(max_batches):
+        rows = store.unsynced(after_seq=watermark, limit=batch_size)
+        if not rows:
+            break
+
+        new_watermark = publish_batch(encode_batch(rows), rows[-1][0])
+        if new_watermark is None:
+            break
+
+        store.mark_synced(new_watermark)
+        watermark = max(watermark, new_watermark)
+
+    return watermark
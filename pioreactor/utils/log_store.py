@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+The leader's store of log lines, kept apart from the experiment data: logs get their own SQLite file
+([storage] log_database) and their own writer, so a chatty job can't slow down or fill the queue in front of
+OD readings and dosing events.
+
+Before they are written, log lines can be thinned, per [storage.logs] in config.ini:
+
+    [storage.logs]
+    # fraction of lines to keep, per level. WARNING and above are always kept.
+    sample.DEBUG=0.1
+    # lines per second (and burst) allowed per (unit, task), for levels below WARNING.
+    rate_limit=10
+    rate_limit_burst=50
+
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+
+from pioreactor.config import config
+from pioreactor.utils.sqlite_writer import SqliteWriter, OVERFLOW
+
+LOG_COLUMNS = (
+    "timestamp",
+    "timestamp_epoch",
+    "experiment",
+    "message",
+    "pioreactor_unit",
+    "source",
+    "level",
+    "task",
+)
+
+CREATE_LOGS_SQL = """
+CREATE TABLE IF NOT EXISTS logs (
+    timestamp              TEXT  NOT NULL,
+    timestamp_epoch        REAL,
+    experiment             TEXT  NOT NULL,
+    message                TEXT  NOT NULL,
+    pioreactor_unit        TEXT  NOT NULL,
+    source                 TEXT  NOT NULL,
+    level                  TEXT,
+    task                   TEXT
+);
+
+CREATE INDEX IF NOT EXISTS logs_timestamp_ix ON logs (timestamp);
+CREATE INDEX IF NOT EXISTS logs_ix ON logs (experiment, pioreactor_unit, timestamp);
+"""
+
+# levels that are never sampled or rate limited
+ALWAYS_KEPT_LEVELS = {"WARNING", "ERROR", "CRITICAL"}
+
+
+def get_log_database():
+    return config.get(
+        "storage", "log_database", fallback="/home/pi/.pioreactor/logs.sqlite"
+    )
+
+
+def create_log_database(database):
+    import sqlite3
+
+    connection = sqlite3.connect(database, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous = 1")
+    connection.executescript(CREATE_LOGS_SQL)
+    connection.close()
+
+
+class LogStore:
+    """
+    Example
+    ---------
+
+    > store = LogStore(get_log_database())
+    > store.add({"timestamp": ..., "experiment": ..., "message": ..., "pioreactor_unit": ..., "source": "app", "level": "DEBUG", "task": "stirring"})
+    > store.metrics()
+    {"lines_kept": 1, "lines_sampled_out": 0, "lines_rate_limited": 0, "rows_written": ...}
+    > store.close()
+
+    """
+
+    def __init__(self, database):
+        create_log_database(database)
+        self.writer = SqliteWriter(database, max_queue_size=1000)
+
+        self.sample_rates = {
+            key[len("sample.") :].upper(): float(value)
+            for key, value in (
+                config["storage.logs"].items()
+                if config.has_section("storage.logs")
+                else []
+            )
+            if key.startswith("sample.")
+        }
+        self.rate_limit = config.getfloat("storage.logs", "rate_limit", fallback=10.0)
+        self.rate_limit_burst = config.getfloat(
+            "storage.logs", "rate_limit_burst", fallback=50.0
+        )
+
+        # (unit, task) -> [tokens, last refill time]
+        self._buckets = defaultdict(lambda: [self.rate_limit_burst, time.monotonic()])
+        self._lock = threading.Lock()
+        self._counters = {
+            "lines_kept": 0,
+            "lines_sampled_out": 0,
+            "lines_rate_limited": 0,
+        }
+
+    def add(self, row):
+        """
+        row is a dict of the `logs` columns. Returns whether the line was kept.
+        """
+        level = (row.get("level") or "").upper()
+
+        with self._lock:
+            if level not in ALWAYS_KEPT_LEVELS:
+                if random.random() >= self.sample_rates.get(level, 1.0):
+                    self._counters["lines_sampled_out"] += 1
+                    return False
+
+                if not self._take_token((row["pioreactor_unit"], row.get("task"))):
+                    self._counters["lines_rate_limited"] += 1
+                    return False
+
+            self._counters["lines_kept"] += 1
+
+        if row.get("timestamp_epoch") is None:
+            from pioreactor.actions.leader.migrate_database import to_epoch
+
+            row = {**row, "timestamp_epoch": to_epoch(row["timestamp"])}
+
+        # dropping the oldest waiting log lines is better than making anyone wait.
+        self.writer.execute(
+            f"INSERT INTO logs ({', '.join(LOG_COLUMNS)}) VALUES ({', '.join(['?'] * len(LOG_COLUMNS))})",
+            tuple(row.get(c) for c in LOG_COLUMNS),
+            overflow=OVERFLOW.DROP_OLDEST,
+        )
+        return True
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, **self.writer.metrics()}
+
+    def close(self):
+        self.writer.close()
+
+    def _take_token(self, key):
+        # token bucket: refills at rate_limit tokens per second, up to rate_limit_burst.
+        bucket = self._buckets[key]
+        now = time.monotonic()
+        bucket[0] = min(
+            self.rate_limit_burst, bucket[0] + (now - bucket[1]) * self.rate_limit
+        )
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        return False
+
+
+def query_logs(
+    experiment=None,
+    units=(),
+    levels=(),
+    task=None,
+    since=None,
+    until=None,
+    limit=100,
+    database=None,
+):
+    """
+    The most recent `limit` log lines matching the filters, oldest first, as dicts. For the UI and `pio logs`.
+    since and until are UTC timestamps, ex: "2021-06-01T12:00:00".
+    """
+    from pioreactor.utils.sqlite_reader import get_reader
+
+    conditions, params = [], []
+    if experiment is not None:
+        conditions.append("experiment = ?")
+        params.append(experiment)
+    if units:
+        conditions.append(f"pioreactor_unit IN ({', '.join(['?'] * len(units))})")
+        params.extend(units)
+    if levels:
+        conditions.append(f"UPPER(level) IN ({', '.join(['?'] * len(levels))})")
+        params.extend(level.upper() for level in levels)
+    if task is not None:
+        conditions.append("task = ?")
+        params.append(task)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    columns = [c for c in LOG_COLUMNS if c != "timestamp_epoch"]
+    rows = get_reader(database or get_log_database()).query(
+        f"SELECT {', '.join(columns)} FROM logs {where} ORDER BY timestamp DESC LIMIT ?",
+        tuple(params) + (limit,),
+    )
+    return [dict(zip(columns, row)) for row in reversed(rows)]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary storage of vectors and matrices (ex: the Kalman filter's state and covariance matrix) in the database.
+
+A blob is an 8 byte header followed by the values, little-endian:
+
+    version (uint8), dtype (uint8), flags (uint8), padding (uint8), rows (uint16), cols (uint16)
+
+cols is 0 for vectors. If the UPPER_TRIANGLE flag is set, only the upper triangle (including the diagonal) of
+a symmetric matrix is stored, row by row.
+
+Older rows stored these values as JSON text; the decoders below accept those, too.
+"""
+import json
+import struct
+
+import numpy as np
+
+VERSION = 1
+HEADER = struct.Struct("<BBBxHH")
+
+DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f8")}
+DTYPE_CODES = {"float32": 0, "float64": 1}
+
+UPPER_TRIANGLE = 1
+
+
+def pack_array(values, dtype="float64", upper_triangle=False):
+    array = np.asarray(values)
+    if array.ndim == 1:
+        rows, cols = array.shape[0], 0
+        data = array
+    elif array.ndim == 2:
+        rows, cols = array.shape
+        if upper_triangle:
+            assert rows == cols, "upper_triangle requires a square matrix."
+            data = array[np.triu_indices(rows)]
+        else:
+            data = array.ravel()
+    else:
+        raise ValueError("Only vectors and matrices can be packed.")
+
+    flags = UPPER_TRIANGLE if (upper_triangle and cols) else 0
+    return (
+        HEADER.pack(VERSION, DTYPE_CODES[dtype], flags, rows, cols)
+        + data.astype(DTYPES[DTYPE_CODES[dtype]]).tobytes()
+    )
+
+
+def _is_legacy_json(blob):
+    return isinstance(blob, str) or blob[:1] == b"["
+
+
+def unpack_array(blob):
+    """
+    blob (or legacy JSON) -> np.ndarray (float64)
+    """
+    if _is_legacy_json(blob):
+        return np.array(json.loads(blob), dtype=float)
+
+    _, dtype_code, flags, rows, cols = HEADER.unpack_from(blob)
+    data = np.frombuffer(blob, dtype=DTYPES[dtype_code], offset=HEADER.size).astype(float)
+
+    if cols == 0:
+        return data
+    elif flags & UPPER_TRIANGLE:
+        matrix = np.empty((rows, cols))
+        i, j = np.triu_indices(rows)
+        matrix[i, j] = data
+        matrix[j, i] = data
+        return matrix
+    else:
+        return data.reshape(rows, cols)
+
+
+def unpack_arrays(blobs):
+    """
+    Decode a whole column of blobs (ex: from cursor.fetchall()) into one array of shape (n, rows) for vectors,
+    or (n, rows, cols) for matrices.
+
+    When every blob shares the same header (the common case), this decodes without a Python loop: the blobs are
+    concatenated and viewed as a single (n, blob_size) buffer.
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0,))
+
+    first = blobs[0]
+    if _is_legacy_json(first) or any(
+        _is_legacy_json(b)
+        or len(b) != len(first)
+        or b[: HEADER.size] != first[: HEADER.size]
+        for b in blobs
+    ):
+        # mixed headers, or legacy rows: decode one at a time.
+        return np.stack([unpack_array(b) for b in blobs])
+
+    _, dtype_code, flags, rows, cols = HEADER.unpack_from(first)
+    buffer = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(
+        len(blobs), len(first)
+    )
+    data = (
+        np.ascontiguousarray(buffer[:, HEADER.size :])
+        .view(DTYPES[dtype_code])
+        .astype(float)
+    )
+
+    if cols == 0:
+        return data
+    elif flags & UPPER_TRIANGLE:
+        matrices = np.empty((len(blobs), rows, cols))
+        i, j = np.triu_indices(rows)
+        matrices[:, i, j] = data
+        matrices[:, j, i] = data
+        return matrices
+    else:
+        return data.reshape(len(blobs), rows, cols)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampled rollups of high-rate time series, for charts and exports over long experiments.
+
+For each source table below, and each bucket size, there is a table `<source>_rollup_<bucket>`
+with one row per (experiment, pioreactor_unit, [channel], bucket) storing the min, max, mean and count
+of the source's value column. The streamer keeps these up to date as it writes rows (see `rollup_upserts`), and
+`pio run backfill_rollups` (re)computes them from the raw tables.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+RollupSource = namedtuple("RollupSource", ["value_column", "key_columns"])
+
+# source table -> value to aggregate, and the columns (besides experiment and unit) to group by.
+ROLLUP_SOURCES = {
+    "od_readings_raw": RollupSource("od_reading_v", ("channel",)),
+    "od_readings_filtered": RollupSource("normalized_od_reading", ("channel",)),
+    "growth_rates": RollupSource("rate", ()),
+    "temperature_readings": RollupSource("temperature_c", ()),
+}
+
+# bucket name -> bucket size in seconds
+BUCKETS = {"1m": 60, "15m": 15 * 60}
+
+
+def rollup_table(table, bucket):
+    return f"{table}_rollup_{bucket}"
+
+
+def choose_source(table, duration, points):
+    """
+    The coarsest table to read `points` points, over `duration` seconds, of `table` from: the rollup with the
+    largest buckets that still has at least `points` buckets in the duration, else the raw table. Returns
+    (table, time column, value column).
+    """
+    for bucket, bucket_size in sorted(BUCKETS.items(), key=lambda kv: -kv[1]):
+        if duration / bucket_size >= points:
+            return rollup_table(table, bucket), "bucket_epoch", "mean"
+    return table, "timestamp_epoch", ROLLUP_SOURCES[table].value_column
+
+
+def _group_columns(table):
+    return ("experiment", "pioreactor_unit") + ROLLUP_SOURCES[table].key_columns
+
+
+def create_rollup_tables_sql():
+    """
+    DDL for all rollup tables. Mirrors what's in sql/create_tables.sql.
+    """
+    statements = []
+    for table, source in ROLLUP_SOURCES.items():
+        key_columns_ddl = "".join(
+            f"    {c} INTEGER NOT NULL,\n" for c in source.key_columns
+        )
+        primary_key = ", ".join(_group_columns(table) + ("bucket_epoch",))
+        for bucket in BUCKETS:
+            statements.append(
+                f"""CREATE TABLE IF NOT EXISTS {rollup_table(table, bucket)} (
+    experiment TEXT NOT NULL,
+    pioreactor_unit TEXT NOT NULL,
+{key_columns_ddl}    bucket_epoch INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    mean REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY ({primary_key})
+);"""
+            )
+    return statements
+
+
+def _upsert_sql(table, bucket):
+    group_columns = _group_columns(table)
+    columns = group_columns + ("bucket_epoch", "timestamp", "min", "max", "mean", "count")
+    return f"""
+        INSERT INTO {rollup_table(table, bucket)} ({", ".join(columns)})
+        VALUES ({", ".join(["?"] * len(columns))})
+        ON CONFLICT ({", ".join(group_columns + ("bucket_epoch",))}) DO UPDATE SET
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max),
+            mean = (mean * count + excluded.mean * excluded.count) / (count + excluded.count),
+            count = count + excluded.count"""
+
+
+def rollup_upserts(table, columns, rows):
+    """
+    Aggregate a batch of rows about to be inserted into `table` into per-bucket partial aggregates, and
+    return a list of (sql, params) to merge them into the rollup tables (for use with executemany).
+    Rows need a timestamp_epoch column. Tables without rollups return [].
+    """
+    if table not in ROLLUP_SOURCES:
+        return []
+
+    source = ROLLUP_SOURCES[table]
+    group_indexes = [columns.index(c) for c in _group_columns(table)]
+    value_index = columns.index(source.value_column)
+    epoch_index = columns.index("timestamp_epoch")
+
+    upserts = []
+    for bucket, bucket_size in BUCKETS.items():
+        aggregates = {}  # (group values..., bucket_epoch) -> [min, max, sum, count]
+        for row in rows:
+            bucket_epoch = int(row[epoch_index] // bucket_size) * bucket_size
+            key = tuple(row[i] for i in group_indexes) + (bucket_epoch,)
+            value = row[value_index]
+
+            if key in aggregates:
+                aggregate = aggregates[key]
+                aggregate[0] = min(aggregate[0], value)
+                aggregate[1] = max(aggregate[1], value)
+                aggregate[2] += value
+                aggregate[3] += 1
+            else:
+                aggregates[key] = [value, value, value, 1]
+
+        params = [
+            key
+            + (
+                datetime.utcfromtimestamp(key[-1]).isoformat(),
+                min_,
+                max_,
+                sum_ / count,
+                count,
+            )
+            for key, (min_, max_, sum_, count) in aggregates.items()
+        ]
+        upserts.append((_upsert_sql(table, bucket), params))
+
+    return upserts
+
+
+def backfill_sql(table, bucket):
+    """
+    SQL to recompute a rollup table for one experiment (parameter: experiment) from its raw table.
+    Run after deleting the experiment's rows from the rollup table.
+    """
+    source = ROLLUP_SOURCES[table]
+    bucket_size = BUCKETS[bucket]
+    group_columns = ", ".join(_group_columns(table))
+    return f"""
+        INSERT INTO {rollup_table(table, bucket)} ({group_columns}, bucket_epoch, timestamp, min, max, mean, count)
+        SELECT
+            {group_columns},
+            CAST(timestamp_epoch / {bucket_size} AS INTEGER) * {bucket_size} as bucket_epoch,
+            strftime('%Y-%m-%dT%H:%M:%S', CAST(timestamp_epoch / {bucket_size} AS INTEGER) * {bucket_size}, 'unixepoch'),
+            MIN({source.value_column}),
+            MAX({source.value_column}),
+            AVG({source.value_column}),
+            COUNT(*)
+        FROM {table}
+        WHERE experiment = ? AND timestamp_epoch IS NOT NULL
+        GROUP BY {group_columns}, bucket_epoch"""
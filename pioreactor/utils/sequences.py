@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Sequence numbers for telemetry, so that the leader can tell a duplicate (a QoS retry, a replayed spool, a re-sent edge
+batch) from a new message, and notice messages that never arrived.
+
+Each (unit, source) has its own sequence, where the source is the job or action publishing. Sequences are allocated
+hi/lo: a process reserves a block of `block_size` numbers on disk, under a lock, and hands them out from memory, so
+disk is touched once per block, not once per message. At exit, the unused part of the block is given back, so the
+next process continues where this one stopped. After a crash, it's skipped: sequences never go backwards, but can
+have gaps. A new sequence (ex: on a new SD card) starts at the current time in milliseconds, above anything the
+unit could have published before under the same name.
+
+    > allocator = get_sequence_allocator("od_reading")
+    > allocator.next()
+    1634650000001
+    > allocator.next()
+    1634650000002
+
+On the leader, a SequenceTracker remembers recent sequence numbers per (unit, source), to skip duplicates before they
+reach the database (where a unique index is the last line of defence), and counts gaps.
+"""
+import atexit
+import fcntl
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+class SequenceAllocator:
+    """
+    Parameters
+    -----------
+    directory: str
+        where the reserved blocks are recorded, one file per source. Created if missing.
+    source: str
+    block_size: int
+        how many numbers to reserve at a time.
+    """
+
+    def __init__(self, directory, source, block_size=1000):
+        self.path = os.path.join(directory, f"{source}.seq")
+        self.block_size = block_size
+
+        self._next = 1
+        self._hi = 0  # the last number of the reserved block
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.release)
+
+    def next(self):
+        with self._lock:
+            if self._next > self._hi:
+                self._reserve()
+            seq = self._next
+            self._next += 1
+            return seq
+
+    def release(self):
+        """
+        Give back the unused part of our block, if no one has reserved a block after it.
+        """
+        with self._lock:
+            if self._next > self._hi:
+                return
+            with self._locked():
+                if self._read() == self._hi:
+                    self._write(self._next - 1)
+            self._hi = self._next - 1
+
+    def _reserve(self):
+        with self._locked():
+            start = self._read() + 1
+            self._hi = start + self.block_size - 1
+            self._write(self._hi)
+        self._next = start
+
+    @contextmanager
+    def _locked(self):
+        # many processes can publish for the same source, ex: two add_media actions.
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return int(time.time() * 1000)
+
+    def _write(self, hi):
+        # write then rename, so a crash can't leave a truncated file behind.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(hi))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+@lru_cache(maxsize=None)
+def get_sequence_allocator(source):
+    from pioreactor.config import config
+
+    return SequenceAllocator(
+        config.get(
+            "storage", "sequence_directory", fallback="/home/pi/.pioreactor/sequences"
+        ),
+        source,
+        block_size=config.getint("storage", "sequence_block_size", fallback=1000),
+    )
+
+
+def sequence(message, source=None):
+    """
+    Give a pioreactor.structs message a new sequence number, before it's published. Every publish is a new message,
+    even of the same object, ex: a dosing event published again while pumping continuously. Messages without a `seq`
+    field, or without a source, are left as they are.
+    """
+    if "seq" not in message.__slots__:
+        return message
+
+    message.source = message.source or source
+    if message.source is not None:
+        message.seq = get_sequence_allocator(message.source).next()
+    return message
+
+
+class SequenceTracker:
+    """
+    Remembers the last `window` sequence numbers seen per (unit, source).
+
+    Example
+    ---------
+
+    > tracker = SequenceTracker()
+    > tracker.is_new("unit1", "od_reading", 1)
+    True
+    > tracker.is_new("unit1", "od_reading", 1)
+    False
+    > tracker.is_new("unit1", "od_reading", 4)  # 2 and 3 are missing, for now
+    True
+    > tracker.metrics()
+    {"duplicates": 1, "gaps": 1, "missing": 2, "late": 0}
+
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        # (unit, source) -> [highest seq, set of recent seqs, deque of the same, for eviction, set of missing seqs]
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._counters = {"duplicates": 0, "gaps": 0, "late": 0}
+
+    def is_new(self, unit, source, seq):
+        with self._lock:
+            key = (unit, source)
+            if key not in self._sources:
+                # the first we've seen (since we started): we can't tell what's missing before it.
+                self._sources[key] = [seq, set(), deque(), set()]
+            highest, seen, order, missing = self._sources[key]
+
+            if seq in seen:
+                self._counters["duplicates"] += 1
+                return False
+
+            if seq > highest + 1:
+                self._counters["gaps"] += 1
+                missing.update(range(max(highest + 1, seq - self.window), seq))
+            elif seq in missing:
+                self._counters["late"] += 1
+                missing.discard(seq)
+
+            self._sources[key][0] = max(highest, seq)
+            seen.add(seq)
+            order.append(seq)
+            if len(order) > self.window:
+                evicted = order.popleft()
+                seen.discard(evicted)
+
+            # seqs that have fallen out of the window aren't coming back.
+            oldest = self._sources[key][0] - self.window
+            if missing and min(missing) <= oldest:
+                missing.difference_update([s for s in missing if s <= oldest])
+            return True
+
+    def metrics(self):
+        """
+        Cumulative counts of duplicates skipped, gaps (a jump in a sequence), and late messages (that filled a gap),
+        and the number of sequence numbers currently missing.
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                "missing": sum(len(s[3]) for s in self._sources.values()),
+            }
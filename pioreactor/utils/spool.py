@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+An on-disk, append-only spool for outbound MQTT messages. When the leader (and hence the broker) is unreachable,
+workers append messages here instead of blocking, and a drainer replays them, in order, once the broker is back.
+
+Layout on disk:
+
+    <directory>/
+        .lock                       # flock'd by writers and the drainer (many processes write to the same spool)
+        000000000001.seg            # closed segment, waiting to be drained
+        000000000001.seg.offset     # byte offset already drained from the segment above (optional)
+        000000000002.seg            # newest segment, writers append here
+
+Each record in a segment is a small header (topic length, payload length, qos, retain) followed by the topic and payload bytes.
+
+"""
+
+import os
+import time
+import struct
+import fcntl
+import atexit
+from contextlib import contextmanager
+
+SEGMENT_SUFFIX = ".seg"
+OFFSET_SUFFIX = ".offset"
+RECORD_HEADER = struct.Struct("<IIBB")
+
+
+def encode_payload(payload):
+    # mirror what paho accepts as a payload
+    if payload is None:
+        return b""
+    elif isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    elif isinstance(payload, str):
+        return payload.encode("utf-8")
+    else:
+        return str(payload).encode("utf-8")
+
+
+class Spool:
+    """
+    Parameters
+    -----------
+    directory: str
+        where segments are stored. Created if missing.
+    max_segment_bytes: int
+        roll over to a new segment after the current one is larger than this.
+    fsync_every: int
+        fsync after this many appends...
+    fsync_interval: float
+        ...or after this many seconds, whichever comes first. Pending appends are fsync'd at exit, too.
+    recheck_interval: float
+        while messages are waiting, seconds between checks of the disk for whether they've been drained (by any process).
+
+    Example
+    ---------
+
+    > spool = Spool("/home/pi/.pioreactor/spool")
+    > spool.append("pioreactor/unit1/exp/dosing_events", payload, qos=2, retain=False)
+    > ...
+    > spool.drain(publish_batch)  # publish_batch accepts a list of (topic, payload, qos, retain), and raises if unable to send
+
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_segment_bytes=1_000_000,
+        fsync_every=20,
+        fsync_interval=2.0,
+        recheck_interval=1.0,
+    ):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.recheck_interval = recheck_interval
+
+        self._file = None
+        self._unsynced_appends = 0
+        self._last_fsync_at = time.monotonic()
+
+        # whether the spool is empty, as of _checked_at. None: unknown, check the disk.
+        self._empty = None
+        self._checked_at = 0.0
+
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.close)
+
+    ########### public #############
+
+    def append(self, topic, payload, qos=0, retain=False):
+        topic_bytes = topic.encode("utf-8")
+        payload_bytes = encode_payload(payload)
+        record = (
+            RECORD_HEADER.pack(len(topic_bytes), len(payload_bytes), qos, int(retain))
+            + topic_bytes
+            + payload_bytes
+        )
+
+        with self._locked():
+            file = self._file_for_appending()
+            file.write(record)
+            file.flush()
+        self._empty = False
+
+        self._unsynced_appends += 1
+        if (self._unsynced_appends >= self.fsync_every) or (
+            time.monotonic() - self._last_fsync_at >= self.fsync_interval
+        ):
+            self.fsync()
+
+    def fsync(self):
+        if self._file is not None and self._unsynced_appends > 0:
+            os.fsync(self._file.fileno())
+        self._unsynced_appends = 0
+        self._last_fsync_at = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.fsync()
+            self._file.close()
+            self._file = None
+
+    def is_empty(self):
+        """
+        Called on every publish, so the disk is only checked the first time, after `refresh`, and, while messages are
+        waiting, every `recheck_interval` seconds.
+        """
+        if (self._empty is None) or (
+            not self._empty
+            and time.monotonic() - self._checked_at >= self.recheck_interval
+        ):
+            self.refresh()
+        return self._empty
+
+    def refresh(self):
+        """
+        Check the disk for waiting messages, ex: spooled by other processes while we were disconnected.
+        """
+        self._empty = all(
+            os.path.getsize(self._path(segment)) == 0 for segment in self._segments()
+        )
+        self._checked_at = time.monotonic()
+
+    def drain(self, publish_batch, batch_size=50):
+        """
+        Replay spooled messages, oldest first. `publish_batch` is called with a list of
+        (topic, payload, qos, retain) tuples, and should raise if it's unable to send them. On failure,
+        we stop and keep the remaining messages for the next drain.
+
+        Returns the number of messages sent.
+        """
+        # roll the newest segment so writers move on to a fresh one, and we can drain the
+        # closed ones without holding the lock.
+        with self._locked():
+            segments = self._segments()
+            if segments and os.path.getsize(self._path(segments[-1])) > 0:
+                self._create_segment(self._segment_number(segments[-1]) + 1)
+            segments = self._segments()[:-1]
+
+        n_sent = 0
+        for segment in segments:
+            offset = self._read_offset(segment)
+            batch, batch_end = [], offset
+
+            for record, record_end in self._read_records(segment, offset):
+                batch.append(record)
+                batch_end = record_end
+
+                if len(batch) >= batch_size:
+                    publish_batch(batch)
+                    n_sent += len(batch)
+                    self._write_offset(segment, batch_end)
+                    batch = []
+
+            if batch:
+                publish_batch(batch)
+                n_sent += len(batch)
+
+            os.remove(self._path(segment))
+            try:
+                os.remove(self._path(segment) + OFFSET_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+        self.refresh()
+        return n_sent
+
+    ########### private #############
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _segments(self):
+        return sorted(s for s in os.listdir(self.directory) if s.endswith(SEGMENT_SUFFIX))
+
+    @staticmethod
+    def _segment_number(segment):
+        return int(segment[: -len(SEGMENT_SUFFIX)])
+
+    def _create_segment(self, number):
+        segment = f"{number:012d}{SEGMENT_SUFFIX}"
+        open(self._path(segment), "ab").close()
+        return segment
+
+    def _file_for_appending(self):
+        # must hold the lock. Other processes (and the drainer) can roll the segment, so
+        # we always append to the newest segment on disk.
+        segments = self._segments()
+        if not segments:
+            newest = self._create_segment(1)
+        else:
+            newest = segments[-1]
+            if os.path.getsize(self._path(newest)) >= self.max_segment_bytes:
+                newest = self._create_segment(self._segment_number(newest) + 1)
+
+        if (self._file is None) or (self._file.name != self._path(newest)):
+            self.close()
+            self._file = open(self._path(newest), "ab")
+
+        return self._file
+
+    def _read_offset(self, segment):
+        try:
+            with open(self._path(segment) + OFFSET_SUFFIX) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, segment, offset):
+        tmp_path = self._path(segment) + OFFSET_SUFFIX + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self._path(segment) + OFFSET_SUFFIX)
+
+    def _read_records(self, segment, offset):
+        with open(self._path(segment), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    # end of segment, or a partial write from a crash - nothing after it is recoverable.
+                    return
+
+                topic_length, payload_length, qos, retain = RECORD_HEADER.unpack(header)
+                body = f.read(topic_length + payload_length)
+                if len(body) < topic_length + payload_length:
+                    return
+
+                topic = body[:topic_length].decode("utf-8")
+                payload = body[topic_length:]
+                yield (topic, payload, qos, bool(retain)), f.tell()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Reads against the (leader's) SQLite database, from a pool of read-only connections.
+
+In WAL mode readers don't block the writer (see sqlite_writer.py), or each other, so the pool lets dashboards
+and CLI tools run queries concurrently without contending with the streamer. Connections are kept open, so
+their prepared statements are reused, and results can be iterated in chunks instead of loaded all at once.
+
+Small, hot queries (ex: the latest experiment, the latest growth rates) can be served from a result cache.
+The cache is invalidated whenever any other connection (ex: the streamer) commits a write, which SQLite
+tells us with `PRAGMA data_version`.
+
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from queue import LifoQueue, Empty
+
+
+class SqliteReader:
+    """
+    Parameters
+    -----------
+    database: str
+        path to the SQLite database
+    pool_size: int
+        maximum number of open connections. Callers wait for a free connection beyond this.
+    cache_size: int
+        number of query results to keep in the result cache.
+
+    Example
+    ---------
+
+    > reader = SqliteReader(config["storage"]["database"])
+    > reader.query("SELECT experiment FROM experiments ORDER BY timestamp DESC LIMIT 1", cache=True)
+    [("exp1",)]
+    > for row in reader.iterate("SELECT * FROM od_readings_raw WHERE experiment=?", ("exp1",)):
+    >     ...
+    > reader.metrics()
+    {"queries": 2, "cache_hits": 0, "cache_misses": 1, "open_connections": 2}
+    > reader.close()
+
+    """
+
+    def __init__(self, database, pool_size=4, cache_size=128):
+        self.database = database
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+
+        self._pool = LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._n_connections = 0
+
+        # a connection used only to ask SQLite if the database has changed.
+        self._version_connection = self._connect()
+        self._version_lock = threading.Lock()
+
+        self._cache = OrderedDict()  # (sql, params) -> (data_version, rows)
+        self._cache_lock = threading.Lock()
+
+        self._counters = {"queries": 0, "cache_hits": 0, "cache_misses": 0}
+        self._counters_lock = threading.Lock()
+
+    ########### public #############
+
+    def query(self, sql, params=(), cache=False):
+        """
+        Run a query and return all its rows. With cache=True, an identical query is answered from the cache
+        until the database is next written to.
+        """
+        self._count("queries")
+        if not cache:
+            with self.connection() as connection:
+                return connection.execute(sql, params).fetchall()
+
+        key = (sql, tuple(params))
+        # read the version _before_ we query, so a write that lands mid-query invalidates our result.
+        version = self.data_version()
+        with self._cache_lock:
+            if key in self._cache and self._cache[key][0] == version:
+                self._cache.move_to_end(key)
+                self._count("cache_hits")
+                return list(self._cache[key][1])
+
+        self._count("cache_misses")
+        with self.connection() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        with self._cache_lock:
+            self._cache[key] = (version, tuple(rows))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return rows
+
+    def iterate(self, sql, params=(), fetch_size=1000):
+        """
+        Yield rows, fetched fetch_size at a time. The connection is held until the iteration is finished (or the
+        generator is closed).
+        """
+        self._count("queries")
+        with self.connection() as connection:
+            cursor = connection.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def data_version(self):
+        with self._version_lock:
+            return self._version_connection.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def connection(self):
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._pool.put(connection)
+
+    def close(self):
+        with self._pool_lock:
+            while True:
+                try:
+                    self._pool.get_nowait().close()
+                except Empty:
+                    break
+                self._n_connections -= 1
+        with self._version_lock:
+            self._version_connection.close()
+
+    def metrics(self):
+        return {**self._counters, "open_connections": self._n_connections}
+
+    ########### private #############
+
+    def _count(self, counter):
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    def _connect(self):
+        # mode=ro: this connection can't write, even by accident.
+        # cached_statements: statements are prepared once and reused
+        connection = sqlite3.connect(
+            f"file:{self.database}?mode=ro",
+            uri=True,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        connection.execute("PRAGMA query_only = 1")
+        return connection
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except Empty:
+            pass
+
+        with self._pool_lock:
+            if self._n_connections < self.pool_size:
+                connection = self._connect()
+                self._n_connections += 1
+                return connection
+
+        # wait for someone to return theirs.
+        return self._pool.get()
+
+
+@lru_cache(maxsize=None)
+def get_reader(database):
+    """
+    The reader for this process, so its connections and cache are shared.
+    """
+    return SqliteReader(database)
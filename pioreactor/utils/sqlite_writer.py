@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+A single thread that owns the (leader's) SQLite connection and performs all writes. Callers
+enqueue statements and return immediately; the writer thread drains the queue, grouping
+everything waiting into one transaction and using `executemany` for each statement.
+
+The queue is bounded. What happens when it's full depends on the statement's overflow policy:
+
+ - BLOCK: the caller waits until there is room (backpressure).
+ - DROP_OLDEST: the oldest queued DROP_OLDEST statement is dropped to make room. Use this for high-rate telemetry.
+ - NEVER_DROP: the statement is queued regardless of the bound. Use this for data we can't lose, ex: dosing events.
+
+Checkpoints: by default SQLite checkpoints the WAL inside whichever commit pushes it over 1000 pages, so every so
+often one write takes much longer than the rest. With `checkpoint_interval` set, the writer turns that off and
+instead checkpoints from its own thread (and connection) every `checkpoint_interval` seconds:
+
+ - PASSIVE while writes are arriving: it copies what it can to the database without blocking the writer.
+ - TRUNCATE once nothing has been written for `checkpoint_idle_after` seconds: the WAL file is reset to zero bytes.
+ - RESTART if the WAL has grown past `max_wal_size` bytes anyway (ex: a long-running reader held it back), so the
+   next writes go to the start of the WAL instead of growing it further. A RESTART blocks the writer while it waits,
+   so it's only done when the queue is empty and nothing is being written. If the WAL stays too large for
+   `force_restart_after` seconds without such a lull, it's done anyway.
+
+The WAL's size is part of `metrics()`.
+
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+
+from pioreactor.logging import create_logger
+
+
+# see SqliteWriter.executemany
+AfterInsert = namedtuple("AfterInsert", ["table", "columns", "callback"])
+
+
+class OVERFLOW:
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    NEVER_DROP = "never_drop"
+
+
+class SqliteWriter:
+    """
+    Parameters
+    -----------
+    database: str
+        path to the SQLite database
+    max_queue_size: int
+        number of statements (each with possibly many rows) allowed to wait in the queue
+    max_statements_per_transaction: int
+        upper bound on how many queued statements are grouped into one transaction.
+    checkpoint_interval: float
+        seconds between WAL checkpoints. If None, SQLite's automatic checkpoints are used instead.
+    checkpoint_idle_after: float
+        seconds without writes after which the WAL is truncated.
+    max_wal_size: int
+        bytes the WAL can grow to before we checkpoint (RESTART) at the next lull in writes, without waiting for it to be idle.
+    force_restart_after: float
+        seconds the WAL can stay over max_wal_size, while writes keep arriving, before we RESTART regardless.
+
+    Example
+    ---------
+
+    > writer = SqliteWriter(config["storage"]["database"])
+    > writer.executemany("INSERT INTO dosing_events (...) VALUES (?, ...)", rows, overflow=OVERFLOW.NEVER_DROP)
+    > writer.metrics()
+    {"rows_queued": 10, "rows_written": 10, "rows_dropped": 0, "rows_failed": 0, "queue_depth": 0}
+    > writer.close()  # writes everything left in the queue
+
+    """
+
+    def __init__(
+        self,
+        database,
+        max_queue_size=1000,
+        max_statements_per_transaction=500,
+        checkpoint_interval=None,
+        checkpoint_idle_after=5.0,
+        max_wal_size=64 * 1024 * 1024,
+        force_restart_after=300.0,
+    ):
+        self.database = database
+        self.max_queue_size = max_queue_size
+        self.max_statements_per_transaction = max_statements_per_transaction
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_idle_after = checkpoint_idle_after
+        self.max_wal_size = max_wal_size
+        self.force_restart_after = force_restart_after
+        self.logger = create_logger("sqlite_writer", to_mqtt=False)
+
+        self._queue = deque()  # of (sql, rows, overflow, then)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._closing = False
+        self._last_write_at = time.monotonic()
+        self._wal_too_large_since = None  # only used by the checkpoint thread
+
+        self._counters = {
+            "rows_queued": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "rows_failed": 0,
+        }
+        self._checkpoint_metrics = {}
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        self._checkpoints_stopped = threading.Event()
+        if self.checkpoint_interval is not None:
+            self._checkpoint_metrics = {
+                "checkpoints": 0,
+                "checkpoints_truncate": 0,
+                "checkpoints_restart": 0,
+                "last_checkpoint_duration_s": None,
+                "max_checkpoint_duration_s": None,
+                # WAL frames the last checkpoint couldn't copy to the database, ex: because a reader needed them
+                "wal_frames_not_checkpointed": None,
+            }
+            self._checkpoint_thread = threading.Thread(
+                target=self._run_checkpoints, daemon=True
+            )
+            self._checkpoint_thread.start()
+
+    ########### public #############
+
+    def execute(self, sql, values=(), overflow=OVERFLOW.BLOCK):
+        self.executemany(sql, [values], overflow=overflow)
+
+    def executemany(self, sql, rows, overflow=OVERFLOW.BLOCK, then=None):
+        """
+        Queue `sql` to be run for each of `rows`. `then` is an optional AfterInsert(table, columns, callback): after
+        `sql` inserts into `table`, the callback is called (in the writer thread) with the rows actually inserted, ex:
+        not ignored by an INSERT OR IGNORE, with their `columns`, and returns a list of (sql, rows) to run in the same
+        transaction.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+
+        with self._condition:
+            if self._closing:
+                raise RuntimeError("SqliteWriter is closed.")
+
+            if len(self._queue) >= self.max_queue_size:
+                if overflow == OVERFLOW.BLOCK:
+                    while len(self._queue) >= self.max_queue_size and not self._closing:
+                        self._condition.wait()
+                    if self._closing:
+                        raise RuntimeError("SqliteWriter is closed.")
+                elif overflow == OVERFLOW.DROP_OLDEST:
+                    if not self._drop_oldest():
+                        # nothing droppable queued - drop this one instead.
+                        self._counters["rows_dropped"] += len(rows)
+                        return
+                elif overflow == OVERFLOW.NEVER_DROP:
+                    pass
+                else:
+                    raise ValueError(f"Unknown overflow policy `{overflow}`.")
+
+            self._queue.append((sql, rows, overflow, then))
+            self._counters["rows_queued"] += len(rows)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything queued so far is written (or failed). Returns False if timeout elapsed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        """
+        Write everything left in the queue, then close the connection.
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+
+        self._checkpoints_stopped.set()
+        if self.checkpoint_interval is not None:
+            self._checkpoint_thread.join()
+        self._thread.join()  # closing the last connection checkpoints what's left.
+
+    def metrics(self):
+        with self._condition:
+            metrics = {
+                **self._counters,
+                **self._checkpoint_metrics,
+                "queue_depth": len(self._queue),
+                "rows_in_queue": sum(len(rows) for (_, rows, _, _) in self._queue),
+            }
+        if self.checkpoint_interval is not None:
+            metrics["wal_size_bytes"] = self._wal_size()
+        return metrics
+
+    ########### private #############
+
+    def _drop_oldest(self):
+        # must hold self._condition
+        for i, (_, rows, overflow, _) in enumerate(self._queue):
+            if overflow == OVERFLOW.DROP_OLDEST:
+                del self._queue[i]
+                self._counters["rows_dropped"] += len(rows)
+                return True
+        return False
+
+    def _next_batch(self):
+        # blocks until there is work, or we are closing and the queue is empty (returns [])
+        with self._condition:
+            while not self._queue and not self._closing:
+                self._condition.wait()
+
+            batch = []
+            while self._queue and len(batch) < self.max_statements_per_transaction:
+                batch.append(self._queue.popleft())
+            self._in_flight = len(batch)
+            self._condition.notify_all()  # room in the queue for blocked callers
+            return batch
+
+    def _run(self):
+        # the connection must be created (and used) in this thread
+        # cached_statements: statements are prepared once and reused
+        connection = sqlite3.connect(
+            self.database, timeout=30, isolation_level=None, cached_statements=256
+        )
+        if self.checkpoint_interval is not None:
+            # we checkpoint on our own schedule, see _run_checkpoints
+            connection.execute("PRAGMA wal_autocheckpoint = 0")
+
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+
+            try:
+                written, failed = self._write(connection, batch)
+            except Exception as e:
+                # ex: a ROLLBACK that failed. Whatever happens, the thread must live on: callers wait on it.
+                written, failed = 0, sum(len(rows) for (_, rows, _, _) in batch)
+                self.logger.error(f"Failed to write {failed} rows: {e}")
+                self.logger.debug(e, exc_info=True)
+
+            with self._condition:
+                self._counters["rows_written"] += written
+                self._counters["rows_failed"] += failed
+                self._in_flight = 0
+                self._last_write_at = time.monotonic()
+                self._condition.notify_all()
+
+        connection.close()
+
+    def _write(self, connection, batch):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for sql, rows, _, then in batch:
+                self._execute(cursor, sql, rows, then)
+            cursor.execute("COMMIT")
+            return sum(len(rows) for (_, rows, _, _) in batch), 0
+        except Exception:
+            # an sqlite3.Error, or an error from a `then` callback.
+            if connection.in_transaction:
+                cursor.execute("ROLLBACK")
+
+        # something in the transaction failed. Retry each statement in its own transaction so
+        # one bad row doesn't cost us the rest of the batch.
+        written, failed = 0, 0
+        for sql, rows, _, then in batch:
+            try:
+                cursor.execute("BEGIN")
+                self._execute(cursor, sql, rows, then)
+                cursor.execute("COMMIT")
+                written += len(rows)
+            except Exception as e:
+                if connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                failed += len(rows)
+                self.logger.error(f"Failed to write {len(rows)} rows: {e}")
+                self.logger.debug(f"{sql} with {rows}", exc_info=True)
+        return written, failed
+
+    def _execute(self, cursor, sql, rows, then):
+        if then is None:
+            cursor.executemany(sql, rows)
+            return
+
+        # new rows get rowids above the largest one, and we hold the write lock: they're what's above it afterwards.
+        (max_rowid,) = cursor.execute(f"SELECT MAX(rowid) FROM {then.table}").fetchone()
+        cursor.executemany(sql, rows)
+        inserted = cursor.execute(
+            f"SELECT {', '.join(then.columns)} FROM {then.table} WHERE rowid > ?",
+            (max_rowid or 0,),
+        ).fetchall()
+
+        for then_sql, then_rows in then.callback(inserted):
+            if then_rows:
+                cursor.executemany(then_sql, then_rows)
+
+    def _wal_size(self):
+        try:
+            return os.path.getsize(self.database + "-wal")
+        except OSError:
+            return 0
+
+    def _choose_checkpoint_mode(self, wal_size):
+        now = time.monotonic()
+        with self._condition:
+            quiet = not self._queue and not self._in_flight
+            idle = quiet and now - self._last_write_at >= self.checkpoint_idle_after
+
+        if wal_size <= self.max_wal_size:
+            self._wal_too_large_since = None
+        elif self._wal_too_large_since is None:
+            self._wal_too_large_since = now
+
+        if idle:
+            return "TRUNCATE"
+        elif self._wal_too_large_since is not None and (
+            quiet or now - self._wal_too_large_since >= self.force_restart_after
+        ):
+            return "RESTART"
+        return "PASSIVE"
+
+    def _run_checkpoints(self):
+        # a short timeout: a TRUNCATE or RESTART that can't get the locks quickly gives up, and is tried again next time.
+        connection = sqlite3.connect(
+            self.database, timeout=1, isolation_level=None, check_same_thread=False
+        )
+
+        while not self._checkpoints_stopped.wait(self.checkpoint_interval):
+            wal_size = self._wal_size()
+            if wal_size == 0:
+                continue
+
+            mode = self._choose_checkpoint_mode(wal_size)
+            start = time.monotonic()
+            try:
+                _, wal_frames, checkpointed_frames = connection.execute(
+                    f"PRAGMA wal_checkpoint({mode})"
+                ).fetchone()
+            except sqlite3.Error as e:
+                self.logger.debug(f"{mode} checkpoint failed: {e}")
+                continue
+            duration = time.monotonic() - start
+
+            with self._condition:
+                metrics = self._checkpoint_metrics
+                metrics["checkpoints"] += 1
+                if mode != "PASSIVE":
+                    metrics[f"checkpoints_{mode.lower()}"] += 1
+                metrics["last_checkpoint_duration_s"] = duration
+                metrics["max_checkpoint_duration_s"] = max(
+                    duration, metrics["max_checkpoint_duration_s"] or 0.0
+                )
+                metrics["wal_frames_not_checkpointed"] = max(
+                    wal_frames - checkpointed_frames, 0
+                )
+
+        connection.close()
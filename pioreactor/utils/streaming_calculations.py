@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from json import dumps
 from threading import Timer
 from pioreactor.pubsub import publish
 
@@ -351,20 +350,22 @@ class PID:
 
     def publish_pid_stats(self):
 
-        to_send = {
-            "setpoint": self.pid.setpoint,
-            "output_limits_lb": self.pid.output_limits[0],
-            "output_limits_ub": self.pid.output_limits[1],
-            "Kd": self.pid.Kd,
-            "Ki": self.pid.Ki,
-            "Kp": self.pid.Kp,
-            "K0": self.K0,
-            "integral": self.pid._integral,
-            "proportional": self.pid._proportional,
-            "derivative": self.pid._derivative,
-            "latest_input": self.pid._last_input,
-            "latest_output": self.pid._last_output,
-            "job_name": self.job_name,
-            "target_name": self.target_name,
-        }
-        publish(f"pioreactor/{self.unit}/{self.experiment}/pid_log", dumps(to_send))
+        from pioreactor.structs import PIDStats
+
+        to_send = PIDStats(
+            setpoint=self.pid.setpoint,
+            output_limits_lb=self.pid.output_limits[0],
+            output_limits_ub=self.pid.output_limits[1],
+            Kd=self.pid.Kd,
+            Ki=self.pid.Ki,
+            Kp=self.pid.Kp,
+            K0=self.K0,
+            integral=self.pid._integral,
+            proportional=self.pid._proportional,
+            derivative=self.pid._derivative,
+            latest_input=self.pid._last_input,
+            latest_output=self.pid._last_output,
+            job_name=self.job_name,
+            target_name=self.target_name,
+        )
+        publish(f"pioreactor/{self.unit}/{self.experiment}/pid_log", to_send)
@@ -21,11 +21,11 @@ def get_latest_experiment_name():
     elif is_testing_env():
         return "_testing_experiment"
 
-    from pioreactor.pubsub import subscribe
+    from pioreactor.pubsub import snapshot
 
-    mqtt_msg = subscribe("pioreactor/latest_experiment", timeout=1)
-    if mqtt_msg:
-        return mqtt_msg.payload.decode()
+    retained = snapshot("pioreactor/latest_experiment", deadline=1)
+    if "pioreactor/latest_experiment" in retained:
+        return retained["pioreactor/latest_experiment"].decode()
     else:
         from pioreactor.logging import create_logger
 
@@ -4,11 +4,17 @@ CREATE TABLE IF NOT EXISTS od_readings_raw (
     od_reading_v           REAL     NOT NULL,
     experiment             TEXT     NOT NULL,
     angle                  TEXT     NOT NULL,
-    channel                INTEGER  NOT NULL
+    channel                INTEGER  NOT NULL,
+    timestamp_epoch        REAL,
+    source                 TEXT,
+    seq                    INTEGER
 );
 
 CREATE INDEX IF NOT EXISTS od_readings_raw_ix
-ON od_readings_raw (experiment);
+ON od_readings_raw (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS od_readings_raw_seq_ux
+ON od_readings_raw (pioreactor_unit, source, seq);
 
 
 
@@ -16,11 +22,12 @@ CREATE TABLE IF NOT EXISTS alt_media_fraction (
     timestamp              TEXT  NOT NULL,
     pioreactor_unit        TEXT  NOT NULL,
     alt_media_fraction     REAL  NOT NULL,
-    experiment             TEXT  NOT NULL
+    experiment             TEXT  NOT NULL,
+    timestamp_epoch        REAL
 );
 
 CREATE INDEX IF NOT EXISTS alt_media_fraction_ix
-ON alt_media_fraction (experiment);
+ON alt_media_fraction (experiment, pioreactor_unit, timestamp);
 
 
 
@@ -30,11 +37,17 @@ CREATE TABLE IF NOT EXISTS od_readings_filtered (
     normalized_od_reading  REAL     NOT NULL,
     experiment             TEXT     NOT NULL,
     angle                  TEXT     NOT NULL,
-    channel                INTEGER  NOT NULL
+    channel                INTEGER  NOT NULL,
+    timestamp_epoch        REAL,
+    source                 TEXT,
+    seq                    INTEGER
 );
 
 CREATE INDEX IF NOT EXISTS od_readings_filtered_ix
-ON od_readings_filtered (experiment);
+ON od_readings_filtered (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS od_readings_filtered_seq_ux
+ON od_readings_filtered (pioreactor_unit, source, seq);
 
 
 
@@ -44,9 +57,18 @@ CREATE TABLE IF NOT EXISTS dosing_events (
     event                  TEXT  NOT NULL,
     volume_change_ml       REAL  NOT NULL,
     pioreactor_unit        TEXT  NOT NULL,
-    source_of_event        TEXT
+    source_of_event        TEXT,
+    timestamp_epoch        REAL,
+    source                 TEXT,
+    seq                    INTEGER
 );
 
+CREATE INDEX IF NOT EXISTS dosing_events_ix
+ON dosing_events (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS dosing_events_seq_ux
+ON dosing_events (pioreactor_unit, source, seq);
+
 
 
 CREATE TABLE IF NOT EXISTS led_events (
@@ -56,20 +78,35 @@ CREATE TABLE IF NOT EXISTS led_events (
     channel                TEXT  NOT NULL,
     intensity              REAL  NOT NULL,
     pioreactor_unit        TEXT  NOT NULL,
-    source_of_event        TEXT
+    source_of_event        TEXT,
+    timestamp_epoch        REAL,
+    source                 TEXT,
+    seq                    INTEGER
 );
 
+CREATE INDEX IF NOT EXISTS led_events_ix
+ON led_events (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS led_events_seq_ux
+ON led_events (pioreactor_unit, source, seq);
+
 
 
 CREATE TABLE IF NOT EXISTS growth_rates (
     timestamp              TEXT  NOT NULL,
     experiment             TEXT  NOT NULL,
     rate                   REAL  NOT NULL,
-    pioreactor_unit        TEXT  NOT NULL
+    pioreactor_unit        TEXT  NOT NULL,
+    timestamp_epoch        REAL,
+    source                 TEXT,
+    seq                    INTEGER
 );
 
 CREATE INDEX IF NOT EXISTS growth_rates_ix
-ON growth_rates (experiment);
+ON growth_rates (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS growth_rates_seq_ux
+ON growth_rates (pioreactor_unit, source, seq);
 
 
 
@@ -118,9 +155,13 @@ CREATE TABLE IF NOT EXISTS pid_logs (
     integral               REAL,
     derivative             REAL,
     latest_input           REAL  NOT NULL,
-    latest_output          REAL  NOT NULL
+    latest_output          REAL  NOT NULL,
+    timestamp_epoch        REAL
 );
 
+CREATE INDEX IF NOT EXISTS pid_logs_ix
+ON pid_logs (experiment, pioreactor_unit, timestamp);
+
 
 
 CREATE TABLE IF NOT EXISTS dosing_automation_settings (
@@ -160,22 +201,32 @@ CREATE TABLE IF NOT EXISTS kalman_filter_outputs (
     timestamp                TEXT NOT NULL,
     pioreactor_unit          TEXT NOT NULL,
     experiment               TEXT NOT NULL,
-    state                    TEXT NOT NULL,
-    covariance_matrix        TEXT NOT NULL
+    state                    BLOB NOT NULL,
+    covariance_matrix        BLOB NOT NULL,
+    timestamp_epoch          REAL
 );
 
+CREATE INDEX IF NOT EXISTS kalman_filter_outputs_ix
+ON kalman_filter_outputs (experiment, pioreactor_unit, timestamp);
+
 
 
 CREATE TABLE IF NOT EXISTS temperature_readings (
     timestamp                TEXT  NOT NULL,
     pioreactor_unit          TEXT NOT NULL,
     experiment               TEXT NOT NULL,
-    temperature_c            REAL NOT NULL
+    temperature_c            REAL NOT NULL,
+    timestamp_epoch          REAL,
+    source                   TEXT,
+    seq                      INTEGER
 );
 
 
 CREATE INDEX IF NOT EXISTS temperature_readings_ix
-ON temperature_readings (experiment);
+ON temperature_readings (experiment, pioreactor_unit, timestamp);
+
+CREATE UNIQUE INDEX IF NOT EXISTS temperature_readings_seq_ux
+ON temperature_readings (pioreactor_unit, source, seq);
 
 
 
@@ -183,9 +234,13 @@ CREATE TABLE IF NOT EXISTS stirring_rates (
     timestamp                TEXT NOT NULL,
     pioreactor_unit          TEXT NOT NULL,
     experiment               TEXT NOT NULL,
-    rpm                      REAL NOT NULL
+    rpm                      REAL NOT NULL,
+    timestamp_epoch          REAL
 );
 
+CREATE INDEX IF NOT EXISTS stirring_rates_ix
+ON stirring_rates (experiment, pioreactor_unit, timestamp);
+
 
 
 CREATE TABLE IF NOT EXISTS od_reading_statistics (
@@ -194,5 +249,133 @@ CREATE TABLE IF NOT EXISTS od_reading_statistics (
     experiment               TEXT NOT NULL,
     source                   TEXT NOT NULL,
     estimator                TEXT NOT NULL,
-    estimate                 REAL NOT NULL
+    estimate                 REAL NOT NULL,
+    timestamp_epoch          REAL
+);
+
+CREATE INDEX IF NOT EXISTS od_reading_statistics_ix
+ON od_reading_statistics (experiment, pioreactor_unit, timestamp);
+
+
+-- downsampled rollups, see pioreactor/utils/rollups.py. Maintained by mqtt_to_db_streaming.
+CREATE TABLE IF NOT EXISTS od_readings_raw_rollup_1m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    channel                INTEGER  NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, channel, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS od_readings_raw_rollup_15m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    channel                INTEGER  NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, channel, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS od_readings_filtered_rollup_1m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    channel                INTEGER  NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, channel, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS od_readings_filtered_rollup_15m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    channel                INTEGER  NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, channel, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS growth_rates_rollup_1m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS growth_rates_rollup_15m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS temperature_readings_rollup_1m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, bucket_epoch)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS temperature_readings_rollup_15m (
+    experiment             TEXT     NOT NULL,
+    pioreactor_unit        TEXT     NOT NULL,
+    bucket_epoch           INTEGER  NOT NULL,
+    timestamp              TEXT     NOT NULL,
+    min                    REAL     NOT NULL,
+    max                    REAL     NOT NULL,
+    mean                   REAL     NOT NULL,
+    count                  INTEGER  NOT NULL,
+    PRIMARY KEY (experiment, pioreactor_unit, bucket_epoch)
+);
+
+
+
+-- the highest sequence number stored from each worker's edge store, see pioreactor/utils/edge_store.py
+CREATE TABLE IF NOT EXISTS edge_sync_watermarks (
+    pioreactor_unit        TEXT     PRIMARY KEY,
+    seq                    INTEGER  NOT NULL
 );
@@ -1,3 +1,4 @@
+PRAGMA auto_vacuum = INCREMENTAL; -- must come before any tables are created. Lets archive_experiment return freed pages.
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous = 1; -- recommended when using WAL
 PRAGMA temp_store = 2;  -- stop writing small files to disk, use mem